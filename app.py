@@ -38,6 +38,8 @@ def create_app(script_info: ScriptInfo = None):
     # noinspection PyUnresolvedReferences
     import komidabot.models
     # noinspection PyUnresolvedReferences
+    import komidabot.models_jobs
+    # noinspection PyUnresolvedReferences
     import komidabot.models_training
     # noinspection PyUnresolvedReferences
     import komidabot.models_users
@@ -81,4 +83,9 @@ def create_app(script_info: ScriptInfo = None):
         # noinspection PyCallByClass,PyTypeChecker
         KomidabotApp.__init__(app, app.config)
 
+        if os.environ.get("KOMIDABOT_BACKGROUND_TASKS", "true") == "true":
+            # Not for CLI commands, these would send out the daily menu a second time
+            # noinspection PyCallByClass,PyTypeChecker
+            KomidabotApp.start_background_tasks(app)
+
     return app
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from collections import namedtuple
 from typing import List, Optional, TypedDict
 
@@ -51,6 +52,20 @@ class ConfigType(TypedDict):
 
     COVID19_DISABLED: int
 
+    DAILY_MENU_WINDOW: int
+    DAILY_MENU_SLOTS: int
+    DAILY_MENU_RATE: int
+
+    OUTBOX_WORKERS: int
+
+    TRANSLATION_DEADLINE: float
+
+    BLOB_STORAGE: str
+    BLOB_STORAGE_DIR: str
+    BLOB_STORAGE_BUCKET: Optional[str]
+    BLOB_STORAGE_ENDPOINT: Optional[str]
+    BLOB_STORAGE_PREFIX: str
+
 
 class BaseConfig:
     """Base configuration"""
@@ -74,6 +89,25 @@ class BaseConfig:
 
     COVID19_DISABLED = int(os.getenv('COVID19_DISABLED', '0')) != 0
 
+    # The daily menu is spread out over DAILY_MENU_WINDOW seconds, divided into DAILY_MENU_SLOTS slots that each send at
+    # most DAILY_MENU_RATE messages per second (0 means unlimited)
+    DAILY_MENU_WINDOW = int(os.getenv('DAILY_MENU_WINDOW', '1800'))
+    DAILY_MENU_SLOTS = int(os.getenv('DAILY_MENU_SLOTS', '6'))
+    DAILY_MENU_RATE = int(os.getenv('DAILY_MENU_RATE', '20'))
+
+    # Number of threads delivering queued messages, with 0 messages are sent immediately instead of being queued
+    OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+
+    # Number of seconds a reply waits on translations, after that the original text is used
+    TRANSLATION_DEADLINE = float(os.getenv('TRANSLATION_DEADLINE', '2.0'))
+
+    # Where screenshots are stored, either 'local' for a directory or 's3' for an S3-compatible bucket
+    BLOB_STORAGE = os.getenv('BLOB_STORAGE', 'local')
+    BLOB_STORAGE_DIR = os.getenv('BLOB_STORAGE_DIR', '/var/komidabot_blobs')
+    BLOB_STORAGE_BUCKET = os.getenv('BLOB_STORAGE_BUCKET')
+    BLOB_STORAGE_ENDPOINT = os.getenv('BLOB_STORAGE_ENDPOINT')
+    BLOB_STORAGE_PREFIX = os.getenv('BLOB_STORAGE_PREFIX', '')
+
     # Flask options
     SESSION_REFRESH_EACH_REQUEST = False
 
@@ -118,5 +152,14 @@ class TestingConfig(BaseConfig):
     VERIFY_TOKEN = None
     APP_SECRET = None
 
+    DAILY_MENU_WINDOW = 0
+    DAILY_MENU_SLOTS = 1
+    DAILY_MENU_RATE = 0
+
+    OUTBOX_WORKERS = 0
+
+    BLOB_STORAGE = 'local'
+    BLOB_STORAGE_DIR = os.path.join(tempfile.gettempdir(), 'komidabot_test_blobs')
+
     # Flask-SQLAlchemy options
     SQLALCHEMY_DATABASE_URI = _get_postgres_uri(POSTGRES_HOST, POSTGRES_USER, POSTGRES_PASSWORD, 'komidabot_test')
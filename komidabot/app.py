@@ -14,13 +14,17 @@ class App:
         import atexit
         from concurrent.futures import ThreadPoolExecutor as PyThreadPoolExecutor
 
+        from komidabot.blob_storage import BlobStorage, create_blob_storage
         from komidabot.facebook.api_interface import ApiInterface
         from komidabot.facebook.users import UserManager as FBUserManager
         from komidabot.web.users import UserManager as WebUserManager
         from komidabot.subscriptions.daily_menu import Channel as DailyMenuChannel
         from komidabot.subscriptions import SubscriptionManager
+        from komidabot.jobs import JobRunner
         from komidabot.komidabot import Komidabot
+        from komidabot.outbox import Outbox
         from komidabot.translation import GoogleTranslationService, TranslationService
+        from komidabot.translation_flights import TranslationFlights
         from komidabot.users import UnifiedUserManager, UserId, UserManager
 
         self.logger: logging.Logger
@@ -40,8 +44,19 @@ class App:
 
         self.translator: TranslationService = GoogleTranslationService()
 
+        # Screenshots of learning datapoints are kept out of the database
+        self.blob_storage: BlobStorage = create_blob_storage(config)
+
         self.bot = Komidabot(self)
 
+        self.outbox = Outbox(self, config.get('OUTBOX_WORKERS', 0))
+
+        # Long running jobs, such as admin-triggered menu updates, get their own threads
+        self.job_runner = JobRunner(self, max_workers=1)
+
+        # Translations for replies run in the background, so replies don't wait longer than the deadline
+        self.translation_flights = TranslationFlights(self)
+
         # TODO: This could probably also be moved to the Komidabot class
         self.task_executor = PyThreadPoolExecutor(max_workers=5)
         atexit.register(PyThreadPoolExecutor.shutdown, self.task_executor)  # Ensure cleanup of resources
@@ -57,6 +72,14 @@ class App:
                 from komidabot.models import AppSettings
                 AppSettings.create_entries()
 
+    def start_background_tasks(self):
+        """
+        Starts the scheduled jobs and the outbox workers, this should only be done by the process serving the bot.
+        """
+        self.job_runner.start()
+        self.bot.start(self)
+        self.outbox.start()
+
     def app_context(self):
         raise NotImplementedError()
 
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+__all__ = ['BlobStorage', 'LocalBlobStorage', 'S3BlobStorage', 'create_blob_storage', 'get_blob_key', 'is_blob_key']
+
+STORAGE_LOCAL = 'local'
+STORAGE_S3 = 's3'
+
+_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def get_blob_key(data: bytes) -> str:
+    """
+    Blobs are content-addressed, the key of a blob is the SHA-256 hash of its contents.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_blob_key(key: str) -> bool:
+    return isinstance(key, str) and _KEY_PATTERN.match(key) is not None
+
+
+def _check_key(key: str):
+    if not is_blob_key(key):
+        raise ValueError('Invalid blob key: {!r}'.format(key))
+
+
+class BlobStorage:
+    """
+    Stores immutable blobs, such as screenshots, outside of the database. Storing the same data twice results in a
+    single blob.
+    """
+
+    def put(self, data: bytes) -> str:
+        """
+        Stores a blob, unless a blob with the same contents is already stored.
+        :return: The key of the blob.
+        """
+        if not isinstance(data, bytes):
+            raise ValueError('data expected bytes')
+
+        key = get_blob_key(data)
+
+        if not self.exists(key):
+            self._write(key, data)
+
+        return key
+
+    def get(self, key: str) -> 'Optional[bytes]':
+        """
+        :return: The contents of the blob, or None if no blob with the key exists.
+        """
+        _check_key(key)
+
+        return self._read(key)
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError()
+
+    def _read(self, key: str) -> 'Optional[bytes]':
+        raise NotImplementedError()
+
+    def _write(self, key: str, data: bytes):
+        raise NotImplementedError()
+
+
+class LocalBlobStorage(BlobStorage):
+    """
+    Stores blobs in a local directory, split over subdirectories to keep the size of each directory down.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[0:2], key[2:4], key)
+
+    def exists(self, key: str) -> bool:
+        _check_key(key)
+
+        return os.path.isfile(self._get_path(key))
+
+    def _read(self, key: str) -> 'Optional[bytes]':
+        try:
+            with open(self._get_path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key: str, data: bytes):
+        path = self._get_path(key)
+        directory = os.path.dirname(path)
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first, so a blob is never seen partially written
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+class S3BlobStorage(BlobStorage):
+    """
+    Stores blobs in a bucket of S3 or an S3-compatible service. Credentials are taken from the environment, as usual
+    for boto3.
+    """
+
+    def __init__(self, bucket: str, endpoint_url: str = None, prefix: str = ''):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def exists(self, key: str) -> bool:
+        _check_key(key)
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+
+    def _read(self, key: str) -> 'Optional[bytes]':
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+        return response['Body'].read()
+
+    def _write(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+
+def create_blob_storage(config) -> BlobStorage:
+    storage_type = config.get('BLOB_STORAGE', STORAGE_LOCAL)
+
+    if storage_type == STORAGE_LOCAL:
+        return LocalBlobStorage(config['BLOB_STORAGE_DIR'])
+    if storage_type == STORAGE_S3:
+        return S3BlobStorage(config['BLOB_STORAGE_BUCKET'], config.get('BLOB_STORAGE_ENDPOINT'),
+                             config.get('BLOB_STORAGE_PREFIX', ''))
+
+    raise ValueError('Unknown blob storage: {}'.format(storage_type))
@@ -3,7 +3,6 @@ import hmac
 import json
 import pprint
 import sys
-import time
 import traceback
 from functools import wraps
 
@@ -119,8 +118,6 @@ def handle_facebook_webhook():
 
 
 def _do_handle_facebook_webhook(event, user: FacebookUser, app):
-    time.sleep(0.1)  # Yield
-
     with app.app_context():
         trigger = triggers.Trigger(aspects=[triggers.SenderAspect(user)])
 
@@ -135,6 +132,7 @@ def _do_handle_facebook_webhook(event, user: FacebookUser, app):
         bot: Bot = app.bot
 
         locale = user.get_locale()
+        typing_timer = None
 
         try:
             print('Handling message in new path for {}'.format(user.id), flush=True)
@@ -144,6 +142,7 @@ def _do_handle_facebook_webhook(event, user: FacebookUser, app):
                 message = event['message']
 
                 user.mark_message_seen()
+                typing_timer = user.start_typing_timer()
 
                 # print(pprint.pformat(message, indent=2), flush=True)
 
@@ -192,6 +191,7 @@ def _do_handle_facebook_webhook(event, user: FacebookUser, app):
                 # print(pprint.pformat(event, indent=2), flush=True)
 
                 user.mark_message_seen()
+                typing_timer = user.start_typing_timer()
 
                 if app.config.get('DISABLED'):
                     if not user.is_admin():
@@ -265,6 +265,9 @@ def _do_handle_facebook_webhook(event, user: FacebookUser, app):
 
             user.send_message(TextMessage(trigger, localisation.INTERNAL_ERROR(locale)))
             app.logger.exception(e)
+        finally:
+            if typing_timer is not None:
+                typing_timer.cancel()
 
 
 @blueprint.route('/subscription', methods=['POST'])
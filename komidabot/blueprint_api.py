@@ -2,18 +2,23 @@ import json
 from datetime import date, timedelta
 from typing import Any, Dict, TypedDict, Union
 
-from flask import Blueprint, abort, jsonify, request
+from flask import Blueprint, abort, jsonify, make_response, request, url_for
 from flask_login import current_user, login_required, UserMixin
 from werkzeug.http import HTTP_STATUS_CODES
 
 import komidabot.api_utils as api_utils
+import komidabot.learning_evaluation as learning_evaluation
 import komidabot.messages as messages
 import komidabot.models as models
+import komidabot.screenshots as screenshots
 import komidabot.triggers as triggers
 import komidabot.web.constants as web_constants
 from extensions import db, login
 from komidabot.app import get_app
+from komidabot.blob_storage import is_blob_key
 from komidabot.debug.administration import notify_admins
+from komidabot.jobs import JOB_MENU_UPDATE, job_to_object
+from komidabot.models_jobs import Job
 from komidabot.models_training import LearningDatapoint
 from komidabot.models_users import RegisteredUser
 from komidabot.users import UserId
@@ -154,7 +159,7 @@ def put_subscribe():
 
 @blueprint.route('/trigger', methods=['POST'])
 @api_utils.wrap_exceptions
-@api_utils.expects_schema(input_schema='POST_api_trigger', output_schema='api_response_strict')
+@api_utils.expects_schema(input_schema='POST_api_trigger', output_schema='POST_api_trigger.response')
 @login_required
 def post_trigger():
     class PostData(TypedDict):
@@ -171,22 +176,66 @@ def post_trigger():
             raise RuntimeError('Test exception')
         except RuntimeError as e:
             notify_admins(messages.ExceptionMessage(triggers.Trigger(), e))
+            db.session.commit()
 
         return api_utils.response_ok()
     elif trigger == 'notification_test_text':
         notify_admins(messages.TextMessage(triggers.Trigger(), 'Test notification'))
+        db.session.commit()
 
         return api_utils.response_ok()
     elif trigger == 'menu_update':
-        from komidabot.komidabot import update_menus
-
-        update_menus()
+        job_id, _ = get_app().job_runner.submit(JOB_MENU_UPDATE, {})
 
-        return api_utils.response_ok()
+        return jsonify({'status': 200, 'message': HTTP_STATUS_CODES[200], 'job_id': job_id}), 200
     else:
         return api_utils.response_bad_request()
 
 
+@blueprint.route('/jobs/<int:job_id>', methods=['GET'])
+@api_utils.wrap_exceptions
+@api_utils.expects_schema(output_schema='GET_api_jobs.response')
+@login_required
+def get_job(job_id: int):
+    if not current_user.is_role('admin'):
+        return api_utils.response_unauthorized()
+
+    job = Job.find_by_id(job_id)
+
+    if job is None:
+        return jsonify({'status': 404, 'message': HTTP_STATUS_CODES[404], 'data': None}), 200
+
+    return jsonify({'status': 200, 'message': HTTP_STATUS_CODES[200], 'data': job_to_object(job)}), 200
+
+
+@blueprint.route('/translations/cache', methods=['GET'])
+@api_utils.wrap_exceptions
+@api_utils.expects_schema(output_schema='GET_api_translations_cache.response')
+@login_required
+def get_translation_cache():
+    if not current_user.is_role('admin'):
+        return api_utils.response_unauthorized()
+
+    return jsonify({'status': 200, 'message': HTTP_STATUS_CODES[200],
+                    'data': models.translation_cache.get_stats()}), 200
+
+
+@blueprint.route('/translations/cache', methods=['DELETE'])
+@api_utils.wrap_exceptions
+@api_utils.expects_schema(output_schema='GET_api_translations_cache.response')
+@login_required
+def delete_translation_cache():
+    # Translations changed outside of this process, such as by manage.py import_translations, are only picked up once
+    # they're removed from the cache
+    if not current_user.is_role('admin'):
+        return api_utils.response_unauthorized()
+
+    models.translation_cache.clear()
+
+    return jsonify({'status': 200, 'message': HTTP_STATUS_CODES[200],
+                    'data': models.translation_cache.get_stats()}), 200
+
+
 @blueprint.route('/learning', methods=['GET'])
 @api_utils.wrap_exceptions
 @api_utils.expects_schema(output_schema='GET_api_learning.response')
@@ -200,11 +249,16 @@ def get_learning():
     if datapoint is None:
         return jsonify({'status': 200, 'message': HTTP_STATUS_CODES[200], 'data': None}), 200
 
+    if datapoint.screenshot_hash is None:
+        datapoint.move_screenshot()
+        db.session.commit()
+
     processed = json.loads(datapoint.processed_data)
 
     result = {
         'id': str(datapoint.id),
-        'screenshot': datapoint.screenshot,
+        'screenshot_url': url_for('.get_learning_screenshot', screenshot_hash=datapoint.screenshot_hash),
+        'screenshot_widths': screenshots.VARIANT_WIDTHS,
         'course_name': processed['name']['nl'],
         'course_type': models.CourseType[processed['course_type']].value,
         'course_sub_type': models.CourseSubType[processed['course_sub_type']].value,
@@ -215,6 +269,53 @@ def get_learning():
     return jsonify({'status': 200, 'message': HTTP_STATUS_CODES[200], 'data': result}), 200
 
 
+@blueprint.route('/learning/evaluation', methods=['GET'])
+@api_utils.wrap_exceptions
+@api_utils.expects_schema(output_schema='GET_api_learning_evaluation.response')
+@login_required
+def get_learning_evaluation():
+    if not current_user.is_role('admin'):
+        return api_utils.response_unauthorized()
+
+    return jsonify({'status': 200, 'message': HTTP_STATUS_CODES[200],
+                    'data': learning_evaluation.get_evaluation()}), 200
+
+
+@blueprint.route('/learning/screenshot/<string:screenshot_hash>', methods=['GET'])
+@login_required
+def get_learning_screenshot(screenshot_hash: str):
+    """
+    Serves a screenshot of a learning datapoint. Pass a width from screenshot_widths to get a smaller, recompressed
+    variant. Screenshots never change, so they can be cached indefinitely.
+    """
+    if not current_user.is_role('learner'):
+        abort(403)
+
+    if not is_blob_key(screenshot_hash):
+        abort(404)
+
+    width = request.args.get('width', None, type=int)
+
+    if width is not None and width not in screenshots.VARIANT_WIDTHS:
+        abort(400)
+
+    screenshot = screenshots.get_screenshot(get_app().blob_storage, screenshot_hash, width)
+
+    if screenshot is None:
+        abort(404)
+
+    data, mimetype = screenshot
+
+    response = make_response(data)
+    response.mimetype = mimetype
+    response.set_etag('{}-{}'.format(screenshot_hash, width or 'original'))
+    response.cache_control.private = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+
+    return response.make_conditional(request)
+
+
 @blueprint.route('/learning', methods=['POST'])
 @api_utils.wrap_exceptions
 @api_utils.expects_schema(input_schema='POST_api_learning', output_schema='api_response_strict')
@@ -0,0 +1,480 @@
+import csv
+import datetime
+import itertools
+import json
+import time
+from decimal import Decimal
+from typing import Any, Dict, IO, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import komidabot.models as models
+from extensions import db
+from komidabot.models_training import LearningDatapoint, LearningDatapointSubmission
+from komidabot.util import normalize_text
+
+__all__ = ['FORMAT_CSV', 'FORMAT_JSONL', 'FORMATS', 'BATCH_SIZE', 'get_format', 'read_records', 'write_records',
+           'TRANSLATION_MEMORY_FIELDS', 'TranslationImportResult', 'iter_translation_memory',
+           'import_translation_memory', 'UserImportResult', 'import_dump', 'USER_FIELDS', 'iter_users', 'MENU_FIELDS',
+           'iter_menus', 'LEARNING_DATA_FIELDS', 'iter_learning_data']
+
+FORMAT_CSV = 'csv'
+FORMAT_JSONL = 'jsonl'
+FORMATS = [FORMAT_CSV, FORMAT_JSONL]
+
+BATCH_SIZE = 500
+
+TRANSLATION_MEMORY_FIELDS = ['original_language', 'original_text', 'language', 'translation', 'provider']
+
+DUMP_DAYS = [models.Day.MONDAY, models.Day.TUESDAY, models.Day.WEDNESDAY, models.Day.THURSDAY, models.Day.FRIDAY]
+
+USER_FIELDS = ['id', 'provider', 'internal_id', 'language', 'enabled', 'provider_locale'] + \
+              [field for day in DUMP_DAYS for field in (day.name.lower(), day.name.lower() + '_active')]
+MENU_FIELDS = ['campus', 'menu_day', 'course_type', 'course_sub_type', 'course_attributes', 'course_allergens',
+               'price_students', 'price_staff', 'original_language', 'original_text', 'translations']
+LEARNING_DATA_FIELDS = ['id', 'campus', 'menu_day', 'screenshot_hash', 'processed_data', 'submissions']
+
+
+def get_format(path: str, file_format: 'Optional[str]' = None) -> str:
+    """
+    Gets the format of a file, based on its extension if no format is given explicitly.
+    """
+    if file_format is None:
+        file_format = FORMAT_CSV if path.lower().endswith('.csv') else FORMAT_JSONL
+
+    if file_format not in FORMATS:
+        raise ValueError('Unknown format: {}'.format(file_format))
+
+    return file_format
+
+
+def write_records(file: IO[str], file_format: str, fields: 'Sequence[str]', records: 'Iterable[Dict[str, Any]]') -> int:
+    """
+    Writes records one at a time, so the records don't all need to be in memory.
+    :return: The number of records written.
+    """
+    count = 0
+
+    if file_format == FORMAT_CSV:
+        writer = csv.DictWriter(file, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+
+        for record in records:
+            # Nested values are written as JSON, as CSV has no way to represent them
+            writer.writerow({key: json.dumps(value, ensure_ascii=False, default=_json_default)
+                             if isinstance(value, (dict, list)) else value for key, value in record.items()})
+            count += 1
+    elif file_format == FORMAT_JSONL:
+        for record in records:
+            file.write(json.dumps({field: record.get(field) for field in fields}, ensure_ascii=False,
+                                  default=_json_default))
+            file.write('\n')
+            count += 1
+    else:
+        raise ValueError('Unknown format: {}'.format(file_format))
+
+    return count
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def read_records(file: IO[str], file_format: str) -> 'Iterator[Dict[str, Any]]':
+    """
+    Reads records one at a time. Empty values in CSV files are read as None.
+    """
+    if file_format == FORMAT_CSV:
+        for record in csv.DictReader(file):
+            yield {key: value if value != '' else None for key, value in record.items()}
+    elif file_format == FORMAT_JSONL:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        raise ValueError('Unknown format: {}'.format(file_format))
+
+
+def _batches(records: 'Iterable[Any]', batch_size: int) -> 'Iterator[List[Any]]':
+    batch = []
+
+    for record in records:
+        batch.append(record)
+
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def iter_translation_memory(batch_size: int = BATCH_SIZE) -> 'Iterator[Dict[str, Any]]':
+    """
+    Streams all stored translations, without loading them all into memory.
+    """
+    query = db.session.query(models.Translatable.original_language, models.Translatable.original_text,
+                             models.Translation.language, models.Translation.translation,
+                             models.Translation.provider).join(models.Translation).order_by(
+        models.Translatable.id, models.Translation.language
+    ).yield_per(batch_size)
+
+    for row in query:
+        yield {
+            'original_language': row.original_language,
+            'original_text': row.original_text,
+            'language': row.language,
+            'translation': row.translation,
+            'provider': row.provider,
+        }
+
+
+def iter_users(batch_size: int = BATCH_SIZE) -> 'Iterator[Dict[str, Any]]':
+    """
+    Streams all users together with the campus of their subscription on every weekday, without loading them all into
+    memory.
+    """
+    query = db.session.query(models.AppUser.id, models.AppUser.provider, models.AppUser.internal_id,
+                             models.AppUser.language, models.AppUser.enabled, models.AppUser.provider_locale,
+                             models.UserDayCampusPreference.day, models.UserDayCampusPreference.active,
+                             models.Campus.short_name).outerjoin(
+        models.UserDayCampusPreference, models.UserDayCampusPreference.user_id == models.AppUser.id
+    ).outerjoin(
+        models.Campus, models.Campus.id == models.UserDayCampusPreference.campus_id
+    ).order_by(models.AppUser.id).yield_per(batch_size)
+
+    for _, rows in itertools.groupby(query, key=lambda r: r.id):
+        rows = list(rows)
+        record = {
+            'id': rows[0].id,
+            'provider': rows[0].provider,
+            'internal_id': rows[0].internal_id,
+            'language': rows[0].language,
+            'enabled': rows[0].enabled,
+            'provider_locale': rows[0].provider_locale,
+        }
+
+        for row in rows:
+            if row.day is not None:
+                record[row.day.name.lower()] = row.short_name
+                record[row.day.name.lower() + '_active'] = row.active
+
+        yield record
+
+
+def iter_menus(first_day: datetime.date = None, last_day: datetime.date = None,
+               batch_size: int = BATCH_SIZE) -> 'Iterator[Dict[str, Any]]':
+    """
+    Streams the menu items of all menus between first_day and last_day, each with the translations of its name, without
+    loading them all into memory.
+    """
+    query = db.session.query(models.MenuItem.id, models.Campus.short_name, models.Menu.menu_day,
+                             models.MenuItem.course_type, models.MenuItem.course_sub_type,
+                             models.MenuItem.course_attributes, models.MenuItem.course_allergens,
+                             models.MenuItem.price_students, models.MenuItem.price_staff,
+                             models.Translatable.original_language, models.Translatable.original_text,
+                             models.Translation.language, models.Translation.translation).join(
+        models.Menu, models.Menu.id == models.MenuItem.menu_id
+    ).join(
+        models.Campus, models.Campus.id == models.Menu.campus_id
+    ).join(
+        models.Translatable, models.Translatable.id == models.MenuItem.translatable_id
+    ).outerjoin(
+        models.Translation, models.Translation.translatable_id == models.Translatable.id
+    )
+
+    if first_day is not None:
+        query = query.filter(models.Menu.menu_day >= first_day)
+    if last_day is not None:
+        query = query.filter(models.Menu.menu_day <= last_day)
+
+    query = query.order_by(models.Menu.menu_day, models.Campus.id, models.MenuItem.id).yield_per(batch_size)
+
+    for _, rows in itertools.groupby(query, key=lambda r: r.id):
+        rows = list(rows)
+
+        yield {
+            'campus': rows[0].short_name,
+            'menu_day': rows[0].menu_day,
+            'course_type': rows[0].course_type.name,
+            'course_sub_type': rows[0].course_sub_type.name,
+            'course_attributes': json.loads(rows[0].course_attributes),
+            'course_allergens': json.loads(rows[0].course_allergens),
+            'price_students': rows[0].price_students,
+            'price_staff': rows[0].price_staff,
+            'original_language': rows[0].original_language,
+            'original_text': rows[0].original_text,
+            'translations': {row.language: row.translation for row in rows if row.language is not None},
+        }
+
+
+def iter_learning_data(batch_size: int = BATCH_SIZE) -> 'Iterator[Dict[str, Any]]':
+    """
+    Streams all learning datapoints together with their submissions, without loading them all into memory. Screenshots
+    aren't included, only the key of their blob.
+    """
+    query = db.session.query(LearningDatapoint.id, models.Campus.short_name, LearningDatapoint.menu_day,
+                             LearningDatapoint.screenshot_hash, LearningDatapoint.processed_data,
+                             LearningDatapointSubmission.user_id,
+                             LearningDatapointSubmission.submission_data).join(
+        models.Campus, models.Campus.id == LearningDatapoint.campus_id
+    ).outerjoin(
+        LearningDatapointSubmission, LearningDatapointSubmission.datapoint_id == LearningDatapoint.id
+    ).order_by(LearningDatapoint.id).yield_per(batch_size)
+
+    for _, rows in itertools.groupby(query, key=lambda r: r.id):
+        rows = list(rows)
+
+        yield {
+            'id': rows[0].id,
+            'campus': rows[0].short_name,
+            'menu_day': rows[0].menu_day,
+            'screenshot_hash': rows[0].screenshot_hash,
+            'processed_data': json.loads(rows[0].processed_data),
+            'submissions': [{'user_id': row.user_id, 'submission': json.loads(row.submission_data)}
+                            for row in rows if row.user_id is not None],
+        }
+
+
+class TranslationImportResult(NamedTuple):
+    inserted: int
+    updated: int
+    skipped: int
+
+
+def import_translation_memory(records: 'Iterable[Dict[str, Any]]',
+                              batch_size: int = BATCH_SIZE) -> TranslationImportResult:
+    """
+    Imports translations in batches, committing after every batch. Existing translations are only replaced by
+    translations from a provider with the same or a higher precedence, see models.get_provider_precedence.
+    """
+    inserted = 0
+    updated = 0
+    skipped = 0
+
+    for batch in _batches(records, batch_size):
+        batch_inserted, batch_updated, batch_skipped = _import_translation_batch(batch)
+        db.session.commit()
+
+        inserted += batch_inserted
+        updated += batch_updated
+        skipped += batch_skipped
+
+    return TranslationImportResult(inserted, updated, skipped)
+
+
+def _import_translation_batch(batch: 'List[Dict[str, Any]]') -> TranslationImportResult:
+    skipped = 0
+    valid = []
+
+    for record in batch:
+        if not record.get('original_text') or not record.get('language') or not record.get('translation'):
+            skipped += 1
+            continue
+
+        original_language = record.get('original_language') or 'nl'
+
+        if record['language'] == original_language:
+            skipped += 1  # The original text doesn't need a translation
+            continue
+
+        valid.append((original_language, record))
+
+    translatables = _get_or_create_translatables({(original_language, record['original_text'])
+                                                  for original_language, record in valid})
+
+    # Only the best translation per translatable and language can be upserted in a single statement
+    values: 'Dict[tuple, Dict[str, Any]]' = dict()
+
+    for original_language, record in valid:
+        translatable = translatables[(original_language, normalize_text(record['original_text']))]
+        key = (translatable.id, record['language'])
+        value = {
+            'translatable_id': translatable.id,
+            'language': record['language'],
+            'translation': record['translation'],
+            'provider': record.get('provider'),
+        }
+
+        if key in values:
+            skipped += 1
+
+            if models.get_provider_precedence(value['provider']) > \
+                    models.get_provider_precedence(values[key]['provider']):
+                continue
+
+        values[key] = value
+
+    if not values:
+        return TranslationImportResult(0, 0, skipped)
+
+    table = models.Translation.__table__
+    statement = pg_insert(table).values(list(values.values()))
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.translatable_id, table.c.language],
+        set_={'translation': statement.excluded.translation, 'provider': statement.excluded.provider},
+        where=models.provider_precedence_expression(table.c.provider) >=
+        models.provider_precedence_expression(statement.excluded.provider),
+    ).returning(table.c.translatable_id, table.c.language, db.literal_column('xmax = 0').label('inserted'))
+
+    rows = db.session.execute(statement).fetchall()
+
+    # XXX: This only invalidates the cache of this process, see DELETE /api/translations/cache
+    for row in rows:
+        models.translation_cache.invalidate(row.translatable_id, row.language)
+
+    inserted = sum(1 for row in rows if row.inserted)
+    updated = len(rows) - inserted
+    skipped += len(values) - len(rows)  # Existing translations with a higher precedence
+
+    return TranslationImportResult(inserted, updated, skipped)
+
+
+def _get_or_create_translatables(texts: 'Iterable[tuple]') -> 'Dict[tuple, models.Translatable]':
+    """
+    :param texts: 2-tuples of the original language and original text.
+    :return: Maps the original language and normalized text to the translatable.
+    """
+    by_key = dict()
+    for original_language, text in texts:
+        by_key.setdefault((original_language, normalize_text(text)), text)
+
+    result = dict()
+
+    if not by_key:
+        return result
+
+    # XXX: Locked until the end of the transaction, so the cleanup doesn't remove them before they're referenced
+    existing = models.Translatable.query.filter(db.tuple_(models.Translatable.original_language,
+                                                          models.Translatable.normalized_text).in_(list(by_key))) \
+        .with_for_update(read=True, key_share=True).all()
+
+    for translatable in existing:
+        result[(translatable.original_language, translatable.normalized_text)] = translatable
+
+    for key, text in by_key.items():
+        if key not in result:
+            translatable = models.Translatable(text, key[0])
+            db.session.add(translatable)
+
+            result[key] = translatable
+
+    db.session.flush()
+
+    return result
+
+
+class UserImportResult(NamedTuple):
+    inserted: int
+    updated: int
+    skipped: int
+    duration: float  # Seconds
+
+    @property
+    def throughput(self) -> float:
+        """
+        :return: The number of users imported per second.
+        """
+        return (self.inserted + self.updated) / self.duration if self.duration > 0 else 0.0
+
+
+def import_dump(file: IO[str], batch_size: int = BATCH_SIZE) -> UserImportResult:
+    """
+    Imports Facebook users and their campus preferences from a TSV dump. The dump is read in batches of batch_size
+    lines, each inserted with a single statement per table and committed, so memory use doesn't grow with the size of
+    the dump. Users that already exist keep their language, only their campus preferences are updated. Lines with the
+    wrong number of columns or an unknown campus are skipped.
+
+    The columns of the dump are the id of the user, whether the subscription is active, the short name of the campus
+    for every weekday and the locale of the user, after a header line.
+    """
+    start = time.perf_counter()
+    campuses = {campus.short_name: campus.id for campus in models.Campus.query.all()}
+
+    inserted = 0
+    updated = 0
+    skipped = 0
+
+    _ = file.readline()  # Skip header
+
+    for batch in _batches(file, batch_size):
+        batch_inserted, batch_updated, batch_skipped = _import_dump_batch(batch, campuses)
+        db.session.commit()
+
+        inserted += batch_inserted
+        updated += batch_updated
+        skipped += batch_skipped
+
+    return UserImportResult(inserted, updated, skipped, time.perf_counter() - start)
+
+
+def _import_dump_batch(lines: 'List[str]', campuses: 'Dict[str, int]') -> 'Tuple[int, int, int]':
+    skipped = 0
+    users: 'Dict[str, Dict[str, Any]]' = dict()
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+
+        split = line.split('\t')
+
+        if len(split) != 8:
+            skipped += 1
+            continue
+
+        internal_id, active, *campus_names, locale = split
+        campus_ids = [campuses.get(short_name) for short_name in campus_names]
+
+        if not internal_id or None in campus_ids:
+            skipped += 1
+            continue
+
+        if internal_id in users:
+            skipped += 1  # A user can only be upserted once per statement, the last line wins
+
+        users[internal_id] = {
+            'language': '' if locale == '0' else locale,
+            'active': active == 'True',
+            'campus_ids': campus_ids,
+        }
+
+    if not users:
+        return 0, 0, skipped
+
+    table = models.AppUser.__table__
+    statement = pg_insert(table).values([{'provider': 'facebook', 'internal_id': internal_id,
+                                          'language': user['language']} for internal_id, user in users.items()])
+    # XXX: The language may have been changed since the dump was taken, this update only makes RETURNING include users
+    #      that already exist
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.provider, table.c.internal_id],
+        set_={'internal_id': statement.excluded.internal_id},
+    ).returning(table.c.id, table.c.internal_id, db.literal_column('xmax = 0').label('inserted'))
+
+    rows = db.session.execute(statement).fetchall()
+
+    values = []
+    for row in rows:
+        user = users[row.internal_id]
+        values.extend({'user_id': row.id, 'day': day, 'campus_id': campus_id, 'active': user['active']}
+                      for day, campus_id in zip(DUMP_DAYS, user['campus_ids']))
+
+    table = models.UserDayCampusPreference.__table__
+    statement = pg_insert(table).values(values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day],
+        set_={'campus_id': statement.excluded.campus_id, 'active': statement.excluded.active},
+    )
+
+    db.session.execute(statement)
+
+    inserted = sum(1 for row in rows if row.inserted)
+
+    return inserted, len(rows) - inserted, skipped
@@ -0,0 +1,161 @@
+import datetime
+import time
+from typing import Any, Callable, List, NamedTuple, Optional
+
+from sqlalchemy import select, tuple_
+
+from extensions import db
+from komidabot.menu_backfill import get_week_start
+from komidabot.models import ClosingDays, DeliveryLedger, Menu, MenuItem, OutboxMessage, Translatable, \
+    translation_cache
+from komidabot.models_jobs import BackfillShard, Job, JobStatus
+from komidabot.models_training import LearningDatapoint
+
+__all__ = ['BATCH_SIZE', 'CleanupResult', 'Retention', 'cleanup']
+
+BATCH_SIZE = 1000  # Rows deleted per transaction
+
+STEP_CLOSING_DAYS = 'closing_days'
+STEP_MENUS = 'menus'
+STEP_BACKFILL_SHARDS = 'backfill_shards'
+STEP_DELIVERY_LEDGER = 'delivery_ledger'
+STEP_OUTBOX = 'outbox'
+STEP_JOBS = 'jobs'
+STEP_LEARNING_DATA = 'learning_data'
+STEP_TRANSLATABLES = 'translatables'
+
+
+class Retention(NamedTuple):
+    """
+    Number of days rows are kept for, None keeps them forever.
+    """
+    menus: Optional[int] = None
+    delivery_ledger: Optional[int] = 90
+    outbox: Optional[int] = 30  # Only messages that were handled
+    jobs: Optional[int] = 30  # Only jobs that finished
+    learning_data: Optional[int] = None
+
+
+class CleanupResult(NamedTuple):
+    step: str
+    rows: int
+    duration: float  # Seconds
+
+
+def cleanup(retention: Retention = Retention(), batch_size: int = BATCH_SIZE,
+            on_step: 'Callable[[CleanupResult], None]' = None) -> 'List[CleanupResult]':
+    """
+    Removes menus on closing days, rows that are older than their retention and translatables that are no longer used.
+    Rows are deleted in batches of batch_size, each in its own short transaction. Rows that are locked by another
+    transaction are skipped and left for the next cleanup, so this is safe to run while the bot is serving.
+
+    :param on_step: Called with the result of every step once it is done.
+    """
+    today = datetime.date.today()
+    now = datetime.datetime.now()
+    results = []
+
+    def run_step(step: str, function: 'Callable[[], int]'):
+        start = time.perf_counter()
+        rows = function()
+        result = CleanupResult(step, rows, time.perf_counter() - start)
+
+        results.append(result)
+
+        if on_step is not None:
+            on_step(result)
+
+    def remove_menus_on_closing_days():
+        rows = Menu.remove_menus_on_closing_days()
+        db.session.commit()
+
+        return rows
+
+    run_step(STEP_CLOSING_DAYS, remove_menus_on_closing_days)
+
+    if retention.menus is not None:
+        cutoff = today - datetime.timedelta(days=retention.menus)
+
+        run_step(STEP_MENUS, lambda: _delete_batched(Menu, Menu.menu_day < cutoff, batch_size))
+        # Weeks of which the menus are removed are backfilled again by synchronize_menus
+        run_step(STEP_BACKFILL_SHARDS, lambda: _delete_batched(
+            BackfillShard, BackfillShard.week_start < get_week_start(cutoff), batch_size
+        ))
+
+    if retention.delivery_ledger is not None:
+        cutoff = today - datetime.timedelta(days=retention.delivery_ledger)
+
+        run_step(STEP_DELIVERY_LEDGER, lambda: _delete_batched(
+            DeliveryLedger, DeliveryLedger.dispatch_date < cutoff, batch_size
+        ))
+
+    if retention.outbox is not None:
+        cutoff = now - datetime.timedelta(days=retention.outbox)
+
+        run_step(STEP_OUTBOX, lambda: _delete_batched(
+            OutboxMessage, OutboxMessage.result.isnot(None) & (OutboxMessage.queued_on < cutoff), batch_size
+        ))
+
+    if retention.jobs is not None:
+        cutoff = now - datetime.timedelta(days=retention.jobs)
+
+        run_step(STEP_JOBS, lambda: _delete_batched(
+            Job, Job.status.in_([JobStatus.DONE, JobStatus.FAILED]) & (Job.finished_on < cutoff), batch_size
+        ))
+
+    if retention.learning_data is not None:
+        cutoff = today - datetime.timedelta(days=retention.learning_data)
+
+        # XXX: Submissions are removed by the database, screenshots stay in blob storage as they may be shared
+        run_step(STEP_LEARNING_DATA, lambda: _delete_batched(
+            LearningDatapoint, LearningDatapoint.menu_day < cutoff, batch_size
+        ))
+
+    # Last, as removing menus leaves translatables behind
+    orphaned = ~db.exists().where(MenuItem.translatable_id == Translatable.id) & \
+               ~db.exists().where(ClosingDays.translatable_id == Translatable.id)
+
+    run_step(STEP_TRANSLATABLES, lambda: _delete_batched(
+        Translatable, orphaned, batch_size, on_batch=lambda keys: translation_cache.discard([key[0] for key in keys])
+    ))
+
+    return results
+
+
+def _delete_batched(model, condition, batch_size: int, on_batch: 'Callable[[List[Any]], None]' = None) -> int:
+    """
+    Deletes the rows of a model matching a condition, batch_size rows at a time, committing after every batch.
+    :param on_batch: Called with the primary keys of the rows deleted in every batch.
+    :return: The number of rows deleted.
+    """
+    table = model.__table__
+    primary_key = list(table.primary_key.columns)
+    total = 0
+
+    while True:
+        # XXX: Rows locked by another transaction are skipped, this includes translatables that were looked up using
+        #      Translatable.get_or_create by a transaction that is still running
+        batch = select(*primary_key).where(condition).limit(batch_size).with_for_update(skip_locked=True)
+        statement = table.delete().where(tuple_(*primary_key).in_(batch))
+
+        if on_batch is not None:
+            statement = statement.returning(*primary_key)
+
+        result = db.session.execute(statement)
+
+        if on_batch is not None:
+            keys = result.fetchall()
+            rows = len(keys)
+        else:
+            keys = None
+            rows = result.rowcount
+
+        db.session.commit()
+
+        total += rows
+
+        if keys:
+            on_batch(keys)
+
+        if rows < batch_size:
+            return total
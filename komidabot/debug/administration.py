@@ -1,10 +1,18 @@
+import atexit
 import copy
+import datetime
+import hashlib
 import json
-from typing import Any, Callable, NoReturn
+import queue
+import threading
+import traceback
+from typing import Any, Callable, Dict, List, NoReturn, Optional
 
 from pywebpush import webpush, WebPushException
 
 import komidabot.messages as messages
+import komidabot.triggers as triggers
+from extensions import db
 from komidabot.app import get_app
 from komidabot.models_users import AdminSubscription, RegisteredUser
 
@@ -12,8 +20,14 @@ VAPID_CLAIMS = {
     'sub': 'mailto:komidabot@gmail.com'
 }
 
+# Repeated exceptions are rolled up into a digest that is sent once per interval
+DIGEST_INTERVAL = datetime.timedelta(minutes=15)
+
 
 def notify_admins(message: messages.Message):
+    """
+    Sends a message to the subscriptions of all admins right away. The caller is responsible for committing the changes.
+    """
     target: Callable[[AdminSubscription, Any], NoReturn]
 
     if isinstance(message, messages.TextMessage):
@@ -23,7 +37,7 @@ def notify_admins(message: messages.Message):
     else:
         raise ValueError('Unsupported message type')
 
-    for user in RegisteredUser.get_all():
+    for user in RegisteredUser.get_subscribed_admins():
         for sub in user.get_subscriptions():
             message_result = target(sub, message)
 
@@ -32,6 +46,119 @@ def notify_admins(message: messages.Message):
                 user.remove_subscription(sub['endpoint'])
 
 
+def get_exception_fingerprint(exception: Exception) -> str:
+    """
+    Gets a fingerprint that is the same for exceptions of the same type, raised from the same place.
+    """
+    fingerprint = hashlib.sha1(type(exception).__qualname__.encode('utf-8'))
+
+    for frame in traceback.extract_tb(exception.__traceback__):
+        fingerprint.update('{}:{}:{}'.format(frame.filename, frame.name, frame.lineno).encode('utf-8'))
+
+    return fingerprint.hexdigest()
+
+
+class AdminNotifier:
+    """
+    Sends notifications to the admins from a background thread, so callers never wait for the push services. The first
+    occurrence of an exception is sent immediately, repeats are counted and sent as a digest at the end of the interval.
+    """
+
+    def __init__(self, the_app, digest_interval: datetime.timedelta = DIGEST_INTERVAL):
+        self.app = the_app
+        self.digest_interval = digest_interval
+
+        self._queue: 'queue.Queue[messages.Message]' = queue.Queue()
+        self._lock = threading.Lock()
+        # Fingerprint -> (exception message, number of repeats) for exceptions seen during the current interval
+        self._exceptions: 'Dict[str, List]' = dict()
+        self._digest_due = datetime.datetime.now() + digest_interval
+
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(target=self._run, name='admin-notifier', daemon=True)
+        self._thread.start()
+
+        atexit.register(AdminNotifier.stop, self)  # Ensure cleanup of resources
+
+    def stop(self):
+        self._stopping.set()
+
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def notify(self, message: messages.Message):
+        if isinstance(message, messages.ExceptionMessage):
+            fingerprint = get_exception_fingerprint(message.source)
+
+            with self._lock:
+                if fingerprint in self._exceptions:
+                    self._exceptions[fingerprint][1] += 1
+                    return  # Already sent during this interval
+
+                self._exceptions[fingerprint] = [message, 0]
+
+        self._queue.put(message)
+
+    def get_digest(self) -> 'Optional[messages.TextMessage]':
+        """
+        Gets the digest of the exceptions that repeated during the current interval, and starts a new interval.
+        """
+        with self._lock:
+            exceptions = self._exceptions
+            self._exceptions = dict()
+            self._digest_due = datetime.datetime.now() + self.digest_interval
+
+        lines = []
+        for message, repeats in exceptions.values():
+            if repeats > 0:
+                lines.append('{} (repeated {} times)'.format(_get_exception_text(message.source), repeats))
+
+        if not lines:
+            return None
+
+        return messages.TextMessage(triggers.Trigger(), '\n'.join(lines))
+
+    def process(self, timeout: float = None) -> bool:
+        """
+        Sends the next queued message, or the digest if it is due.
+        :return: True if something was sent, False otherwise.
+        """
+        message = None
+
+        if datetime.datetime.now() >= self._digest_due:
+            message = self.get_digest()
+
+        if message is None:
+            try:
+                message = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+            except queue.Empty:
+                return False
+
+        with self.app.app_context():
+            try:
+                notify_admins(message)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+
+                # Don't try to notify the admins about this, that is what failed
+                self.app.logger.exception(e)
+
+        return True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            timeout = (self._digest_due - datetime.datetime.now()).total_seconds()
+            self.process(timeout=min(max(timeout, 0.1), 5.0))
+
+
 def _send_notification(subscription: AdminSubscription, data) -> messages.MessageSendResult:
     app = get_app()
 
@@ -91,14 +218,18 @@ def _send_text_message(subscription: AdminSubscription,
     return _send_notification(copy.deepcopy(subscription), data)
 
 
-def _send_exception_message(subscription: AdminSubscription,
-                            message: messages.ExceptionMessage) -> messages.MessageSendResult:
-    exception_string = str(message.source)
+def _get_exception_text(exception: Exception) -> str:
+    exception_string = str(exception)
 
     if exception_string:
-        body = '{}: {}'.format(type(message.source).__name__, exception_string)
+        return '{}: {}'.format(type(exception).__name__, exception_string)
     else:
-        body = type(message.source).__name__
+        return type(exception).__name__
+
+
+def _send_exception_message(subscription: AdminSubscription,
+                            message: messages.ExceptionMessage) -> messages.MessageSendResult:
+    body = _get_exception_text(message.source)
 
     data = {
         'notification': {
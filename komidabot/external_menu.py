@@ -3,7 +3,7 @@ import datetime
 import json
 import re
 from decimal import Decimal
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Collection, Dict, Optional, Set, Tuple, Union
 
 import requests
 
@@ -130,6 +130,8 @@ atexit.register(_cleanup_session, session_obj)
 
 
 def _convert_price(price_students: Union[str, Decimal]) -> Decimal:
+    limiter()
+
     url = PRICE_API.format(endpoint=BASE_ENDPOINT, price=price_students)
     price_response = session_obj.get(url, headers=API_GET_HEADERS)
     price_data = json.loads(price_response.text)
@@ -143,7 +145,10 @@ def _decimal_or_none(value: str) -> Optional[Decimal]:
     return Decimal(value)
 
 
-def fetch_raw(campus: models.Campus, date: datetime.date) -> Optional[Any]:
+def fetch_raw(campus: models.Campus, date: datetime.date, strict: bool = False) -> Optional[Any]:
+    """
+    :param strict: Raise on timeouts and server errors, instead of handling them as if there is no menu.
+    """
     debug_state = ProgramStateTrace()
 
     with debug_state.state(SimpleProgramState('Lookup menu', {'campus': campus.short_name, 'date': date.isoformat()})):
@@ -154,12 +159,15 @@ def fetch_raw(campus: models.Campus, date: datetime.date) -> Optional[Any]:
         try:
             response = session_obj.get(url, headers=API_GET_HEADERS)
         except requests.exceptions.Timeout:
+            if strict:
+                raise
             return None  # If the connection times out, we'll just ignore it
 
         if 400 <= response.status_code < 500:
             raise DebuggableException('Client error on HTTP request')
         if 500 <= response.status_code < 600:
-            # raise DebuggableException('Server error on HTTP request')
+            if strict:
+                raise DebuggableException('Server error on HTTP request')
             return None  # Don't raise an exception when the server fails, we'll just ignore it
             # TODO: Maybe send a notification to admins that we failed requesting data?
 
@@ -263,7 +271,74 @@ def parse_fetched(fetched: Dict):
     return result
 
 
-def process_parsed(parsed: Dict):
+# Rules used by classify_course to determine the course type
+RULE_SOUP = 'soup'
+RULE_PASTA_ATTRIBUTE = 'pasta_attribute'
+RULE_PASTA_NAME = 'pasta_name'
+RULE_GRILL = 'grill'
+RULE_SNACK = 'snack'
+RULE_SUB = 'sub'
+RULE_SALAD = 'salad'
+RULE_DESSERT = 'dessert'
+RULE_DAILY = 'daily'
+
+RULES = [RULE_SOUP, RULE_PASTA_ATTRIBUTE, RULE_PASTA_NAME, RULE_GRILL, RULE_SNACK, RULE_SUB, RULE_SALAD, RULE_DESSERT,
+         RULE_DAILY]
+
+
+def classify_course(attributes: 'Collection[str]', name: str,
+                    price_students: str) -> 'Tuple[models.CourseType, models.CourseSubType, str]':
+    """
+    Determines the type and sub type of a course.
+
+    :param attributes: The names of the course attributes, see COURSE_LOGOS.
+    :param name: The Dutch name of the course.
+    :return: A 3-tuple containing the course type, course sub type, and the rule that determined the course type.
+    """
+    course_sub_type = models.CourseSubType.NORMAL
+
+    if 'VEGAN' in attributes:
+        course_sub_type = models.CourseSubType.VEGAN
+    elif 'VEGGIE' in attributes:
+        course_sub_type = models.CourseSubType.VEGETARIAN
+
+    if 'SOUP' in attributes:
+        return models.CourseType.SOUP, course_sub_type, RULE_SOUP
+
+    if 'PASTA' in attributes:
+        return models.CourseType.PASTA, course_sub_type, RULE_PASTA_ATTRIBUTE
+
+    # No pasta attribute, let's check the name to make sure anyway
+    name = name.lower()
+
+    for pasta in PASTA_NAMES + BROKEN_ITALIAN_NAMES:
+        if pasta in name:
+            return models.CourseType.PASTA, course_sub_type, RULE_PASTA_NAME
+
+    if 'GRILL' in attributes:
+        return models.CourseType.GRILL, course_sub_type, RULE_GRILL
+
+    if 'SNACK' in attributes:
+        # If the item has a low price, it's more likely to be a snack, not a sub (broodje)
+        if Decimal(price_students) < 2.7:
+            return models.CourseType.SNACK, course_sub_type, RULE_SNACK
+        else:
+            return models.CourseType.SUB, course_sub_type, RULE_SUB
+
+    if 'SALAD' in attributes:
+        return models.CourseType.SALAD, course_sub_type, RULE_SALAD
+
+    # If the item has a low price and no other specific logo, it's probably a dessert, not a daily course
+    if Decimal(price_students) < 3:
+        return models.CourseType.DESSERT, course_sub_type, RULE_DESSERT
+
+    return models.CourseType.DAILY, course_sub_type, RULE_DAILY
+
+
+def process_parsed(parsed: Dict, on_request: 'Callable[[], None]' = None):
+    """
+    :param on_request: Called for every request made to look up the price for staff of an item.
+    """
     if parsed is None:
         return None
 
@@ -328,45 +403,14 @@ def process_parsed(parsed: Dict):
             processed_item['course_allergens'].sort()
 
             if parsed_item['multiple_prices']:
+                if on_request is not None:
+                    on_request()
+
                 processed_item['price_staff'] = str(_convert_price(parsed_item['price']))
 
-            has_pasta = 'PASTA' in processed_item['course_attributes']
-
-            if not has_pasta:
-                # No pasta in name, let's check to make sure anyway
-                name = processed_item['name']['nl']
-
-                for pasta in PASTA_NAMES + BROKEN_ITALIAN_NAMES:
-                    if pasta in name.lower():
-                        has_pasta = True
-                        break
-
-            course_type = models.CourseType.DAILY
-            course_sub_type = models.CourseSubType.NORMAL
-
-            if 'VEGAN' in processed_item['course_attributes']:
-                course_sub_type = models.CourseSubType.VEGAN
-            elif 'VEGGIE' in processed_item['course_attributes']:
-                course_sub_type = models.CourseSubType.VEGETARIAN
-
-            if 'SOUP' in processed_item['course_attributes']:
-                course_type = models.CourseType.SOUP
-            elif 'PASTA' in processed_item['course_attributes'] or has_pasta:
-                course_type = models.CourseType.PASTA
-            elif 'GRILL' in processed_item['course_attributes']:
-                course_type = models.CourseType.GRILL
-            elif 'SNACK' in processed_item['course_attributes']:
-                # If the item has a low price, it's more likely to be a snack, not a sub (broodje)
-                if Decimal(processed_item['price_students']) < 2.7:
-                    course_type = models.CourseType.SNACK
-                else:
-                    course_type = models.CourseType.SUB
-            elif 'SALAD' in processed_item['course_attributes']:
-                course_type = models.CourseType.SALAD
-            else:
-                # If the item has a low price and no other specific logo, it's probably a dessert, not a daily course
-                if Decimal(processed_item['price_students']) < 3:
-                    course_type = models.CourseType.DESSERT
+            course_type, course_sub_type, _ = classify_course(processed_item['course_attributes'],
+                                                             processed_item['name']['nl'],
+                                                             processed_item['price_students'])
 
             processed_item['course_type'] = course_type.name
             processed_item['course_sub_type'] = course_sub_type.name
@@ -376,9 +420,17 @@ def process_parsed(parsed: Dict):
     return result
 
 
-def update_menu(processed: Dict):
+def update_menu(processed: Dict, changed_translations: 'Set[Tuple[int, str]]' = None) -> 'Set[int]':
+    """
+    Stores a processed menu in the database.
+    :param changed_translations: The translatable ids and languages of the translations that were updated are added to
+                                 this set, these need to be removed from the translation cache after committing.
+    :return: The ids of the translatables used by the menu items.
+    """
+    translatable_ids = set()
+
     if processed is None:
-        return None
+        return translatable_ids
 
     debug_state = ProgramStateTrace()
 
@@ -408,11 +460,12 @@ def update_menu(processed: Dict):
             for item in items:
                 translatable, translation = models.Translatable.get_or_create(item['name'][LANGUAGE_DUTCH],
                                                                               LANGUAGE_DUTCH)
+                translatable_ids.add(translatable.id)
 
                 for language in set(item['name'].keys()).difference([LANGUAGE_DUTCH]):
-                    if translatable.has_translation(language):
-                        translation = translatable.get_translation(language)
+                    translation = models.Translation.find_by_id(translatable.id, language)
 
+                    if translation is not None:
                         # Don't replace translation if provider is Komida, as this is the official translation
                         # Likewise, if the provider is not defined, this means it is most likely manually added
                         # Otherwise it's done by Google or some other provider, which is sub-optimal
@@ -422,6 +475,9 @@ def update_menu(processed: Dict):
                         # Update translation and provider to new values
                         translation.translation = item['name'][language]
                         translation.provider = 'komida'
+
+                        if changed_translations is not None:
+                            changed_translations.add((translatable.id, language))
                     else:
                         translatable.add_translation(language, item['name'][language], 'komida')
 
@@ -446,3 +502,5 @@ def update_menu(processed: Dict):
                                                    Decimal(item['price_students']),
                                                    _decimal_or_none(item['price_staff']))
                     menu_item.external_id = item['external_id']
+
+    return translatable_ids
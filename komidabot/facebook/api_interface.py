@@ -1,8 +1,10 @@
+import atexit
 import json
-import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlencode
 
 import requests
-from cachetools import cached, TTLCache
 
 import komidabot.messages as messages
 from komidabot.app import get_app
@@ -15,6 +17,53 @@ SEND_API = '/me/messages'
 PROFILE_API = '/me/messenger_profile'
 PASS_THREAD_CONTROL_API = '/me/pass_thread_control'
 
+BATCH_SIZE = 50  # Maximum number of requests in a single batch request
+
+SENDER_ACTION_MARK_SEEN = 'mark_seen'
+SENDER_ACTION_TYPING_ON = 'typing_on'
+SENDER_ACTION_TYPING_OFF = 'typing_off'
+
+
+def get_send_result(status_code: int, data: 'Optional[dict]') -> messages.MessageSendResult:
+    """
+    Maps the response of the Send API to the result of sending a message.
+    """
+    if status_code == 200:
+        return messages.MessageSendResult.SUCCESS
+
+    if 500 <= status_code < 600:
+        return messages.MessageSendResult.EXTERNAL_ERROR
+
+    if status_code == 400 and data is not None and 'error' in data:
+        code = data['error']['code']
+        subcode = data['error'].get('error_subcode')
+
+        # https://developers.facebook.com/docs/messenger-platform/reference/send-api/error-codes
+        if code == 1200:
+            # Temporary send message failure. Please try again later.
+            return messages.MessageSendResult.EXTERNAL_ERROR
+        if code == 100:
+            if subcode == 2018001:
+                # No matching user found
+                return messages.MessageSendResult.GONE
+        if code == 10:
+            if subcode == 2018065:
+                # This message is sent outside of allowed window.
+                return messages.MessageSendResult.UNREACHABLE
+            if subcode == 2018108:
+                # This Person Cannot Receive Messages: This person isn't receiving messages from you right now.
+                return messages.MessageSendResult.UNREACHABLE
+            if subcode == 2018278:
+                # TODO: Get official description from FB once available
+                # Sent after March 4th to indicate the subscription message was denied
+                return messages.MessageSendResult.UNREACHABLE
+        if code == 551:
+            if subcode == 1545041:
+                # This person isn't available right now.
+                return messages.MessageSendResult.UNREACHABLE
+
+    return messages.MessageSendResult.ERROR  # TODO: Further specify
+
 
 class ApiInterface:
     def __init__(self, page_access_token: str):
@@ -25,9 +74,13 @@ class ApiInterface:
         self.headers_post = dict()
         self.headers_post['Content-Type'] = 'application/json'
 
-        self.locale_parameters = dict()
-        self.locale_parameters['access_token'] = page_access_token
-        self.locale_parameters['fields'] = 'locale'
+        # Sender actions are only cosmetic, so they get their own connections and threads and nobody waits for them
+        self.sender_action_session = requests.Session()
+        self.sender_action_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='fb-sender-actions')
+        atexit.register(ThreadPoolExecutor.shutdown, self.sender_action_executor)  # Ensure cleanup of resources
+
+        self.batch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='fb-batches')
+        atexit.register(ThreadPoolExecutor.shutdown, self.batch_executor)  # Ensure cleanup of resources
 
     @check_exceptions(messages.MessageSendResult.ERROR)  # Handles exceptions raised in this method
     def post_send_api(self, data: dict) -> messages.MessageSendResult:
@@ -41,41 +94,149 @@ class ApiInterface:
             print('Received {} for request {}'.format(response.status_code, response.request.body), flush=True)
             print(response.content, flush=True)
 
-        if response.status_code == 200:
-            return messages.MessageSendResult.SUCCESS
-
-        if 500 <= response.status_code < 600:
-            return messages.MessageSendResult.EXTERNAL_ERROR
+        return get_send_result(response.status_code, data)
+
+    def post_send_api_batch(self, data_list: 'List[dict]') -> 'List[messages.MessageSendResult]':
+        """
+        Sends multiple messages using batch requests. Messages for the same recipient are delivered in order, once a
+        message fails the remaining messages for that recipient are not sent and get the same result. Batches that
+        don't share any recipients are sent in parallel.
+
+        :param data_list: The messages as they would be passed to post_send_api.
+        :return: The result of sending every message, in the same order.
+        """
+        results: 'List[Optional[messages.MessageSendResult]]' = [None] * len(data_list)
+
+        by_recipient: 'Dict[str, List[int]]' = dict()
+        for index, data in enumerate(data_list):
+            by_recipient.setdefault(data['recipient']['id'], []).append(index)
+
+        # Every task is a list of batches that must be sent one after another, separate tasks are independent
+        tasks: 'List[List[List[int]]]' = []
+        current: 'List[int]' = []
+
+        for indices in by_recipient.values():
+            if len(indices) > BATCH_SIZE:
+                tasks.append([indices[i:i + BATCH_SIZE] for i in range(0, len(indices), BATCH_SIZE)])
+                continue
+
+            if len(current) + len(indices) > BATCH_SIZE:
+                tasks.append([current])
+                current = []
+
+            current.extend(indices)
+
+        if current:
+            tasks.append([current])
+
+        def run_task(task: 'List[List[int]]'):
+            failed = dict()  # Recipient -> result of the message that failed
+
+            for indices in task:
+                self._post_send_api_batch(data_list, indices, results, failed)
+
+        if len(tasks) == 1:
+            run_task(tasks[0])
+        else:
+            list(self.batch_executor.map(run_task, tasks))
+
+        return results
+
+    def _post_send_api_batch(self, data_list: 'List[dict]', indices: 'List[int]',
+                             results: 'List[Optional[messages.MessageSendResult]]',
+                             failed: 'Dict[str, messages.MessageSendResult]'):
+        batch = []
+        batch_indices = []
+        previous = dict()  # Recipient -> name of the previous request for this recipient
+
+        for index in sorted(indices):  # Keep the original order of the messages
+            data = data_list[index]
+            recipient = data['recipient']['id']
+
+            if recipient in failed:
+                results[index] = failed[recipient]
+                continue
+
+            request = {
+                'method': 'POST',
+                'relative_url': SEND_API.lstrip('/'),
+                'body': urlencode({key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                                   for key, value in data.items()}),
+                'name': 'message-{}'.format(index),
+                'omit_response_on_success': False,
+            }
+
+            if recipient in previous:
+                # If the previous message fails, this one won't be sent
+                request['depends_on'] = previous[recipient]
+
+            previous[recipient] = request['name']
+            batch.append(request)
+            batch_indices.append(index)
+
+        if not batch:
+            return
+
+        batch_result = None
+
+        try:
+            responses = self.post_batch(batch)
+        except requests.HTTPError as e:
+            print('Batch request failed with status {}'.format(e.response.status_code), flush=True)
+            responses = None
+
+            if 500 <= e.response.status_code < 600:
+                batch_result = messages.MessageSendResult.EXTERNAL_ERROR
+            else:
+                batch_result = messages.MessageSendResult.ERROR
+        except requests.RequestException as e:
+            print('Batch request failed: {}'.format(e), flush=True)
+            responses = None
+            batch_result = messages.MessageSendResult.EXTERNAL_ERROR
+
+        for position, index in enumerate(batch_indices):
+            recipient = data_list[index]['recipient']['id']
+
+            if responses is None:
+                result = batch_result
+            elif responses[position] is None:
+                # Not handled, either because the previous message failed or because the batch timed out
+                result = failed.get(recipient, messages.MessageSendResult.EXTERNAL_ERROR)
+            else:
+                response = responses[position]
+                body = json.loads(response['body']) if response.get('body') else None
+                result = get_send_result(response['code'], body)
+
+            results[index] = result
+
+            if result != messages.MessageSendResult.SUCCESS and recipient not in failed:
+                failed[recipient] = result
+
+    def post_sender_action(self, recipient_id: str, sender_action: str) -> 'Optional[Future]':
+        """
+        Sends a sender action in the background, the result is not reported.
+        See https://developers.facebook.com/docs/messenger-platform/send-messages/sender-actions
+        """
+        if not self.base_parameters['access_token']:
+            return None  # Can't reach Facebook anyway
+
+        data = {
+            'recipient': {'id': recipient_id},
+            'sender_action': sender_action,
+        }
+
+        return self.sender_action_executor.submit(self._post_sender_action, data)
+
+    @check_exceptions(False)
+    def _post_sender_action(self, data: dict) -> bool:
+        response = self.sender_action_session.post(BASE_ENDPOINT + API_VERSION + SEND_API, params=self.base_parameters,
+                                                   headers=self.headers_post, data=json.dumps(data))
+
+        if response.status_code != 200:
+            print('Received {} for sender action {}'.format(response.status_code, data['sender_action']), flush=True)
+            print(response.content, flush=True)
 
-        if response.status_code == 400:
-            code = data['error']['code']
-            subcode = data['error']['error_subcode']
-
-            # https://developers.facebook.com/docs/messenger-platform/reference/send-api/error-codes
-            if code == 1200:
-                # Temporary send message failure. Please try again later.
-                return messages.MessageSendResult.EXTERNAL_ERROR
-            if code == 100:
-                if subcode == 2018001:
-                    # No matching user found
-                    return messages.MessageSendResult.GONE
-            if code == 10:
-                if subcode == 2018065:
-                    # This message is sent outside of allowed window.
-                    return messages.MessageSendResult.UNREACHABLE
-                if subcode == 2018108:
-                    # This Person Cannot Receive Messages: This person isn't receiving messages from you right now.
-                    return messages.MessageSendResult.UNREACHABLE
-                if subcode == 2018278:
-                    # TODO: Get official description from FB once available
-                    # Sent after March 4th to indicate the subscription message was denied
-                    return messages.MessageSendResult.UNREACHABLE
-            if code == 551:
-                if subcode == 1545041:
-                    # This person isn't available right now.
-                    return messages.MessageSendResult.UNREACHABLE
-
-        return messages.MessageSendResult.ERROR  # TODO: Further specify
+        return response.status_code == 200
 
     @check_exceptions(False)  # TODO: Exception checking needs to be done differently
     def post_profile_api(self, data: dict):
@@ -111,16 +272,45 @@ class ApiInterface:
 
         return response.status_code == 200
 
-    @check_exceptions()  # TODO: Exception checking needs to be done differently
-    @cached(cache=TTLCache(maxsize=64, ttl=300), lock=threading.Lock())
-    def lookup_locale(self, user_id):
-        # TODO: Futures or Promises???
+    def post_batch(self, batch: 'List[dict]') -> 'List[Optional[dict]]':
+        """
+        Sends multiple requests to the Graph API in a single HTTP request.
+        See https://developers.facebook.com/docs/graph-api/making-multiple-requests
 
-        response = self.session.get(BASE_ENDPOINT + API_VERSION + user_id, params=self.locale_parameters)
+        :param batch: The requests, at most BATCH_SIZE.
+        :return: The response of every request, in the same order. A response is None if the request wasn't handled.
+        """
+        if len(batch) > BATCH_SIZE:
+            raise ValueError('Too many requests in batch')
 
-        # print('Received {} for user request {}'.format(response.status_code, user_id), flush=True)
-        # print(response.content, flush=True)
+        response = self.session.post(BASE_ENDPOINT + API_VERSION, params=self.base_parameters,
+                                     data={'batch': json.dumps(batch), 'include_headers': 'false'})
 
-        data = json.loads(response.content)
+        app = get_app()
+
+        if app.config.get('VERBOSE'):
+            print('Received {} for batch of {} requests'.format(response.status_code, len(batch)), flush=True)
+
+        response.raise_for_status()
+
+        return json.loads(response.content)
+
+    def lookup_locales(self, user_ids: 'Iterable[str]') -> 'Dict[str, str]':
+        """
+        Looks up the locales of multiple users using batch requests. Users whose lookup failed are left out.
+        """
+        user_ids = list(user_ids)
+        result = dict()
+
+        for i in range(0, len(user_ids), BATCH_SIZE):
+            chunk = user_ids[i:i + BATCH_SIZE]
+            responses = self.post_batch([{'method': 'GET', 'relative_url': '{}?fields=locale'.format(user_id)}
+                                         for user_id in chunk])
+
+            for user_id, response in zip(chunk, responses):
+                if response is None or response.get('code') != 200:
+                    continue
+
+                result[user_id] = json.loads(response['body']).get('locale', LANGUAGE_DUTCH)
 
-        return data.get('locale', LANGUAGE_DUTCH)
+        return result
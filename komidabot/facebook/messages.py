@@ -1,3 +1,5 @@
+from typing import List, Optional, Tuple
+
 import komidabot.facebook.constants as fb_constants
 import komidabot.menu
 import komidabot.messages as messages
@@ -11,20 +13,62 @@ TYPE_SUBSCRIPTION = 'NON_PROMOTIONAL_SUBSCRIPTION'
 
 class MessageHandler(messages.MessageHandler):
     def send_message(self, user: users.User, message: messages.Message) -> messages.MessageSendResult:
+        data = self.prepare_message(user, message)
+
+        if isinstance(data, messages.MessageSendResult):
+            return data
+
+        return self.deliver_prepared(user, data)
+
+    def prepare_message(self, user: users.User, message: messages.Message):
         if user.id.provider != fb_constants.PROVIDER_ID:
             raise ValueError('User id is not for Facebook')
 
         if isinstance(message, messages.TextMessage):
-            return self._send_text_message(user.id, message)
+            return self._prepare_text_message(user.id, message)
         elif isinstance(message, messages.MenuMessage):
-            return self._send_menu_message(user, message)
+            return self._prepare_menu_message(user, message)
         elif isinstance(message, TemplateMessage):
-            return self._send_template_message(user.id, message)
+            return self._prepare_template_message(user.id, message)
         else:
             return messages.MessageSendResult.UNSUPPORTED
 
+    def send_messages(self, user: users.User, message_list: 'List[messages.Message]') \
+            -> 'List[messages.MessageSendResult]':
+        if len(message_list) == 1:
+            return [self.send_message(user, message_list[0])]
+
+        results: 'List[Optional[messages.MessageSendResult]]' = [None] * len(message_list)
+        items = []
+        item_indices = []
+
+        for index, message in enumerate(message_list):
+            data = self.prepare_message(user, message)
+
+            if isinstance(data, messages.MessageSendResult):
+                results[index] = data
+            else:
+                items.append((user, data))
+                item_indices.append(index)
+
+        for index, result in zip(item_indices, self.deliver_prepared_many(items)):
+            results[index] = result
+
+        return results
+
+    def deliver_prepared(self, user: users.User, data: dict) -> messages.MessageSendResult:
+        return get_app().bot_interfaces['facebook']['api_interface'].post_send_api(data)
+
+    def deliver_prepared_many(self, items: 'List[Tuple[users.User, dict]]') -> 'List[messages.MessageSendResult]':
+        if not items:
+            return []
+        if len(items) == 1:
+            return [self.deliver_prepared(*items[0])]
+
+        return get_app().bot_interfaces['facebook']['api_interface'].post_send_api_batch([data for _, data in items])
+
     @staticmethod
-    def _send_text_message(user_id: users.UserId, message: messages.TextMessage) -> messages.MessageSendResult:
+    def _prepare_text_message(user_id: users.UserId, message: messages.TextMessage):
         data = {
             'recipient': {
                 'id': user_id.id
@@ -35,11 +79,12 @@ class MessageHandler(messages.MessageHandler):
             'messaging_type': TYPE_REPLY if triggers.SenderAspect in message.trigger else TYPE_SUBSCRIPTION,
         }
 
-        return get_app().bot_interfaces['facebook']['api_interface'].post_send_api(data)
+        return data
 
     @staticmethod
-    def _send_menu_message(user: users.User, message: messages.MenuMessage) -> messages.MessageSendResult:
-        text = komidabot.menu.get_menu_text(message.menu, message.translator, user.get_locale())
+    def _prepare_menu_message(user: users.User, message: messages.MenuMessage):
+        text = komidabot.menu.get_menu_text(message.menu, message.translator, user.get_locale(),
+                                            get_app().config.get('TRANSLATION_DEADLINE'))
 
         if text is None:
             return messages.MessageSendResult.ERROR
@@ -54,10 +99,10 @@ class MessageHandler(messages.MessageHandler):
             'messaging_type': TYPE_REPLY if triggers.SenderAspect in message.trigger else TYPE_SUBSCRIPTION,
         }
 
-        return get_app().bot_interfaces['facebook']['api_interface'].post_send_api(data)
+        return data
 
     @staticmethod
-    def _send_template_message(user_id: users.UserId, message: 'TemplateMessage') -> messages.MessageSendResult:
+    def _prepare_template_message(user_id: users.UserId, message: 'TemplateMessage'):
         data = {
             'recipient': {
                 'id': user_id.id
@@ -71,7 +116,7 @@ class MessageHandler(messages.MessageHandler):
             'messaging_type': TYPE_REPLY if triggers.SenderAspect in message.trigger else TYPE_SUBSCRIPTION,
         }
 
-        return get_app().bot_interfaces['facebook']['api_interface'].post_send_api(data)
+        return data
 
 
 class TemplateMessage(messages.Message):
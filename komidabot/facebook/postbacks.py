@@ -125,14 +125,16 @@ def settings_subscriptions(trigger: triggers.Trigger):
 
         elements_list[-1].extend(elements)
 
-    sender.send_message(messages.TextMessage(trigger, localisation.REPLY_EXPERIMENTAL_DISPLAY(locale)))
+    message_list = [messages.TextMessage(trigger, localisation.REPLY_EXPERIMENTAL_DISPLAY(locale))]
 
     for elements in elements_list:
         payload = {
             'template_type': 'generic',
             'elements': elements,
         }
-        sender.send_message(fb_messages.TemplateMessage(trigger, payload))
+        message_list.append(fb_messages.TemplateMessage(trigger, payload))
+
+    sender.send_messages(message_list)
 
     return None
 
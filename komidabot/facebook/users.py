@@ -1,19 +1,45 @@
-from typing import Optional, Union
+import atexit
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Set, Union
+
+from apscheduler.triggers.cron import CronTrigger
+from cachetools import TTLCache
 
 import komidabot.facebook.constants as fb_constants
 import komidabot.messages as messages
 import komidabot.models as models
 import komidabot.users as users
+from extensions import db
 from komidabot.app import get_app
+from komidabot.facebook.api_interface import SENDER_ACTION_MARK_SEEN, SENDER_ACTION_TYPING_ON
 from komidabot.facebook.messages import MessageHandler as FBMessageHandler
+from komidabot.translation import LANGUAGE_DUTCH
 
 __all__ = ['User', 'UserManager']
 
+# Locales are refreshed from Facebook once they're older than this
+LOCALE_MAX_AGE = datetime.timedelta(days=7)
+LOCALE_REFRESH_LIMIT = 1000  # Maximum number of locales refreshed per run of the scheduled refresh
+
+# Number of seconds handling a message may take before the typing indicator is shown
+TYPING_INDICATOR_DELAY = 0.5
+
 
 class UserManager(users.UserManager):
     def __init__(self):
         self.message_handler = FBMessageHandler()
 
+        # Internal id -> locale reported by Facebook
+        self.locale_cache = TTLCache(maxsize=10000, ttl=6 * 60 * 60)
+        self.locale_cache_lock = threading.Lock()
+
+        # Locale lookups never happen on the thread that needs the locale
+        self._locale_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fb-locales')
+        atexit.register(ThreadPoolExecutor.shutdown, self._locale_executor)  # Ensure cleanup of resources
+        self._locale_lookups: 'Set[str]' = set()
+
     # def get_subscribed_users(self, day: models.Day) -> 'List[users.User]':
     #     # TODO: Starting March 4th 2020, facebook subscriptions will no longer be available
     #     #       https://developers.facebook.com/docs/messenger-platform/policy/policy-overview/
@@ -41,9 +67,94 @@ class UserManager(users.UserManager):
         data = postbacks.generate_postback_data(True, app.config.get('PRODUCTION'))
         app.bot_interfaces['facebook']['api_interface'].post_profile_api(data)
 
+        app.bot.scheduler.add_job(UserManager._refresh_stale_locales_job, CronTrigger(minute=30, second=0),
+                                  args=(app.app_context, self),
+                                  id='refresh_locales', name='Refresh stale Facebook locales', replace_existing=True)
+
     def get_identifier(self):
         return fb_constants.PROVIDER_ID
 
+    def get_cached_locale(self, internal_id: str) -> 'Optional[str]':
+        with self.locale_cache_lock:
+            return self.locale_cache.get(internal_id)
+
+    def set_cached_locale(self, internal_id: str, locale: str):
+        with self.locale_cache_lock:
+            self.locale_cache[internal_id] = locale
+
+    def schedule_locale_lookup(self, internal_id: str):
+        """
+        Looks up the locale of a user in the background, so it is available the next time it's needed.
+        """
+        app = get_app()
+        if not app.config.get('PAGE_ACCESS_TOKEN'):
+            return  # Can't reach Facebook anyway
+
+        with self.locale_cache_lock:
+            if internal_id in self._locale_lookups:
+                return  # Already looking it up
+            self._locale_lookups.add(internal_id)
+
+        self._locale_executor.submit(self._lookup_locales, app._get_current_object(), [internal_id])
+
+    def refresh_stale_locales(self, limit: int = LOCALE_REFRESH_LIMIT) -> int:
+        """
+        Refreshes the stored locales that are missing or out of date using batch requests.
+        :return: The number of locales that were refreshed.
+        """
+        refreshed_before = datetime.datetime.now() - LOCALE_MAX_AGE
+        internal_ids = models.AppUser.find_stale_provider_locales(fb_constants.PROVIDER_ID, refreshed_before, limit)
+
+        return self._store_locales(internal_ids)
+
+    def _lookup_locales(self, app, internal_ids: 'Iterable[str]'):
+        internal_ids = list(internal_ids)
+
+        try:
+            with app.app_context():
+                self._store_locales(internal_ids)
+        except Exception as e:
+            app.logger.exception(e)
+        finally:
+            with self.locale_cache_lock:
+                self._locale_lookups.difference_update(internal_ids)
+
+    def _store_locales(self, internal_ids: 'Iterable[str]') -> int:
+        api_interface = get_app().bot_interfaces['facebook']['api_interface']
+
+        internal_ids = list(internal_ids)
+        locales = api_interface.lookup_locales(internal_ids)
+
+        models.AppUser.set_provider_locales(fb_constants.PROVIDER_ID, locales)
+        # XXX: Failed lookups are only tried again once the locale is stale, users that can't be looked up (blocked or
+        #      removed accounts) would otherwise use up the limit of every refresh
+        models.AppUser.set_provider_locales_refreshed(fb_constants.PROVIDER_ID,
+                                                      [internal_id for internal_id in internal_ids
+                                                       if internal_id not in locales])
+        db.session.commit()
+
+        for internal_id, locale in locales.items():
+            self.set_cached_locale(internal_id, locale)
+
+        return len(locales)
+
+    @staticmethod
+    def _refresh_stale_locales_job(context, manager: 'UserManager'):
+        with context():
+            app = get_app()
+            if app.config.get('DISABLED'):
+                return
+
+            try:
+                refreshed = manager.refresh_stale_locales()
+
+                if app.config.get('VERBOSE'):
+                    print('Refreshed {} Facebook locales'.format(refreshed), flush=True)
+            except Exception as e:
+                app.bot.notify_error(e)
+
+                app.logger.exception(e)
+
 
 class User(users.User):
     def __init__(self, manager: UserManager, id_str: str):
@@ -51,12 +162,26 @@ class User(users.User):
         self._id = id_str
 
     def get_locale(self) -> 'Optional[str]':
-        stored_value = super().get_locale()
+        """
+        Gets the language chosen by the user, or the locale reported by Facebook. This never waits on Facebook, if the
+        locale isn't known yet it is looked up in the background and Dutch is used in the meantime.
+        """
+        user = self.get_db_user()
+
+        if user is not None and user.language:
+            return user.language
+
+        cached_value = self._manager.get_cached_locale(self._id)
+        if cached_value:
+            return cached_value
+
+        if user is not None and user.provider_locale:
+            self._manager.set_cached_locale(self._id, user.provider_locale)
+            return user.provider_locale
 
-        if not stored_value:
-            return get_app().bot_interfaces['facebook']['api_interface'].lookup_locale(self._id)
+        self._manager.schedule_locale_lookup(self._id)
 
-        return stored_value
+        return LANGUAGE_DUTCH
 
     def get_provider_name(self) -> 'str':
         return fb_constants.PROVIDER_ID
@@ -77,7 +202,17 @@ class User(users.User):
         return self._manager.message_handler
 
     def mark_message_seen(self):
-        return get_app().bot_interfaces['facebook']['api_interface'].post_send_api({
-            'recipient': {'id': self._id},
-            'sender_action': 'mark_seen'
-        })
+        get_app().bot_interfaces['facebook']['api_interface'].post_sender_action(self._id, SENDER_ACTION_MARK_SEEN)
+
+    def start_typing_timer(self, delay: float = TYPING_INDICATOR_DELAY) -> threading.Timer:
+        """
+        Shows the typing indicator if the timer isn't cancelled within the delay, so the user only sees it when handling
+        their message takes a while. Facebook hides it again once a message is sent.
+        """
+        api_interface = get_app().bot_interfaces['facebook']['api_interface']
+
+        timer = threading.Timer(delay, api_interface.post_sender_action, args=(self._id, SENDER_ACTION_TYPING_ON))
+        timer.daemon = True
+        timer.start()
+
+        return timer
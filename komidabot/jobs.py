@@ -0,0 +1,137 @@
+import atexit
+import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Tuple
+
+from extensions import db
+from komidabot.debug.state import DebuggableException
+from komidabot.models import Campus
+from komidabot.models_jobs import Job
+from komidabot.pretranslation import pretranslate
+
+__all__ = ['JOB_MENU_UPDATE', 'JobRunner', 'job_to_object']
+
+JOB_MENU_UPDATE = 'menu_update'
+
+
+def _run_menu_update(app, job_id: int, arguments: Dict[str, Any]):
+    from komidabot.komidabot import update_menus
+
+    progress = dict()
+
+    def on_progress(campus: Campus, done: int, total: int):
+        now = datetime.datetime.now()
+
+        if campus.short_name not in progress:
+            progress[campus.short_name] = {
+                'done': 0,
+                'total': total,
+                'started_on': now.isoformat(),
+                'finished_on': None,
+                'duration': None,
+            }
+
+        campus_progress = progress[campus.short_name]
+        campus_progress['done'] = done
+
+        if done == total:
+            started_on = datetime.datetime.fromisoformat(campus_progress['started_on'])
+
+            campus_progress['finished_on'] = now.isoformat()
+            campus_progress['duration'] = (now - started_on).total_seconds()
+
+        Job.update_progress(job_id, progress)
+
+    dates = [datetime.date.fromisoformat(date) for date in arguments.get('dates', [])]
+
+    # Don't run at the same time as the scheduled menu updates
+    with app.bot.menu_update_lock:
+        translatable_ids = update_menus(*arguments.get('campuses', []), dates=dates, on_progress=on_progress)
+
+    result = pretranslate(translatable_ids, app.translator)
+
+    progress['pretranslation'] = result._asdict()
+    Job.update_progress(job_id, progress)
+
+
+JOB_TYPES: 'Dict[str, Callable[[Any, int, Dict[str, Any]], None]]' = {
+    JOB_MENU_UPDATE: _run_menu_update,
+}
+
+
+class JobRunner:
+    """
+    Runs long running jobs on a dedicated pool of threads, separate from the threads handling messages and requests.
+    The state of the jobs is stored in the database, so it can be queried from any process.
+    """
+
+    def __init__(self, the_app, max_workers: int = 1):
+        self.app = the_app
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jobs')
+        atexit.register(ThreadPoolExecutor.shutdown, self.executor)  # Ensure cleanup of resources
+
+    def start(self):
+        """
+        Marks the jobs that were left queued or running by a previous process as failed, as nothing will run them
+        anymore. Only the process serving the bot should do this, otherwise it would fail the jobs that it is running.
+        """
+        with self.app.app_context():
+            interrupted = Job.fail_unfinished('Interrupted: the process running the job was stopped')
+            db.session.commit()
+
+        if interrupted:
+            print('Marked {} interrupted jobs as failed'.format(interrupted), flush=True)
+
+    def submit(self, job_type: str, arguments: Dict[str, Any]) -> 'Tuple[int, Future]':
+        """
+        Stores a new job and queues it for execution. Must be called from an application context.
+        :return: A 2-tuple containing the id of the job and a future that completes once the job has finished.
+        """
+        if job_type not in JOB_TYPES:
+            raise ValueError('Unknown job type: {}'.format(job_type))
+
+        job = Job.create(job_type, arguments)
+        db.session.commit()
+
+        return job.id, self.executor.submit(self._run, job.id)
+
+    def _run(self, job_id: int):
+        with self.app.app_context():
+            job = Job.find_by_id(job_id)
+            job.set_running()
+            db.session.commit()
+
+            try:
+                JOB_TYPES[job.job_type](self.app, job_id, job.get_arguments())
+
+                job = Job.find_by_id(job_id)
+                job.set_done()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+
+                job = Job.find_by_id(job_id)
+                job.set_failed('{}: {}'.format(type(e).__name__, e))
+                db.session.commit()
+
+                self.app.bot.notify_error(e)
+
+                if isinstance(e, DebuggableException):
+                    e.print_info(self.app.logger)
+                else:
+                    self.app.logger.exception(e)
+
+
+def job_to_object(job: Job) -> Dict[str, Any]:
+    return {
+        'id': job.id,
+        'type': job.job_type,
+        'status': job.status.name,
+        'progress': job.get_progress(),
+        'error': job.error,
+        'created_on': job.created_on.isoformat(),
+        'started_on': job.started_on.isoformat() if job.started_on is not None else None,
+        'finished_on': job.finished_on.isoformat() if job.finished_on is not None else None,
+        'duration': job.get_duration(),
+    }
@@ -1,44 +1,68 @@
 import atexit
 import datetime
 import threading
-from typing import List
+from typing import Callable, List, Optional, Set
 
 from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
 
-import komidabot.external_menu as external_menu
+import komidabot.bulk_io as bulk_io
 import komidabot.facebook.nlp_dates as nlp_dates
 import komidabot.localisation as localisation
+import komidabot.menu_ingestion as menu_ingestion
 import komidabot.messages as messages
 import komidabot.triggers as triggers
 from extensions import db
 from komidabot.app import get_app
 from komidabot.bot import Bot
-from komidabot.debug.state import DebuggableException, ProgramStateTrace, SimpleProgramState
-from komidabot.models import Campus, ClosingDays, Day, Menu
-from komidabot.models import create_standard_values, import_dump, recreate_db
+from komidabot.debug.administration import AdminNotifier
+from komidabot.debug.state import DebuggableException
+from komidabot.jobs import JOB_MENU_UPDATE
+from komidabot.models import Campus, ClosingDays, Day, DeliveryLedger, Menu
+from komidabot.models import create_standard_values, recreate_db
+from komidabot.pretranslation import pretranslate
+
+DAILY_MENU_TIME = datetime.time(hour=10, minute=0)
+
+# Menus updated less than this long ago are considered fresh, and don't need to be updated again
+MENU_UPDATE_FRESHNESS = datetime.timedelta(minutes=10)
+
+
+def get_menu_update_dates(today: datetime.date) -> 'List[datetime.date]':
+    week_start = today + datetime.timedelta(days=-today.weekday())
+
+    dates = [week_start + datetime.timedelta(days=i) for i in range(today.weekday(), 5)]
+    if today.weekday() >= 3:
+        dates += [week_start + datetime.timedelta(days=7 + i) for i in range(5)]
+
+    return dates
 
 
 class Komidabot(Bot):
     def __init__(self, the_app):
         self.lock = threading.Lock()
 
+        # Held while the menus are being updated, so the daily menu is never sent out from a half-updated database
+        self.menu_update_lock = threading.Lock()
+        self.menu_updated_at: Optional[datetime.datetime] = None
+
         self.scheduler = BackgroundScheduler(
             jobstores={'default': MemoryJobStore()},
             executors={'default': ThreadPoolExecutor(max_workers=4)},
             job_defaults={'misfire_grace_time': 60}
         )
 
-        self._handling_error = False
-
-        self.scheduler.start()
-        atexit.register(BackgroundScheduler.shutdown, self.scheduler)  # Ensure cleanup of resources
+        self.admin_notifier = AdminNotifier(the_app)
+        if not the_app.config.get('TESTING'):
+            self.admin_notifier.start()
 
         # Scheduled jobs should work with DST
 
-        @self.scheduler.scheduled_job(CronTrigger(day_of_week='mon-fri', hour=10, minute=0, second=0),
+        @self.scheduler.scheduled_job(CronTrigger(day_of_week='mon-fri', hour=DAILY_MENU_TIME.hour,
+                                                  minute=DAILY_MENU_TIME.minute, second=0),
                                       args=(the_app.app_context, self),
                                       id='daily_menu', name='Daily menu notifications')
         def daily_menu(context, bot: 'Komidabot'):
@@ -46,7 +70,22 @@ class Komidabot(Bot):
                 if get_app().config.get('DISABLED'):
                     return
 
-                bot.trigger_received(triggers.SubscriptionTrigger())
+                today = datetime.datetime.today().date()
+
+                # This also fires at the same time as the hourly menu update, wait for the update if it's already
+                # running, or run it ourselves first so the menus that get sent out are fresh
+                try:
+                    bot.update_menus_if_stale(get_menu_update_dates(today))
+                except DebuggableException as e:
+                    bot.notify_error(e)
+
+                    e.print_info(get_app().logger)
+                except Exception as e:
+                    bot.notify_error(e)
+
+                    get_app().logger.exception(e)
+
+                bot.schedule_daily_menus(today)
 
         @self.scheduler.scheduled_job(CronTrigger(minute=0, second=0),  # Run every hour to find changes
                                       args=(the_app.app_context, self),
@@ -58,13 +97,8 @@ class Komidabot(Bot):
 
                 try:
                     today = datetime.datetime.today().date()
-                    week_start = today + datetime.timedelta(days=-today.weekday())
 
-                    dates = [week_start + datetime.timedelta(days=i) for i in range(today.weekday(), 5)]
-                    if today.weekday() >= 3:
-                        dates += [week_start + datetime.timedelta(days=7 + i) for i in range(5)]
-
-                    update_menus(dates=dates)
+                    bot.update_menus_if_stale(get_menu_update_dates(today))
                 except DebuggableException as e:
                     bot.notify_error(e)
 
@@ -74,6 +108,81 @@ class Komidabot(Bot):
 
                     get_app().logger.exception(e)
 
+    def start(self, the_app):
+        """
+        Starts running the scheduled jobs. Only the process serving the bot should do this, otherwise every CLI command
+        would also send out the daily menu.
+        """
+        self.scheduler.start()
+        atexit.register(BackgroundScheduler.shutdown, self.scheduler)  # Ensure cleanup of resources
+
+        @self.scheduler.scheduled_job(DateTrigger(),  # Run once on startup
+                                      args=(the_app.app_context, self),
+                                      id='resume_daily_menu', name='Resume interrupted daily menu notifications')
+        def resume_daily_menu(context, bot: 'Komidabot'):
+            from komidabot.subscriptions.daily_menu import CHANNEL_ID as DAILY_MENU_ID
+
+            with context():
+                if get_app().config.get('DISABLED'):
+                    return
+
+                # If the process was restarted while sending out the daily menu, continue where the ledger left off
+                today = datetime.datetime.today().date()
+                if DeliveryLedger.has_pending(today, DAILY_MENU_ID):
+                    bot.schedule_daily_menus(today)
+
+    def update_menus_if_stale(self, dates: 'List[datetime.date]') -> bool:
+        """
+        Updates the menus, unless they were updated recently. If an update is already running, this waits for it to
+        finish instead of starting another one.
+
+        :return: True if the menus were updated
+        """
+        with self.menu_update_lock:
+            now = datetime.datetime.now()
+            if self.menu_updated_at is not None and now - self.menu_updated_at < MENU_UPDATE_FRESHNESS:
+                return False
+
+            translatable_ids = update_menus(dates=dates)
+
+            # Translate the new menus ahead of time, so replies don't have to wait on the translation service
+            result = pretranslate(translatable_ids, get_app().translator)
+            if result.failed > 0:
+                print('Pre-translation: translated {}, failed {}'.format(result.translated, result.failed), flush=True)
+
+            self.menu_updated_at = datetime.datetime.now()
+            return True
+
+    def schedule_daily_menus(self, date: datetime.date):
+        """
+        Spreads out the daily menu over the configured window. Slots that are already due are run immediately.
+        """
+        app = get_app()
+        window = app.config.get('DAILY_MENU_WINDOW', 0)
+        slots = max(app.config.get('DAILY_MENU_SLOTS', 1), 1)
+
+        start = datetime.datetime.combine(date, DAILY_MENU_TIME)
+        now = datetime.datetime.now()
+
+        for slot in range(slots):
+            run_date = start + datetime.timedelta(seconds=window * slot / slots)
+            trigger = triggers.SubscriptionTrigger(date=date, slot=slot, slots=slots)
+
+            # Slots can queue up behind each other on the bot lock, they should still run when they're late
+            self.scheduler.add_job(Komidabot._daily_menu_slot, DateTrigger(run_date if run_date > now else None),
+                                   args=(app.app_context, self, trigger),
+                                   id='daily_menu_slot_{}'.format(slot),
+                                   name='Daily menu notifications (slot {}/{})'.format(slot + 1, slots),
+                                   replace_existing=True, misfire_grace_time=None)
+
+    @staticmethod
+    def _daily_menu_slot(context, bot: 'Komidabot', trigger: triggers.SubscriptionTrigger):
+        with context():
+            if get_app().config.get('DISABLED'):
+                return
+
+            bot.trigger_received(trigger)
+
     def trigger_received(self, trigger: triggers.Trigger):
         with self.lock:  # TODO: Maybe only lock on critical sections?
             app = get_app()
@@ -110,11 +219,13 @@ class Komidabot(Bot):
                     locale = sender.get_locale()
 
                 if triggers.NewUserAspect in trigger:
-                    sender.send_message(messages.TextMessage(trigger, localisation.REPLY_NEW_USER(locale)))
                     msg = localisation.REPLY_INSTRUCTIONS(locale).format(
                         campuses=', '.join([campus.short_name.lower() for campus in campuses if campus.active])
                     )
-                    sender.send_message(messages.TextMessage(trigger, msg))
+                    sender.send_messages([
+                        messages.TextMessage(trigger, localisation.REPLY_NEW_USER(locale)),
+                        messages.TextMessage(trigger, msg),
+                    ])
                     sender.set_is_notified_new_site(True)
                     db.session.commit()
 
@@ -134,13 +245,14 @@ class Komidabot(Bot):
                                 return
                             recreate_db()
                             create_standard_values()
-                            import_dump(app.config['DUMP_FILE'])
+                            with open(app.config['DUMP_FILE']) as file:
+                                bulk_io.import_dump(file)
                             sender.send_message(messages.TextMessage(trigger, 'Setup done'))
                             return
                         elif split[0] == 'update':
-                            sender.send_message(messages.TextMessage(trigger, 'Updating menus...'))
-                            update_menus(*split[1:])
-                            sender.send_message(messages.TextMessage(trigger, 'Done updating menus...'))
+                            job_id, _ = app.job_runner.submit(JOB_MENU_UPDATE, {'campuses': split[1:]})
+                            sender.send_message(messages.TextMessage(trigger, 'Updating menus in the background '
+                                                                              '(job {})'.format(job_id)))
                             return
                         elif split[0] == 'psid':  # TODO: Deprecated?
                             sender.send_message(messages.TextMessage(trigger, 'Your ID is {}'.format(sender.id.id)))
@@ -255,7 +367,8 @@ class Komidabot(Bot):
                 closed = ClosingDays.find_is_closed(campus, date)
 
                 if closed:
-                    translation = closed.translatable.get_translation(locale, app.translator)
+                    translation = closed.translatable.get_translation(locale, app.translator,
+                                                                      app.config.get('TRANSLATION_DEADLINE'))
 
                     sender.send_message(messages.TextMessage(trigger, localisation.REPLY_CAMPUS_CLOSED(locale)
                                                              .format(campus=campus.name, date=str(date),
@@ -281,27 +394,16 @@ class Komidabot(Bot):
                 #         sender.send_message(messages.TextMessage(trigger, localisation.REPLY_USE_AT_ADMIN(locale)))
 
     def notify_error(self, error: Exception):
-        if self._handling_error:
-            # Already handling an error, or we failed handling the previous error, so don't try handling more
-            return
-        self._handling_error = True
-
         self.message_admins(messages.ExceptionMessage(triggers.Trigger(), error))
 
-        self._handling_error = False
-
     def message_admins(self, message: messages.Message):
-        from komidabot.debug.administration import notify_admins
-
-        with self.lock:
-            notify_admins(message)
+        # Doesn't take the bot lock, this is safe to call while handling a trigger
+        self.admin_notifier.notify(message)
 
 
 def dispatch_daily_menus(trigger: triggers.SubscriptionTrigger):
     from komidabot.subscriptions.daily_menu import CHANNEL_ID as DAILY_MENU_ID
 
-    # limiter = Limiter(20)  # Limit to 20 messages per second
-
     date = trigger.date or datetime.datetime.now().date()
     day = Day(date.isoweekday())
 
@@ -310,11 +412,20 @@ def dispatch_daily_menus(trigger: triggers.SubscriptionTrigger):
     verbose = app.config.get('VERBOSE')
 
     if verbose:
-        print('Sending out subscription for {} ({})'.format(date, day.name), flush=True)
+        if trigger.slot is None:
+            print('Sending out subscription for {} ({})'.format(date, day.name), flush=True)
+        else:
+            print('Sending out subscription for {} ({}), slot {}/{}'.format(date, day.name, trigger.slot + 1,
+                                                                            trigger.slots), flush=True)
 
     message = messages.SubscriptionMenuMessage(trigger, date, app.translator)
     app.subscription_manager.deliver_message(DAILY_MENU_ID, message)
 
+    if verbose:
+        report = DeliveryLedger.get_report(date, DAILY_MENU_ID)
+        print('Subscription for {} delivered to {}/{} users ({} failed)'.format(date, report.delivered, report.total,
+                                                                                report.failed), flush=True)
+
     # user_manager = app.user_manager
     # changed = False
     #
@@ -391,49 +502,24 @@ def dispatch_daily_menus(trigger: triggers.SubscriptionTrigger):
     #     db.session.commit()
 
 
-def update_menus(*campuses: str, dates: 'List[datetime.date]' = None):
-    debug_state = ProgramStateTrace()
+def update_menus(*campuses: str, dates: 'List[datetime.date]' = None,
+                 on_progress: 'Callable[[Campus, int, int], None]' = None, max_workers: int = 1,
+                 dry_run: bool = False, stats: 'menu_ingestion.MenuUpdateStats' = None) -> 'Set[int]':
+    """
+    Updates the menus of the given campuses, or all active campuses if none are given. See menu_ingestion.update_menus
+    for the other parameters.
 
+    :return: The ids of the translatables used by the updated menus and closing days, these can be translated ahead of
+             time using pretranslation.pretranslate.
+    """
     campus_list = Campus.get_all_active()
 
     if len(campuses) > 0:
-        campus_list = [campus for campus in campus_list if campus.short_name not in campuses]
+        campus_list = [campus for campus in campus_list if campus.short_name in campuses]
 
     if not dates:
         today = datetime.datetime.today().date()
-        dates = [
-            today,
-            today + datetime.timedelta(days=1),
-            today + datetime.timedelta(days=2),
-            today + datetime.timedelta(days=3),
-            today + datetime.timedelta(days=4),
-            today + datetime.timedelta(days=5),
-            today + datetime.timedelta(days=6),
-            today + datetime.timedelta(days=7),
-        ]
-
-    for campus in campus_list:
-        for date in dates:
-            if date.isoweekday() in [6, 7]:
-                continue
-
-            closed = ClosingDays.find_is_closed(campus, date)
-
-            if closed:
-                continue  # Campus closed, don't try to find a menu
-
-            with debug_state.state(SimpleProgramState('Campus menu update', {'campus': campus.short_name,
-                                                                             'date': str(date)})):
-                data_raw = external_menu.fetch_raw(campus, date)
-                data_parsed = external_menu.parse_fetched(data_raw)
-                data_processed = external_menu.process_parsed(data_parsed)
-
-                if data_processed is None:
-                    continue  # No data
-
-                assert campus.short_name == data_processed['campus']
-                assert date.isoformat() == data_processed['date']
-
-                external_menu.update_menu(data_processed)
-
-    db.session.commit()
+        dates = [today + datetime.timedelta(days=i) for i in range(8)]
+
+    return menu_ingestion.update_menus(campus_list, dates, max_workers=max_workers, dry_run=dry_run,
+                                       on_progress=on_progress, stats=stats)
@@ -0,0 +1,195 @@
+import datetime
+import glob
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import komidabot.external_menu as external_menu
+import komidabot.models as models
+from extensions import db
+from komidabot.models_training import LearningDatapoint
+from komidabot.screenshots import decode_screenshot
+
+__all__ = ['LearningDataImportResult', 'upload_learning_data']
+
+MAX_WORKERS = 4
+COMMIT_INTERVAL = 20  # Number of files imported per transaction
+
+RAW_MENU_DIRECTORY = 'raw'
+
+
+class LearningDataImportResult(NamedTuple):
+    imported: int
+    skipped: int
+    failed: int
+    datapoints: int
+
+
+class _PreparedFile(NamedTuple):
+    file: str
+    rows: 'Optional[List[Dict[str, Any]]]'  # None if the file could not be imported
+
+
+def upload_learning_data(the_app, directory: str, max_workers: int = MAX_WORKERS,
+                         refetch: bool = False) -> LearningDataImportResult:
+    """
+    Creates datapoints from the learning data files in a directory, by matching the courses in each file to the
+    processed menu of that campus and day. Files are prepared in parallel, the datapoints are inserted in bulk.
+
+    Raw menus are kept in a subdirectory, so running this again doesn't fetch them again. Files for a campus and day
+    that already have datapoints are skipped, so an interrupted import can just be restarted.
+
+    :param the_app: The app, needed to give worker threads their own application context.
+    :param refetch: Ignores the raw menus fetched before.
+    """
+    files = sorted(glob.glob(os.path.join(directory, '*.json')))
+
+    raw_directory = os.path.join(directory, RAW_MENU_DIRECTORY)
+    os.makedirs(raw_directory, exist_ok=True)
+
+    existing = _get_existing_days()
+
+    imported = 0
+    skipped = 0
+    failed = 0
+    datapoints = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='learning-data') as executor:
+        prepared = executor.map(lambda file: _prepare_file(the_app, file, raw_directory, existing, refetch), files)
+
+        rows = []
+        pending = 0  # Files with datapoints that aren't committed yet
+
+        for result in prepared:
+            if result.rows is None:
+                failed += 1
+                continue
+
+            if not result.rows:
+                skipped += 1
+                continue
+
+            imported += 1
+            datapoints += len(result.rows)
+
+            rows.extend(result.rows)
+            pending += 1
+
+            if pending >= COMMIT_INTERVAL:
+                _insert_datapoints(rows)
+                rows = []
+                pending = 0
+
+        if rows:
+            _insert_datapoints(rows)
+
+    return LearningDataImportResult(imported, skipped, failed, datapoints)
+
+
+def _insert_datapoints(rows: 'List[Dict[str, Any]]'):
+    db.session.execute(LearningDatapoint.__table__.insert(), rows)
+    db.session.commit()
+
+    print('Inserted {} datapoints'.format(len(rows)), flush=True)
+
+
+def _get_existing_days() -> 'Set[Tuple[str, datetime.date]]':
+    query = db.session.query(models.Campus.short_name, LearningDatapoint.menu_day).join(
+        LearningDatapoint, LearningDatapoint.campus_id == models.Campus.id
+    ).distinct()
+
+    return {(short_name, menu_day) for short_name, menu_day in query}
+
+
+def _prepare_file(the_app, file: str, raw_directory: str, existing: 'Set[Tuple[str, datetime.date]]',
+                  refetch: bool) -> _PreparedFile:
+    try:
+        with open(file, 'r') as f:
+            data = json.load(f)
+
+        date = datetime.date.fromisoformat(data['date'])
+
+        if (data['restaurant'], date) in existing:
+            return _PreparedFile(file, [])
+
+        # Every worker thread needs its own application context, and with it its own database session
+        with the_app.app_context():
+            campus = models.Campus.get_by_short_name(data['restaurant'])
+
+            data_raw = _get_raw_menu(campus, date, raw_directory, refetch)
+            data_parsed = external_menu.parse_fetched(data_raw)
+            data_processed = external_menu.process_parsed(data_parsed)
+
+            processed_menu: list = data_processed['menu'] if data_processed is not None else []
+
+            rows = []
+
+            for reference_item, processed_item in _match_items(data['menu'], processed_menu):
+                rows.append({
+                    'campus_id': campus.id,
+                    'menu_day': date,
+                    'screenshot_hash': the_app.blob_storage.put(decode_screenshot(reference_item['screenshot'])),
+                    'processed_data': json.dumps(processed_item),
+                })
+
+            return _PreparedFile(file, rows)
+    except json.JSONDecodeError:
+        print('Could not decode:', file, flush=True)
+    except Exception as e:
+        print('Failure preparing learning data for:', file, flush=True)
+
+        traceback.print_tb(e.__traceback__)
+        print(e, flush=True, file=sys.stderr)
+
+    return _PreparedFile(file, None)
+
+
+def _get_raw_menu(campus: models.Campus, date: datetime.date, raw_directory: str, refetch: bool) -> 'Optional[Any]':
+    path = os.path.join(raw_directory, '{}_{}.raw.json'.format(date.isoformat(), campus.short_name))
+
+    if not refetch and os.path.isfile(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    data_raw = external_menu.fetch_raw(campus, date)
+
+    # XXX: No menu and a failed request look the same, so only actual menus are kept
+    if data_raw is not None:
+        with open(path, 'w') as f:
+            json.dump(data_raw, f)
+
+    return data_raw
+
+
+def _match_items(reference_menu: 'List[Dict]', processed_menu: 'List[Dict]') -> 'List[Tuple[Dict, Dict]]':
+    """
+    Matches courses by name, each processed item is matched at most once.
+    """
+    by_name: 'Dict[str, List[Dict]]' = dict()
+
+    for processed_item in processed_menu:
+        by_name.setdefault(processed_item['name']['nl'].lower(), []).append(processed_item)
+
+    # Keep the order of the processed menu for items with the same name
+    for items in by_name.values():
+        items.reverse()
+
+    matched = []
+
+    for reference_item in reference_menu:
+        items = by_name.get(reference_item['course_name'].lower())
+
+        if not items:
+            print('Could not match reference item', reference_item['course_name'].lower(), flush=True)
+            continue
+
+        matched.append((reference_item, items.pop()))
+
+    for items in by_name.values():
+        for processed_item in items:
+            print('Could not match processed item', processed_item['name']['nl'].lower(), flush=True)
+
+    return matched
@@ -0,0 +1,132 @@
+import json
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+import komidabot.external_menu as external_menu
+import komidabot.models as models
+from extensions import db
+from komidabot.models_training import LearningDatapoint, LearningDatapointSubmission
+
+__all__ = ['clear_cache', 'evaluate_classifier', 'get_evaluation']
+
+_COURSE_TYPES = len(models.CourseType)
+_COURSE_SUB_TYPES = len(models.CourseSubType)
+
+_cache_lock = threading.Lock()
+_cache: 'Optional[Tuple[int, Dict[str, Any]]]' = None  # Number of submissions evaluated, evaluation
+
+
+def get_evaluation() -> 'Dict[str, Any]':
+    """
+    Gets the evaluation of the course classifier, it is only evaluated again once new submissions come in. Submissions
+    are never changed, and the classifier can only change with a restart.
+    """
+    global _cache
+
+    count = LearningDatapointSubmission.query.count()
+
+    with _cache_lock:
+        if _cache is not None and _cache[0] == count:
+            return _cache[1]
+
+    result = evaluate_classifier()
+
+    with _cache_lock:
+        _cache = (result['submissions'], result)
+
+    return result
+
+
+def clear_cache():
+    global _cache
+
+    with _cache_lock:
+        _cache = None
+
+
+def evaluate_classifier() -> 'Dict[str, Any]':
+    """
+    Evaluates external_menu.classify_course against the submissions of learners. The classifier is run again on the
+    stored data of every datapoint, so changes to the rules are reflected without importing the datapoints again.
+    """
+    rows = db.session.query(LearningDatapointSubmission.datapoint_id, LearningDatapointSubmission.submission_data,
+                            LearningDatapoint.processed_data).join(
+        LearningDatapoint, LearningDatapoint.id == LearningDatapointSubmission.datapoint_id
+    ).all()
+
+    # Every datapoint is only classified once, even if it has multiple submissions
+    classified: 'Dict[int, Tuple[int, int, int, int]]' = dict()
+
+    for datapoint_id, _, processed_data in rows:
+        if datapoint_id not in classified:
+            processed = json.loads(processed_data)
+            course_type, course_sub_type, rule = external_menu.classify_course(processed['course_attributes'],
+                                                                               processed['name']['nl'],
+                                                                               processed['price_students'])
+            classified[datapoint_id] = (course_type.value, course_sub_type.value,
+                                        external_menu.RULES.index(rule),
+                                        models.CourseType[processed['course_type']].value)
+
+    submissions = [json.loads(submission_data) for _, submission_data, _ in rows]
+
+    predicted = np.array([classified[datapoint_id] for datapoint_id, _, _ in rows], dtype=np.int64).reshape(-1, 4)
+    predicted_type = predicted[:, 0]
+    predicted_sub_type = predicted[:, 1]
+    rule = predicted[:, 2]
+    stored_type = predicted[:, 3]
+
+    actual_type = np.array([s['course_type'] for s in submissions], dtype=np.int64)
+    actual_sub_type = np.array([s['course_sub_type'] for s in submissions], dtype=np.int64)
+    name_correct = np.array([s['course_name_correct'] for s in submissions], dtype=bool)
+    price_students_correct = np.array([s['price_students_correct'] for s in submissions], dtype=bool)
+    price_staff_correct = np.array([s['price_staff_correct'] for s in submissions], dtype=bool)
+
+    # XXX: Learners can submit a negative course type if the datapoint isn't a course, or they don't know
+    has_type = actual_type > 0
+
+    type_correct = predicted_type[has_type] == actual_type[has_type]
+    sub_type_correct = predicted_sub_type == actual_sub_type
+
+    rule_total = np.bincount(rule[has_type], minlength=len(external_menu.RULES))
+    rule_correct = np.bincount(rule[has_type], weights=type_correct, minlength=len(external_menu.RULES))
+
+    return {
+        'submissions': len(rows),
+        'datapoints': len(classified),
+        'course_type': {
+            'accuracy': _rate(type_correct),
+            'without_type': int(np.count_nonzero(~has_type)),
+            # Rows are the submitted types, columns the predicted types, both in order of their value
+            'labels': [course_type.name for course_type in models.CourseType],
+            'confusion_matrix': _confusion_matrix(actual_type[has_type], predicted_type[has_type], _COURSE_TYPES),
+            # Submissions of which the prediction differs from the stored one, due to changes to the rules
+            'changed': int(np.count_nonzero(predicted_type != stored_type)),
+        },
+        'course_sub_type': {
+            'accuracy': _rate(sub_type_correct),
+            'labels': [course_sub_type.name for course_sub_type in models.CourseSubType],
+            'confusion_matrix': _confusion_matrix(actual_sub_type, predicted_sub_type, _COURSE_SUB_TYPES),
+        },
+        'rules': {
+            name: {
+                'total': int(total),
+                'accuracy': float(correct / total) if total else None,
+            } for name, total, correct in zip(external_menu.RULES, rule_total, rule_correct)
+        },
+        'name_correct': _rate(name_correct),
+        'price_students_correct': _rate(price_students_correct),
+        'price_staff_correct': _rate(price_staff_correct),
+    }
+
+
+def _rate(values: np.ndarray) -> 'Optional[float]':
+    return float(values.mean()) if values.size else None
+
+
+def _confusion_matrix(actual: np.ndarray, predicted: np.ndarray, size: int):
+    # Enum values start at 1
+    matrix = np.bincount((actual - 1) * size + (predicted - 1), minlength=size * size).reshape(size, size)
+
+    return matrix.tolist()
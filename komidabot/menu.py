@@ -1,5 +1,5 @@
 import datetime
-from typing import Optional
+from typing import Dict, Optional
 
 import komidabot.localisation as localisation
 import komidabot.models as models
@@ -7,8 +7,12 @@ import komidabot.translation as translation
 import komidabot.util as util
 
 
-def get_menu_line(menu_item: models.MenuItem, translator: translation.TranslationService, locale: str = None) -> str:
-    translation_obj = menu_item.get_translation(locale, translator)
+def get_menu_line(menu_item: models.MenuItem, translator: translation.TranslationService, locale: str = None,
+                  translations: 'Dict[int, models.Translation]' = None, deadline: float = None) -> str:
+    if translations is not None and menu_item.translatable_id in translations:
+        translation_obj = translations[menu_item.translatable_id]
+    else:
+        translation_obj = menu_item.get_translation(locale, translator, deadline)
 
     if not menu_item.price_staff:
         price_str = models.MenuItem.format_price(menu_item.price_students)
@@ -26,7 +30,11 @@ def prepare_menu_text(campus: models.Campus, date: datetime.date, translator: tr
 
 
 def get_menu_text(menu: Optional[models.Menu], translator: translation.TranslationService,
-                  locale: str) -> 'Optional[str]':
+                  locale: str, deadline: float = None) -> 'Optional[str]':
+    """
+    :param deadline: The number of seconds to wait on the translation of dishes, dishes that aren't translated in time
+                     are shown in their original language.
+    """
     if menu is None:
         return None
 
@@ -38,9 +46,12 @@ def get_menu_text(menu: Optional[models.Menu], translator: translation.Translati
     #     result.insert(1, localisation.REPLY_MENU_INCOMPLETE(locale))
 
     try:
+        translations = models.Translatable.get_translations([item.translatable_id for item in menu.menu_items], locale,
+                                                            translator, deadline)
+
         for item in menu.menu_items:
             item: models.MenuItem
-            result.append(get_menu_line(item, translator, locale))
+            result.append(get_menu_line(item, translator, locale, translations, deadline))
     except Exception:
         print('Failed translating to {}'.format(locale), flush=True)
         raise
@@ -0,0 +1,193 @@
+import datetime
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from extensions import db
+from komidabot.app import get_app
+from komidabot.menu_ingestion import MenuUpdateStats, fetch_menu, invalidate_translations, store_menu
+from komidabot.models import Campus, ClosingDays
+from komidabot.models_jobs import BackfillShard
+
+__all__ = ['MAX_WORKERS', 'BATCH_SIZE', 'BackfillResult', 'Shard', 'backfill_menus', 'get_shards', 'get_week_start',
+           'is_full_week']
+
+MAX_WORKERS = 4
+BATCH_SIZE = 10  # Number of shards stored per transaction
+
+
+class Shard(NamedTuple):
+    campus_id: int
+    week_start: datetime.date
+    dates: 'List[datetime.date]'
+
+
+class BackfillResult(NamedTuple):
+    shards: int
+    completed: int
+    skipped: int  # Shards that were completed by an earlier run
+    failed: int  # Shards of which a menu couldn't be fetched, these are backfilled again by the next run
+
+
+class ShardResult(NamedTuple):
+    menus: 'List[Dict[str, Any]]'
+    failed: bool
+
+
+def get_week_start(date: datetime.date) -> datetime.date:
+    return date - datetime.timedelta(days=date.weekday())
+
+
+def is_full_week(shard: Shard) -> bool:
+    return len(shard.dates) == 5
+
+
+def get_shards(campuses: 'List[Campus]', first_day: datetime.date, last_day: datetime.date) -> 'List[Shard]':
+    """
+    Splits a range of dates into a shard per campus and week, containing the weekdays of that week in the range.
+    """
+    shards = []
+    week_start = get_week_start(first_day)
+
+    while week_start <= last_day:
+        dates = [week_start + datetime.timedelta(days=i) for i in range(5)]
+        dates = [date for date in dates if first_day <= date <= last_day]
+
+        if dates:
+            shards.extend(Shard(campus.id, week_start, dates) for campus in campuses)
+
+        week_start += datetime.timedelta(days=7)
+
+    return shards
+
+
+def backfill_menus(campuses: 'List[Campus]', first_day: datetime.date, last_day: datetime.date,
+                   max_workers: int = MAX_WORKERS, batch_size: int = BATCH_SIZE, stats: MenuUpdateStats = None,
+                   on_shard: 'Callable[[Shard], None]' = None) -> BackfillResult:
+    """
+    Fetches and stores the menus of a range of dates, which can be years long. The work is split into shards per campus
+    and week, which are fetched by max_workers threads. Requests are limited by the rate limit of external_menu, shared
+    between all workers. Menus are stored on the calling thread, committing after every batch_size shards together with
+    the shards that were completed, so an interrupted backfill continues where it left off.
+
+    Only shards covering a full week are marked as completed, and only if none of their menus failed to be fetched.
+    Failures are logged and don't stop the backfill.
+
+    :param on_shard: Called after every shard, including those that were completed before.
+    """
+    if stats is None:
+        stats = MenuUpdateStats()
+
+    shards = get_shards(campuses, first_day, last_day)
+
+    if not shards:
+        return BackfillResult(0, 0, 0, 0)
+
+    completed = BackfillShard.find_completed(shards[0].week_start, shards[-1].week_start)
+
+    todo = []
+    skipped = 0
+
+    for shard in shards:
+        if (shard.campus_id, shard.week_start) in completed:
+            skipped += 1
+
+            if on_shard is not None:
+                on_shard(shard)
+        else:
+            todo.append(shard)
+
+    # noinspection PyProtectedMember
+    the_app = get_app()._get_current_object()
+
+    done = 0
+    failed = 0
+    pending = 0  # Shards stored since the last commit
+    changed_translations = set()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='backfill') as executor:
+        # Only a limited number of shards is fetched ahead, so the processed menus don't pile up in memory
+        in_flight: 'Deque[Tuple[Shard, Future]]' = deque()
+        remaining = iter(todo)
+
+        def submit_next():
+            shard = next(remaining, None)
+
+            if shard is not None:
+                in_flight.append((shard, executor.submit(_fetch_shard, the_app, shard, stats)))
+
+        for _ in range(max_workers * 2):
+            submit_next()
+
+        try:
+            while in_flight:
+                shard, future = in_flight.popleft()
+                shard_result: ShardResult = future.result()
+
+                submit_next()
+
+                for processed in shard_result.menus:
+                    store_menu(processed, stats, changed_translations)
+
+                if shard_result.failed:
+                    failed += 1
+                else:
+                    done += 1
+
+                    if is_full_week(shard):
+                        BackfillShard.mark_completed(shard.campus_id, shard.week_start, len(shard_result.menus))
+
+                pending += 1
+
+                if pending >= batch_size:
+                    db.session.commit()
+                    invalidate_translations(changed_translations)
+                    pending = 0
+
+                if on_shard is not None:
+                    on_shard(shard)
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+    db.session.commit()
+    invalidate_translations(changed_translations)
+
+    return BackfillResult(len(shards), done, skipped, failed)
+
+
+def _fetch_shard(the_app, shard: Shard, stats: MenuUpdateStats) -> ShardResult:
+    # Every worker thread needs its own application context, and with it its own database session
+    with the_app.app_context():
+        try:
+            campus = Campus.get_by_id(shard.campus_id)
+            menus = []
+            failed = False
+
+            for date in shard.dates:
+                if ClosingDays.find_is_closed(campus, date):
+                    stats.count('skipped')
+                    continue
+
+                try:
+                    # Failures need to be told apart from days without a menu, or they would never be fetched again
+                    processed: 'Optional[Dict[str, Any]]' = fetch_menu(campus, date, stats, strict=True)
+                except Exception as e:
+                    the_app.logger.error('Failed to backfill the menu of {} on {}: {}'.format(campus.short_name,
+                                                                                          date.isoformat(), e))
+                    failed = True
+                    continue
+
+                if processed is None:
+                    stats.count('skipped')
+                else:
+                    menus.append(processed)
+
+            return ShardResult(menus, failed)
+        except Exception as e:
+            # Otherwise the whole backfill would stop, rather than retrying this shard on the next run
+            the_app.logger.error('Failed to backfill the week of {} for campus {}: {}'.format(
+                shard.week_start.isoformat(), shard.campus_id, e
+            ))
+
+            return ShardResult([], True)
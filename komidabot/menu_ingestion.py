@@ -0,0 +1,240 @@
+import datetime
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import event
+
+import komidabot.external_menu as external_menu
+from extensions import db
+from komidabot.app import get_app
+from komidabot.debug.state import ProgramStateTrace, SimpleProgramState
+from komidabot.models import Campus, ClosingDays, translation_cache
+
+__all__ = ['STAGES', 'MenuUpdateStats', 'fetch_menu', 'invalidate_translations', 'store_menu', 'update_menus']
+
+STAGE_FETCH = 'fetch'
+STAGE_PARSE = 'parse'
+STAGE_PROCESS = 'process'
+STAGE_STORE = 'store'
+
+STAGES = [STAGE_FETCH, STAGE_PARSE, STAGE_PROCESS, STAGE_STORE]
+
+
+class MenuUpdateStats:
+    """
+    Collects statistics of a menu update. Can be shared between threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.requests = 0  # Requests made to the external API, for menus and prices for staff
+        self.skipped = 0  # Weekends, days the campus is closed and days without a menu
+        self.changed = 0
+        self.unchanged = 0
+
+        self.durations: 'Dict[str, List[float]]' = {stage: [] for stage in STAGES}
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+
+            with self.lock:
+                self.durations[stage].append(duration)
+
+    def count(self, attribute: str):
+        with self.lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def get_percentiles(self, stage: str, percentiles: 'List[float]') -> 'Optional[List[float]]':
+        """
+        :return: The percentiles of the durations of a stage in seconds, or None if the stage never ran.
+        """
+        with self.lock:
+            durations = list(self.durations[stage])
+
+        if not durations:
+            return None
+
+        return [float(value) for value in np.percentile(durations, percentiles)]
+
+
+def update_menus(campuses: 'List[Campus]', dates: 'List[datetime.date]', max_workers: int = 1, dry_run: bool = False,
+                 on_progress: 'Callable[[Campus, int, int], None]' = None,
+                 stats: MenuUpdateStats = None) -> 'Set[int]':
+    """
+    Fetches and stores the menus of the given campuses and dates. With more than one worker, menus are fetched and
+    processed in parallel, but they're always stored one at a time on the calling thread. Must be called from an
+    application context.
+
+    :param dry_run: Don't store anything, the statistics still show which menus would change.
+    :param on_progress: Called with the campus, the number of dates handled and the total number of dates, before the
+                        first date of a campus and after every date.
+    :return: The ids of the translatables used by the updated menus and closing days.
+    """
+    if stats is None:
+        stats = MenuUpdateStats()
+
+    translatable_ids = set()
+    changed_translations = set()
+
+    # Weekends and closing days are checked here, so no requests are made for them
+    work: 'List[Tuple[Campus, List[Tuple[datetime.date, bool]]]]' = []
+
+    for campus in campuses:
+        campus_dates = []
+
+        for date in dates:
+            if date.isoweekday() in [6, 7]:
+                campus_dates.append((date, False))
+                continue
+
+            closed = ClosingDays.find_is_closed(campus, date)
+
+            if closed:
+                translatable_ids.add(closed.translatable_id)
+                campus_dates.append((date, False))
+                continue
+
+            campus_dates.append((date, True))
+
+        work.append((campus, campus_dates))
+
+    executor = None
+    futures: 'Dict[Tuple[int, datetime.date], Future]' = dict()
+
+    if max_workers > 1:
+        # noinspection PyProtectedMember
+        the_app = get_app()._get_current_object()
+
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='menu-update')
+
+        for campus, campus_dates in work:
+            for date, is_open in campus_dates:
+                if is_open:
+                    futures[(campus.id, date)] = executor.submit(_fetch_menu_in_context, the_app, campus.id, date,
+                                                                 stats)
+
+    try:
+        for campus, campus_dates in work:
+            if on_progress is not None:
+                on_progress(campus, 0, len(campus_dates))
+
+            for i, (date, is_open) in enumerate(campus_dates):
+                if is_open:
+                    if executor is not None:
+                        processed = futures[(campus.id, date)].result()
+                    else:
+                        processed = fetch_menu(campus, date, stats)
+                else:
+                    processed = None
+
+                if processed is None:
+                    stats.count('skipped')
+                else:
+                    assert campus.short_name == processed['campus']
+                    assert date.isoformat() == processed['date']
+
+                    translatable_ids.update(store_menu(processed, stats, changed_translations))
+
+                if on_progress is not None:
+                    on_progress(campus, i + 1, len(campus_dates))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+
+        # Only after committing, otherwise the old translations could be cached again before the new ones are visible
+        invalidate_translations(changed_translations)
+
+    return translatable_ids
+
+
+def _fetch_menu_in_context(the_app, campus_id: int, date: datetime.date,
+                           stats: MenuUpdateStats) -> 'Optional[Dict[str, Any]]':
+    # Every worker thread needs its own application context, and with it its own database session
+    with the_app.app_context():
+        return fetch_menu(Campus.get_by_id(campus_id), date, stats)
+
+
+def fetch_menu(campus: Campus, date: datetime.date, stats: MenuUpdateStats,
+               strict: bool = False) -> 'Optional[Dict[str, Any]]':
+    """
+    Fetches and processes a menu. Safe to call from any thread with an application context.
+    :param strict: Raise on timeouts and server errors, see external_menu.fetch_raw.
+    :return: The processed menu, or None if there is no menu.
+    """
+    debug_state = ProgramStateTrace()
+
+    with debug_state.state(SimpleProgramState('Campus menu update', {'campus': campus.short_name,
+                                                                     'date': str(date)})):
+        stats.count('requests')
+
+        with stats.measure(STAGE_FETCH):
+            data_raw = external_menu.fetch_raw(campus, date, strict=strict)
+
+        with stats.measure(STAGE_PARSE):
+            data_parsed = external_menu.parse_fetched(data_raw)
+
+        with stats.measure(STAGE_PROCESS):
+            return external_menu.process_parsed(data_parsed, on_request=lambda: stats.count('requests'))
+
+
+def store_menu(processed: 'Dict[str, Any]', stats: MenuUpdateStats,
+               changed_translations: 'Set[Tuple[int, str]]' = None) -> 'Set[int]':
+    """
+    Stores a processed menu, without committing. Menus are counted as changed if storing them changed anything.
+    :param changed_translations: See external_menu.update_menu, pass these to invalidate_translations after committing.
+    :return: The ids of the translatables used by the menu.
+    """
+    with stats.measure(STAGE_STORE):
+        translatable_ids, changed = _store_menu(processed, changed_translations)
+
+    stats.count('changed' if changed else 'unchanged')
+
+    return translatable_ids
+
+
+def _store_menu(processed: 'Dict[str, Any]',
+                changed_translations: 'Optional[Set[Tuple[int, str]]]') -> 'Tuple[Set[int], bool]':
+    session = db.session()
+    changes = 0
+
+    def before_flush(flush_session, _flush_context, _instances):
+        nonlocal changes
+        changes += len(flush_session.new) + len(flush_session.deleted)
+        changes += sum(1 for instance in flush_session.dirty if flush_session.is_modified(instance))
+
+    session.flush()  # Earlier changes shouldn't be counted
+
+    event.listen(session, 'before_flush', before_flush)
+    try:
+        translatable_ids = external_menu.update_menu(processed, changed_translations)
+        session.flush()
+    finally:
+        event.remove(session, 'before_flush', before_flush)
+
+    return translatable_ids, changes > 0
+
+
+def invalidate_translations(changed_translations: 'Set[Tuple[int, str]]'):
+    """
+    Removes translations that were updated by storing menus from the translation cache, call this after committing.
+    """
+    for translatable_id, language in changed_translations:
+        translation_cache.invalidate(translatable_id, language)
+
+    changed_translations.clear()
@@ -1,9 +1,10 @@
 import datetime
 import enum
-from typing import Any, Dict, List, Optional, Type, TypeVar, Union
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar, Union
 
 import komidabot.models as models
 import komidabot.translation as translation
+from komidabot.app import get_app
 
 
 class Aspect:
@@ -147,3 +148,58 @@ class MessageHandler:
     #       will be delivered without problems.
     def send_message(self, user, message: 'Message') -> 'MessageSendResult':
         raise NotImplementedError()
+
+    def prepare_message(self, user, message: 'Message') -> 'Union[Any, MessageSendResult]':
+        """
+        Prepares a message so it can be stored in the outbox and delivered at a later time using deliver_prepared.
+        Handlers that don't override this can't use the outbox, their messages are sent immediately instead.
+        :return: A JSON serializable payload, or a MessageSendResult if the message should not be delivered.
+        """
+        raise NotImplementedError()
+
+    def deliver_prepared(self, user, payload: Any) -> 'MessageSendResult':
+        raise NotImplementedError()
+
+    def send_messages(self, user, message_list: 'List[Message]') -> 'List[MessageSendResult]':
+        """
+        Sends multiple messages to a user, in order. Once a message fails, the remaining messages are not sent and get
+        the same result. Handlers that can deliver multiple messages at once should override this.
+        """
+        results = []
+
+        for message in message_list:
+            if results and results[-1] != MessageSendResult.SUCCESS:
+                results.append(results[-1])
+            else:
+                results.append(self.send_message(user, message))
+
+        return results
+
+    def deliver_prepared_many(self, items: 'List[Tuple[Any, Any]]') -> 'List[MessageSendResult]':
+        """
+        Delivers multiple prepared messages, possibly for different users. Messages for the same user are delivered in
+        order, once a message fails the remaining messages for that user are not sent and get the same result.
+        :param items: 2-tuples containing the user and the payload returned by prepare_message.
+        :return: The result of delivering every message, in the same order.
+        """
+        results = []
+        failed = dict()  # User id -> result of the message that failed
+
+        for user, payload in items:
+            if user.id in failed:
+                results.append(failed[user.id])
+                continue
+
+            try:
+                result = self.deliver_prepared(user, payload)
+            except Exception as e:
+                # XXX: Treated as a failure of the external service, so the message is retried a limited number of times
+                get_app().logger.exception(e)
+                result = MessageSendResult.EXTERNAL_ERROR
+
+            results.append(result)
+
+            if result != MessageSendResult.SUCCESS:
+                failed[user.id] = result
+
+        return results
@@ -2,22 +2,31 @@ import datetime
 import enum
 import json
 import locale
+from concurrent.futures import wait as futures_wait
 from decimal import Decimal
-from typing import Any, Collection, Dict, List, Optional, Tuple
+from typing import Any, Collection, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
 
 from sqlalchemy import inspect as sqlalchemy_inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm.session import make_transient, make_transient_to_detached
-from sqlalchemy.sql import expression
+from sqlalchemy.sql import expression, functions
 
 from extensions import db, ModelBase
-from komidabot.translation import TranslationService
-from komidabot.util import expected, expected_or_none
+from komidabot.app import get_app
+from komidabot.translation import TranslationCache, TranslationService
+from komidabot.util import expected, expected_or_none, normalize_text
 
 make_transient = make_transient
 make_transient_to_detached = make_transient_to_detached
 
 _KEYWORDS_SEPARATOR = ' '
 
+TRANSLATION_BATCH_SIZE = 100  # Maximum number of strings sent to a translation service at once
+
+TRANSLATION_CACHE_SIZE = 20000
+translation_cache = TranslationCache(TRANSLATION_CACHE_SIZE)
+
 
 # Main course type
 class CourseType(enum.Enum):
@@ -338,6 +347,13 @@ class Translatable(ModelBase):
     id = db.Column(db.Integer(), primary_key=True, autoincrement=True)
     original_language = db.Column(db.String(5), nullable=False)
     original_text = db.Column(db.String(256), nullable=False)
+    # Texts that only differ in case, punctuation or whitespace share a translatable, see util.normalize_text
+    # XXX: Not limited like original_text, normalizing can make a text longer (e.g. "ß" becomes "ss")
+    normalized_text = db.Column(db.Text(), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_translatable_normalized_text', 'original_language', 'normalized_text'),
+    )
 
     _translations = db.relationship('Translation', backref='translatable', passive_deletes=True)
     menu_items = db.relationship('MenuItem', backref='translatable')
@@ -351,6 +367,7 @@ class Translatable(ModelBase):
 
         self.original_language = language
         self.original_text = text
+        self.normalized_text = normalize_text(text)
 
     def add_translation(self, language: str, text: str, provider: str = None) -> 'Translation':
         if sqlalchemy_inspect(self).transient:
@@ -359,15 +376,23 @@ class Translatable(ModelBase):
         if language == self.original_language:
             return self._get_dummy_translation()
 
-        translation = Translation.query.filter_by(translatable_id=self.id, language=language).first()
+        translation = Translation.find_by_id(self.id, language)
 
         if translation is None:
             translation = Translation(self.id, language, text, provider)
             db.session.add(translation)
 
+            translation_cache.invalidate(self.id, language)
+
         return translation
 
-    def get_translation(self, language: str, translator: 'TranslationService' = None) -> 'Translation':
+    def get_translation(self, language: str, translator: 'TranslationService' = None,
+                        deadline: float = None) -> 'Translation':
+        """
+        Gets the translation in the given language, translating it if it doesn't exist yet.
+        :param deadline: The number of seconds to wait on the translation service. If it takes longer, the original text
+                         is returned and the translation is stored once it finishes. Waits indefinitely if None.
+        """
         if not language:
             raise ValueError('language expected (got {})'.format(language))
         if translator is not None and not isinstance(translator, TranslationService):
@@ -379,12 +404,21 @@ class Translatable(ModelBase):
         if language == self.original_language:
             return self._get_dummy_translation()
 
-        translation = Translation.query.filter_by(translatable_id=self.id, language=language).first()
+        cached = translation_cache.get(self.id, language)
+        if cached is not None:
+            return Translation.from_cache(self.id, language, cached)
 
-        if translation is None:
+        translation = Translation.find_by_id(self.id, language)
+
+        if translation is not None:
+            translation_cache.put(self.id, language, translation.translation, translation.provider)
+        else:
             if translator is None:
                 raise ValueError('Cannot translate without translator function')
 
+            if deadline is not None:
+                return Translatable._translate_with_deadline([self], language, translator, deadline)[self.id]
+
             translation_text = translator.translate(self.original_text, self.original_language, language)
 
             translation = self.add_translation(language, translation_text, translator.identifier)
@@ -420,7 +454,9 @@ class Translatable(ModelBase):
 
     @staticmethod
     def get_or_create(text: str, language) -> 'Tuple[Translatable, Translation]':
-        translatable = Translatable.query.filter_by(original_language=language, original_text=text).first()
+        # XXX: Locked until the end of the transaction, so the cleanup doesn't remove it before it's referenced
+        translatable = Translatable.query.filter_by(original_language=language, normalized_text=normalize_text(text)) \
+            .with_for_update(read=True, key_share=True).first()
 
         if translatable is None:
             translatable = Translatable(text, language)
@@ -433,10 +469,158 @@ class Translatable(ModelBase):
     def get_by_id(translatable_id) -> 'Optional[Translatable]':
         return Translatable.query.filter_by(id=translatable_id).first()
 
+    @staticmethod
+    def warm_cache(translatable_ids: 'Collection[int]'):
+        """
+        Loads all translations of the given translatables into the translation cache using a single query, skipping
+        translatables that were loaded before.
+        """
+        translatable_ids = [translatable_id for translatable_id in translatable_ids
+                            if not translation_cache.is_warm(translatable_id)]
+
+        if not translatable_ids:
+            return
+
+        rows = db.session.query(Translation.translatable_id, Translation.language, Translation.translation,
+                                Translation.provider).filter(Translation.translatable_id.in_(translatable_ids)).all()
+
+        for row in rows:
+            translation_cache.put(row.translatable_id, row.language, row.translation, row.provider)
+
+        translation_cache.set_warm(translatable_ids)
+
+    @staticmethod
+    def get_translations(translatable_ids: 'Collection[int]', language: str, translator: 'TranslationService' = None,
+                         deadline: float = None) -> 'Dict[int, Translation]':
+        """
+        Gets the translations of multiple translatables. Existing translations are looked up in a single query, missing
+        translations are translated in batches and added to the session.
+        :param deadline: See get_translation.
+        :return: Maps the id of every translatable that was found to its translation.
+        """
+        if not language:
+            raise ValueError('language expected (got {})'.format(language))
+        if translator is not None and not isinstance(translator, TranslationService):
+            raise expected_or_none('translator', translator, TranslationService)
+
+        if not translatable_ids:
+            return dict()
+
+        result = dict()
+        uncached = []
+
+        for translatable_id in translatable_ids:
+            cached = translation_cache.get(translatable_id, language)
+
+            if cached is not None:
+                result[translatable_id] = Translation.from_cache(translatable_id, language, cached)
+            else:
+                uncached.append(translatable_id)
+
+        if not uncached:
+            return result
+
+        translatables = Translatable.query.filter(Translatable.id.in_(uncached)).all()
+        existing = {translation.translatable_id: translation for translation in Translation.query.filter(
+            Translation.translatable_id.in_(uncached),
+            Translation.language == language,
+        )}
+
+        missing: 'Dict[str, List[Translatable]]' = dict()  # Original language -> translatables
+
+        for translatable in translatables:
+            if translatable.original_language == language:
+                result[translatable.id] = translatable._get_dummy_translation()
+            elif translatable.id in existing:
+                translation = existing[translatable.id]
+                translation_cache.put(translatable.id, language, translation.translation, translation.provider)
+
+                result[translatable.id] = translation
+            else:
+                missing.setdefault(translatable.original_language, []).append(translatable)
+
+        if missing and translator is None:
+            raise ValueError('Cannot translate without translator function')
+
+        if deadline is not None:
+            result.update(Translatable._translate_with_deadline([translatable for to_translate in missing.values()
+                                                                 for translatable in to_translate],
+                                                                language, translator, deadline))
+            return result
+
+        for original_language, to_translate in missing.items():
+            for i in range(0, len(to_translate), TRANSLATION_BATCH_SIZE):
+                batch = to_translate[i:i + TRANSLATION_BATCH_SIZE]
+                texts = translator.translate_many([translatable.original_text for translatable in batch],
+                                                  original_language, language)
+
+                for translatable, text in zip(batch, texts):
+                    translation = Translation(translatable.id, language, text, translator.identifier)
+                    db.session.add(translation)
+
+                    result[translatable.id] = translation
+
+        return result
+
+    @staticmethod
+    def _translate_with_deadline(translatables: 'List[Translatable]', language: str, translator: 'TranslationService',
+                                 deadline: float) -> 'Dict[int, Translation]':
+        by_language: 'Dict[str, List[Translatable]]' = dict()
+        for translatable in translatables:
+            by_language.setdefault(translatable.original_language, []).append(translatable)
+
+        flights = get_app().translation_flights
+        futures = dict()
+
+        for original_language, to_translate in by_language.items():
+            texts = [(translatable.id, translatable.original_text) for translatable in to_translate]
+            futures.update(flights.submit(texts, original_language, language, translator))
+
+        futures_wait(futures.values(), timeout=deadline)
+
+        result = dict()
+
+        for translatable in translatables:
+            future = futures[translatable.id]
+
+            if future.done() and future.exception() is None:
+                result[translatable.id] = Translation.from_cache(translatable.id, language,
+                                                                 (future.result(), translator.identifier))
+            else:
+                # Too slow or failed, the user gets the original text this time
+                print('Translation of {} to {} not ready, using the original text'.format(translatable.id, language),
+                      flush=True)
+
+                result[translatable.id] = translatable._get_dummy_translation()
+
+        return result
+
     def __hash__(self):
         return hash(self.id)
 
 
+# Precedence of translation providers, lower is better. Official translations come first, then translations that were
+# added manually, which is also assumed for translations without a provider, and finally translation services.
+PROVIDER_PRECEDENCE = {'komida': 0, 'manual': 1, None: 1}
+PROVIDER_PRECEDENCE_DEFAULT = 2
+
+
+def get_provider_precedence(provider: 'Optional[str]') -> int:
+    return PROVIDER_PRECEDENCE.get(provider, PROVIDER_PRECEDENCE_DEFAULT)
+
+
+def provider_precedence_expression(provider_column):
+    """
+    SQL version of get_provider_precedence.
+    """
+    return db.case(
+        [(provider_column.is_(None), PROVIDER_PRECEDENCE[None])] +
+        [(provider_column == provider, precedence) for provider, precedence in PROVIDER_PRECEDENCE.items()
+         if provider is not None],
+        else_=PROVIDER_PRECEDENCE_DEFAULT
+    )
+
+
 class Translation(ModelBase):
     __tablename__ = 'translation'
 
@@ -461,6 +645,54 @@ class Translation(ModelBase):
         self.translation = translation
         self.provider = provider
 
+    @staticmethod
+    def find_by_id(translatable_id: int, language: str) -> 'Optional[Translation]':
+        return Translation.query.filter_by(translatable_id=translatable_id, language=language).first()
+
+    @staticmethod
+    def insert_missing(language: str, provider: str, translations: 'Dict[int, str]'):
+        """
+        Stores translations using a single statement, translations that exist already are left alone.
+        :param translations: Maps the id of a translatable to its translation.
+        """
+        if not translations:
+            return
+
+        statement = pg_insert(Translation.__table__).values([{
+            'translatable_id': translatable_id,
+            'language': language,
+            'translation': translation,
+            'provider': provider,
+        } for translatable_id, translation in translations.items()]).on_conflict_do_nothing()
+
+        db.session.execute(statement)
+
+    @staticmethod
+    def from_cache(translatable_id: int, language: str, cached: 'Tuple[str, Optional[str]]') -> 'Translation':
+        """
+        Creates a detached Translation from a cache entry. Changes made to it are not saved.
+        """
+        translation = Translation(translatable_id, language, cached[0], cached[1])
+        make_transient_to_detached(translation)
+
+        return translation
+
+    @staticmethod
+    def find_existing(translatable_ids: 'Collection[int]', languages: 'Collection[str]') -> 'Set[Tuple[int, str]]':
+        """
+        Finds which of the given translatables already have a translation in the given languages.
+        :return: The (translatable id, language) pairs of the existing translations.
+        """
+        if not translatable_ids or not languages:
+            return set()
+
+        rows = db.session.query(Translation.translatable_id, Translation.language).filter(
+            Translation.translatable_id.in_(translatable_ids),
+            Translation.language.in_(languages),
+        ).all()
+
+        return {(row.translatable_id, row.language) for row in rows}
+
     def __eq__(self, other: 'Translation'):
         if self.translatable_id != other.translatable_id:
             return False
@@ -519,20 +751,28 @@ class Menu(ModelBase):
 
     @staticmethod
     def get_menu(campus: Campus, day: datetime.date) -> 'Optional[Menu]':
-        return Menu.query.filter_by(campus_id=campus.id, menu_day=day).first()
+        menu = Menu.query.filter_by(campus_id=campus.id, menu_day=day).first()
+
+        if menu is not None:
+            # The menu is most likely loaded to be shown, so get the translations ready
+            Translatable.warm_cache([menu_item.translatable_id for menu_item in menu.menu_items])
+
+        return menu
 
     @staticmethod
-    def remove_menus_on_closing_days():
-        rows = Menu.query.filter(
+    def remove_menus_on_closing_days() -> int:
+        """
+        Removes the menus of days on which their campus is closed, in a single statement. The menu items are removed by
+        the database.
+        :return: The number of menus removed.
+        """
+        return Menu.query.filter(
             ClosingDays.query.filter(
                 Menu.campus_id == ClosingDays.campus_id,
                 Menu.menu_day >= ClosingDays.first_day,
                 Menu.menu_day <= ClosingDays.last_day
             ).exists()
-        ).all()
-
-        for row in rows:
-            db.session.delete(row)
+        ).delete(synchronize_session=False)
 
     def __hash__(self):
         return hash(self.id)
@@ -577,8 +817,8 @@ class MenuItem(ModelBase):
         self.price_students = price_students
         self.price_staff = price_staff
 
-    def get_translation(self, language: str, translator: 'TranslationService') -> 'Translation':
-        return self.translatable.get_translation(language, translator)
+    def get_translation(self, language: str, translator: 'TranslationService', deadline: float = None) -> 'Translation':
+        return self.translatable.get_translation(language, translator, deadline)
 
     @staticmethod
     def format_price(price: Decimal) -> str:
@@ -666,6 +906,9 @@ class AppUser(ModelBase):
     notified_new_site = db.Column(db.Boolean(), nullable=False, default=False, server_default=expression.false())
     enabled = db.Column(db.Boolean(), nullable=False, default=True, server_default=expression.true())
     data = db.Column(db.Text(), nullable=True)  # Stores data specific to the provider
+    # Locale reported by the provider, used when the user hasn't chosen a language
+    provider_locale = db.Column(db.String(16), nullable=True)
+    provider_locale_refreshed_on = db.Column(db.DateTime(), nullable=True)
 
     __table_args__ = (
         db.UniqueConstraint('provider', 'internal_id'),
@@ -734,6 +977,30 @@ class AppUser(ModelBase):
     def delete(self):
         db.session.delete(self)
 
+    @staticmethod
+    def disable_all(user_ids: 'Collection[int]') -> int:
+        """
+        Marks all given users as disabled using a single statement.
+        :return: The number of users that were enabled before.
+        """
+        if not user_ids:
+            return 0
+
+        return AppUser.query.filter(db.and_(AppUser.id.in_(user_ids),
+                                            AppUser.enabled == expression.true()
+                                            )).update({AppUser.enabled: False}, synchronize_session=False)
+
+    @staticmethod
+    def delete_all(user_ids: 'Collection[int]') -> int:
+        """
+        Deletes all given users using a single statement, their related rows are removed by the database.
+        :return: The number of users that were deleted.
+        """
+        if not user_ids:
+            return 0
+
+        return AppUser.query.filter(AppUser.id.in_(user_ids)).delete(synchronize_session=False)
+
     @staticmethod
     def find_subscribed_users_by_day(day: Day, provider=None) -> 'List[AppUser]':
         q = AppUser.query
@@ -753,6 +1020,314 @@ class AppUser(ModelBase):
     def find_by_provider(provider: str) -> 'List[AppUser]':
         return AppUser.query.filter_by(provider=provider).order_by(AppUser.internal_id).all()
 
+    @staticmethod
+    def find_active_locales(default_language: str) -> 'List[str]':
+        """
+        Finds the locales used by enabled users, this is the chosen language of a user, or the locale reported by the
+        provider if they haven't chosen one.
+        :param default_language: The locale used for users without a chosen language or provider locale.
+        """
+        user_locale = functions.coalesce(db.func.nullif(AppUser.language, ''), AppUser.provider_locale,
+                                         default_language)
+
+        rows = db.session.query(user_locale).filter(AppUser.enabled.is_(True)).distinct().all()
+
+        return sorted(row[0] for row in rows)
+
+    @staticmethod
+    def find_stale_provider_locales(provider: str, refreshed_before: datetime.datetime, limit: int) -> 'List[str]':
+        """
+        Finds users without a chosen language whose provider locale is missing or was refreshed before the given time.
+        :return: The internal ids of the users, least recently refreshed first.
+        """
+        rows = db.session.query(AppUser.internal_id).filter(
+            AppUser.provider == provider,
+            AppUser.language == '',
+            db.or_(AppUser.provider_locale_refreshed_on.is_(None),
+                   AppUser.provider_locale_refreshed_on < refreshed_before),
+        ).order_by(AppUser.provider_locale_refreshed_on.asc().nullsfirst()).limit(limit).all()
+
+        return [row.internal_id for row in rows]
+
+    @staticmethod
+    def set_provider_locales(provider: str, locales: 'Dict[str, str]'):
+        """
+        Stores the provider locales of multiple users using a single statement.
+        :param locales: Maps the internal id of a user to their locale.
+        """
+        if not locales:
+            return
+
+        table = AppUser.__table__
+        statement = table.update().where(db.and_(
+            table.c.provider == db.bindparam('b_provider'),
+            table.c.internal_id == db.bindparam('b_internal_id'),
+        )).values(provider_locale=db.bindparam('b_locale'), provider_locale_refreshed_on=functions.now())
+
+        db.session.execute(statement, [{'b_provider': provider, 'b_internal_id': internal_id, 'b_locale': locale}
+                                       for internal_id, locale in locales.items()])
+
+    @staticmethod
+    def set_provider_locales_refreshed(provider: str, internal_ids: 'Collection[str]'):
+        """
+        Marks the provider locales of multiple users as refreshed without changing them, used when looking them up
+        failed. Otherwise these users would stay at the front of the queue of find_stale_provider_locales.
+        """
+        if not internal_ids:
+            return
+
+        AppUser.query.filter(AppUser.provider == provider, AppUser.internal_id.in_(internal_ids)).update(
+            {AppUser.provider_locale_refreshed_on: functions.now()}, synchronize_session=False
+        )
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class DispatchReport(NamedTuple):
+    dispatch_date: datetime.date
+    channel: str
+    total: int
+    pending: int
+    results: Dict[str, int]
+    first_delivery: Optional[datetime.datetime]
+    last_delivery: Optional[datetime.datetime]
+
+    @property
+    def queued(self) -> int:
+        return self.results.get(DeliveryLedger.QUEUED, 0)
+
+    @property
+    def delivered(self) -> int:
+        return self.total - self.pending - self.queued
+
+    @property
+    def failed(self) -> int:
+        return sum(count for result, count in self.results.items() if result not in ('SUCCESS', DeliveryLedger.QUEUED))
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """
+        Average number of messages delivered per second during the dispatch.
+        """
+        if self.first_delivery is None or self.last_delivery is None:
+            return None
+
+        duration = (self.last_delivery - self.first_delivery).total_seconds()
+        if duration <= 0:
+            return None
+
+        return self.delivered / duration
+
+
+class DeliveryLedger(ModelBase):
+    __tablename__ = 'delivery_ledger'
+
+    BATCH_SIZE = 100
+
+    # Result of entries whose message has been handed to the outbox, but hasn't been delivered yet
+    QUEUED = 'QUEUED'
+
+    dispatch_date = db.Column(db.Date(), primary_key=True)
+    channel = db.Column(db.String(32), primary_key=True)
+    # XXX: Deliberately not a foreign key, entries need to outlive users that are removed as a result of the delivery
+    user_id = db.Column(db.Integer(), primary_key=True)
+    # Name of the MessageSendResult or QUEUED, NULL while the delivery is still pending
+    result = db.Column(db.String(16), nullable=True)
+    queued_on = db.Column(db.DateTime(), nullable=False, server_default=functions.now())
+    delivered_on = db.Column(db.DateTime(), nullable=True)
+
+    def __init__(self, dispatch_date: datetime.date, channel: str, user_id: int):
+        if not isinstance(dispatch_date, datetime.date):
+            raise expected('dispatch_date', dispatch_date, datetime.date)
+        if not isinstance(channel, str):
+            raise expected('channel', channel, str)
+        if not isinstance(user_id, int):
+            raise expected('user_id', user_id, int)
+
+        self.dispatch_date = dispatch_date
+        self.channel = channel
+        self.user_id = user_id
+
+    @staticmethod
+    def add_pending(dispatch_date: datetime.date, channel: str, user_ids: Iterable[int]):
+        """
+        Registers the users as recipients of a dispatch. Users that are already in the ledger are left untouched, so
+        their previous result is kept when a dispatch is restarted.
+        """
+        user_ids = list(user_ids)
+        table = DeliveryLedger.__table__
+
+        for i in range(0, len(user_ids), DeliveryLedger.BATCH_SIZE):
+            values = [{'dispatch_date': dispatch_date, 'channel': channel, 'user_id': user_id}
+                      for user_id in user_ids[i:i + DeliveryLedger.BATCH_SIZE]]
+            db.session.execute(pg_insert(table).values(values).on_conflict_do_nothing())
+
+    @staticmethod
+    def get_pending_user_ids(dispatch_date: datetime.date, channel: str) -> 'Set[int]':
+        rows = db.session.query(DeliveryLedger.user_id).filter_by(dispatch_date=dispatch_date, channel=channel,
+                                                                   result=None).all()
+        return {row.user_id for row in rows}
+
+    @staticmethod
+    def has_pending(dispatch_date: datetime.date, channel: str) -> bool:
+        return db.session.query(DeliveryLedger.query.filter_by(dispatch_date=dispatch_date, channel=channel,
+                                                               result=None).exists()).scalar()
+
+    @staticmethod
+    def record_results(dispatch_date: datetime.date, channel: str, results: 'List[Tuple[int, str]]'):
+        """
+        Stores the results of a batch of deliveries using a single statement.
+        :param dispatch_date: The date of the dispatch.
+        :param channel: The channel of the dispatch.
+        :param results: A list of (user id, result name) tuples.
+        """
+        if not results:
+            return
+
+        table = DeliveryLedger.__table__
+        statement = table.update().where(db.and_(
+            table.c.dispatch_date == db.bindparam('b_dispatch_date'),
+            table.c.channel == db.bindparam('b_channel'),
+            table.c.user_id == db.bindparam('b_user_id'),
+        )).values(result=db.bindparam('b_result'), delivered_on=functions.now())
+
+        db.session.execute(statement, [{'b_dispatch_date': dispatch_date, 'b_channel': channel, 'b_user_id': user_id,
+                                        'b_result': result} for user_id, result in results])
+
+    @staticmethod
+    def get_report(dispatch_date: datetime.date, channel: str) -> DispatchReport:
+        rows = db.session.query(
+            DeliveryLedger.result,
+            functions.count(),
+            functions.min(DeliveryLedger.delivered_on),
+            functions.max(DeliveryLedger.delivered_on),
+        ).filter_by(dispatch_date=dispatch_date, channel=channel).group_by(DeliveryLedger.result).all()
+
+        total = 0
+        pending = 0
+        results = dict()
+        first_delivery = None
+        last_delivery = None
+
+        for result, count, first, last in rows:
+            total += count
+
+            if result is None:
+                pending += count
+                continue
+
+            results[result] = count
+
+            if result == DeliveryLedger.QUEUED:
+                continue
+
+            if first_delivery is None or first < first_delivery:
+                first_delivery = first
+            if last_delivery is None or last > last_delivery:
+                last_delivery = last
+
+        return DispatchReport(dispatch_date, channel, total, pending, results, first_delivery, last_delivery)
+
+    def __hash__(self):
+        return hash((self.dispatch_date, self.channel, self.user_id))
+
+
+class OutboxMessage(ModelBase):
+    __tablename__ = 'outbox_message'
+
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = datetime.timedelta(seconds=30)  # Doubles with every failed attempt
+
+    id = db.Column(db.BigInteger(), primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer(), db.ForeignKey('app_user.id', onupdate='CASCADE', ondelete='CASCADE'),
+                        nullable=False)
+    # Subscription channel and dispatch date of the message, if the result needs to be written back to the ledger
+    channel = db.Column(db.String(32), nullable=True)
+    dispatch_date = db.Column(db.Date(), nullable=True)
+    payload = db.Column(db.Text(), nullable=False)  # Prepared message, as returned by MessageHandler.prepare_message
+    # Name of the MessageSendResult, NULL while the message is still pending
+    result = db.Column(db.String(16), nullable=True)
+    attempts = db.Column(db.Integer(), nullable=False, default=0, server_default='0')
+    next_attempt = db.Column(db.DateTime(), nullable=False, server_default=functions.now())
+    queued_on = db.Column(db.DateTime(), nullable=False, server_default=functions.now())
+    delivered_on = db.Column(db.DateTime(), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_outbox_message_pending', 'next_attempt', postgresql_where=expression.text('result IS NULL')),
+    )
+
+    user = db.relationship('AppUser')
+
+    def __init__(self, user_id: int, payload: Any, channel: str = None, dispatch_date: datetime.date = None):
+        if not isinstance(user_id, int):
+            raise expected('user_id', user_id, int)
+        if payload is None:
+            raise ValueError('payload expected not None')
+        if channel is not None and not isinstance(channel, str):
+            raise expected_or_none('channel', channel, str)
+        if dispatch_date is not None and not isinstance(dispatch_date, datetime.date):
+            raise expected_or_none('dispatch_date', dispatch_date, datetime.date)
+
+        self.user_id = user_id
+        self.payload = json.dumps(payload)
+        self.channel = channel
+        self.dispatch_date = dispatch_date
+
+    @staticmethod
+    def create(user_id: int, payload: Any, channel: str = None,
+               dispatch_date: datetime.date = None) -> 'OutboxMessage':
+        message = OutboxMessage(user_id, payload, channel, dispatch_date)
+
+        db.session.add(message)
+
+        return message
+
+    @staticmethod
+    def claim(worker: int, workers: int, limit: int) -> 'List[OutboxMessage]':
+        """
+        Locks a batch of pending messages that are due. Messages are partitioned over the workers by user, so messages
+        for a single user are always delivered by the same worker. Only the oldest pending message of every user is
+        claimed, so a message is never delivered while an earlier one for the same user is waiting for a retry. Rows
+        locked by another transaction are skipped. The lock is held until the transaction ends.
+        """
+        earlier = aliased(OutboxMessage)
+
+        return OutboxMessage.query.filter(
+            OutboxMessage.result.is_(None),
+            OutboxMessage.next_attempt <= functions.now(),
+            OutboxMessage.user_id % workers == worker,
+            ~db.session.query(earlier).filter(
+                earlier.user_id == OutboxMessage.user_id,
+                earlier.id < OutboxMessage.id,
+                earlier.result.is_(None),
+            ).exists(),
+        ).order_by(OutboxMessage.id).with_for_update(skip_locked=True, of=OutboxMessage).limit(limit).all()
+
+    @staticmethod
+    def count_pending() -> int:
+        return OutboxMessage.query.filter(OutboxMessage.result.is_(None)).count()
+
+    def get_payload(self) -> Any:
+        return json.loads(self.payload)
+
+    def retry_later(self) -> bool:
+        """
+        Schedules the message to be retried with an exponential backoff.
+        :return: False if the message has run out of attempts, True otherwise.
+        """
+        self.attempts += 1
+
+        if self.attempts >= OutboxMessage.MAX_ATTEMPTS:
+            return False
+
+        self.next_attempt = datetime.datetime.now() + OutboxMessage.RETRY_DELAY * (2 ** (self.attempts - 1))
+        return True
+
+    def set_result(self, result: str):
+        self.result = result
+        self.delivered_on = datetime.datetime.now()
+
     def __hash__(self):
         return hash(self.id)
 
@@ -874,38 +1449,3 @@ def create_standard_values():
     hzs = Campus.create('Hogere Zeevaartschool', 'hzs', ['hogere', 'zeevaartschool'], 6)
     hzs.active = False
     db.session.commit()
-
-
-def import_dump(dump_file):
-    campus_dict: Dict[str, Campus] = dict()
-
-    def get_campus(short_name) -> Campus:
-        if short_name not in campus_dict:
-            campus_dict[short_name] = Campus.get_by_short_name(short_name)
-        return campus_dict[short_name]
-
-    with open(dump_file) as file:
-        _ = file.readline()  # Skip header
-
-        line = file.readline()
-        while line:
-            line = line.strip()
-            split = list(line.split('\t'))
-
-            if len(split) == 8:
-                split[1] = split[1] == 'True'
-            if split[7] == '0':
-                split[7] = ''  # Query locale
-
-            user = AppUser.create('facebook', split[0], split[7])
-            user.set_campus(Day.MONDAY, get_campus(split[2]), active=split[1])
-            user.set_campus(Day.TUESDAY, get_campus(split[3]), active=split[1])
-            user.set_campus(Day.WEDNESDAY, get_campus(split[4]), active=split[1])
-            user.set_campus(Day.THURSDAY, get_campus(split[5]), active=split[1])
-            user.set_campus(Day.FRIDAY, get_campus(split[6]), active=split[1])
-
-            db.session.add(user)
-
-            line = file.readline()
-
-        db.session.commit()
@@ -0,0 +1,151 @@
+import datetime
+import enum
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql import functions
+
+from extensions import db, ModelBase
+from komidabot.util import expected
+
+
+class JobStatus(enum.Enum):
+    QUEUED = 1
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+
+
+class Job(ModelBase):
+    __tablename__ = 'job'
+
+    id = db.Column(db.Integer(), primary_key=True, autoincrement=True)
+    job_type = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    arguments = db.Column(db.Text(), nullable=False)
+    progress = db.Column(db.Text(), nullable=False, default='{}', server_default='{}')
+    error = db.Column(db.Text(), nullable=True)
+
+    created_on = db.Column(db.DateTime(), nullable=False, server_default=functions.now())
+    started_on = db.Column(db.DateTime(), nullable=True)
+    finished_on = db.Column(db.DateTime(), nullable=True)
+
+    def __init__(self, job_type: str, arguments: Any):
+        if not isinstance(job_type, str):
+            raise expected('job_type', job_type, str)
+        if arguments is None:
+            raise ValueError('arguments expected not None')
+
+        self.job_type = job_type
+        self.arguments = json.dumps(arguments)
+
+    @staticmethod
+    def create(job_type: str, arguments: Any) -> 'Job':
+        job = Job(job_type, arguments)
+
+        db.session.add(job)
+
+        return job
+
+    @staticmethod
+    def find_by_id(job_id: int) -> 'Optional[Job]':
+        return Job.query.filter_by(id=job_id).first()
+
+    @staticmethod
+    def update_progress(job_id: int, progress: Dict[str, Any]):
+        """
+        Stores the progress of a running job. This uses its own transaction, so progress becomes visible right away
+        without committing the work the job has done so far.
+        """
+        table = Job.__table__
+
+        with db.engine.begin() as connection:
+            connection.execute(table.update().where(table.c.id == job_id).values(progress=json.dumps(progress)))
+
+    @staticmethod
+    def fail_unfinished(error: str) -> int:
+        """
+        Marks all jobs that are still queued or running as failed.
+        :return: The number of jobs that were marked as failed.
+        """
+        return Job.query.filter(Job.status.in_([JobStatus.QUEUED, JobStatus.RUNNING])).update({
+            Job.status: JobStatus.FAILED,
+            Job.error: error,
+            Job.finished_on: datetime.datetime.now(),
+        }, synchronize_session=False)
+
+    def get_arguments(self) -> Any:
+        return json.loads(self.arguments)
+
+    def get_progress(self) -> Dict[str, Any]:
+        return json.loads(self.progress)
+
+    def set_running(self):
+        self.status = JobStatus.RUNNING
+        self.started_on = datetime.datetime.now()
+
+    def set_done(self):
+        self.status = JobStatus.DONE
+        self.finished_on = datetime.datetime.now()
+
+    def set_failed(self, error: str):
+        self.status = JobStatus.FAILED
+        self.error = error
+        self.finished_on = datetime.datetime.now()
+
+    def get_duration(self) -> Optional[float]:
+        if self.started_on is None:
+            return None
+
+        return ((self.finished_on or datetime.datetime.now()) - self.started_on).total_seconds()
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class BackfillShard(ModelBase):
+    """
+    A week of menus of a single campus that was completely backfilled, see menu_backfill.
+    """
+    __tablename__ = 'backfill_shard'
+
+    campus_id = db.Column(db.Integer(), db.ForeignKey('campus.id', onupdate='CASCADE', ondelete='CASCADE'),
+                          primary_key=True)
+    week_start = db.Column(db.Date(), primary_key=True)
+    menus = db.Column(db.Integer(), nullable=False)
+    completed_on = db.Column(db.DateTime(), nullable=False, server_default=functions.now())
+
+    @staticmethod
+    def find_completed(first_week: datetime.date, last_week: datetime.date) -> 'Set[Tuple[int, datetime.date]]':
+        """
+        :return: 2-tuples of the campus id and the start of the week, for every completed shard in the range.
+        """
+        query = db.session.query(BackfillShard.campus_id, BackfillShard.week_start).filter(
+            BackfillShard.week_start.between(first_week, last_week)
+        )
+
+        return {(campus_id, week_start) for campus_id, week_start in query}
+
+    @staticmethod
+    def mark_completed(campus_id: int, week_start: datetime.date, menus: int):
+        table = BackfillShard.__table__
+
+        statement = pg_insert(table).values(campus_id=campus_id, week_start=week_start, menus=menus)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.campus_id, table.c.week_start],
+            set_={'menus': statement.excluded.menus, 'completed_on': functions.now()},
+        )
+
+        db.session.execute(statement)
+
+    @staticmethod
+    def clear(campus_ids: 'List[int]', first_week: datetime.date, last_week: datetime.date) -> int:
+        """
+        Forgets the completed shards of some campuses in a range, so they're backfilled again.
+        :return: The number of shards that were forgotten.
+        """
+        return BackfillShard.query.filter(BackfillShard.campus_id.in_(campus_ids),
+                                          BackfillShard.week_start.between(first_week, last_week)).delete(
+            synchronize_session=False
+        )
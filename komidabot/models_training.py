@@ -1,12 +1,16 @@
 import datetime
 import enum
 import json
+import random
 from typing import Any, List, NamedTuple, Optional, TypedDict, Union
 
 from sqlalchemy.sql import expression
 
 from extensions import db, ModelBase
+from komidabot.app import get_app
+from komidabot.blob_storage import is_blob_key
 from komidabot.models_users import RegisteredUser
+from komidabot.screenshots import decode_screenshot, encode_screenshot
 from komidabot.util import expected
 
 # ChoiceSchemaType = NamedTuple('ChoiceType', (('display', str), ('value', Any),))
@@ -153,35 +157,57 @@ class LearningDatapoint(ModelBase):
     id = db.Column(db.Integer(), primary_key=True, autoincrement=True)
     campus_id = db.Column(db.Integer(), db.ForeignKey('campus.id'), nullable=False)
     menu_day = db.Column(db.Date(), nullable=False)
-    screenshot = db.Column(db.Text(), nullable=False)
+    # XXX: Screenshots used to be stored inline as base64, these are moved to blob storage by move_screenshot
+    screenshot = db.deferred(db.Column(db.Text(), nullable=True))
+    screenshot_hash = db.Column(db.String(64), nullable=True)
     processed_data = db.Column(db.Text(), nullable=False)
 
     submissions = db.relationship('LearningDatapointSubmission', backref='datapoint', passive_deletes=True)
 
-    def __init__(self, campus_id: int, menu_day: datetime.date, screenshot: str, processed_data: Any):
+    def __init__(self, campus_id: int, menu_day: datetime.date, screenshot_hash: str, processed_data: Any):
         if not isinstance(campus_id, int):
             raise expected('campus_id', campus_id, int)
         if not isinstance(menu_day, datetime.date):
             raise expected('menu_day', menu_day, datetime.date)
-        if screenshot is None:
-            raise ValueError('screenshot expected not None')
+        if not is_blob_key(screenshot_hash):
+            raise ValueError('screenshot_hash expected a blob key')
         if processed_data is None:
             raise ValueError('processed_data expected not None')
 
         self.campus_id = campus_id
         self.menu_day = menu_day
-        self.screenshot = screenshot
+        self.screenshot_hash = screenshot_hash
         self.processed_data = json.dumps(processed_data)
 
     @staticmethod
-    def create(campus: 'Campus', menu_day: datetime.date, screenshot: str,
+    def create(campus: 'Campus', menu_day: datetime.date, screenshot: bytes,
                processed_data: Any) -> 'Optional[LearningDatapoint]':
-        datapoint = LearningDatapoint(campus.id, menu_day, screenshot, processed_data)
+        """
+        Creates a datapoint, the screenshot is put in the blob storage of the app.
+        """
+        if not isinstance(screenshot, bytes):
+            raise expected('screenshot', screenshot, bytes)
+
+        screenshot_hash = get_app().blob_storage.put(screenshot)
+
+        datapoint = LearningDatapoint(campus.id, menu_day, screenshot_hash, processed_data)
 
         db.session.add(datapoint)
 
         return datapoint
 
+    @staticmethod
+    def find_with_inline_screenshot(limit: int) -> 'List[LearningDatapoint]':
+        return LearningDatapoint.query.filter(LearningDatapoint.screenshot_hash.is_(None)).order_by(
+            LearningDatapoint.id
+        ).limit(limit).all()
+
+    @staticmethod
+    def find_without_inline_screenshot(limit: int) -> 'List[LearningDatapoint]':
+        return LearningDatapoint.query.filter(LearningDatapoint.screenshot.is_(None)).order_by(
+            LearningDatapoint.id
+        ).limit(limit).all()
+
     @staticmethod
     def find_by_id(datapoint_id: int) -> 'Optional[LearningDatapoint]':
         return LearningDatapoint.query.filter_by(id=datapoint_id).first()
@@ -192,15 +218,62 @@ class LearningDatapoint(ModelBase):
 
     @staticmethod
     def get_random(user: 'RegisteredUser') -> 'Optional[LearningDatapoint]':
-        return LearningDatapoint.query.order_by(expression.func.random()).filter(
-            expression.not_(
-                LearningDatapointSubmission.query.filter(
-                    LearningDatapoint.id == LearningDatapointSubmission.datapoint_id,
-                    LearningDatapointSubmission.user_id == user.id
-                ).exists()
-            )
+        """
+        Picks a random datapoint the user hasn't submitted yet. Rather than sorting all datapoints randomly, this starts
+        at a random id and takes the next one the user hasn't submitted, wrapping around to the start if needed. Both
+        lookups only walk the primary key indexes.
+        """
+        min_id, max_id = db.session.query(expression.func.min(LearningDatapoint.id),
+                                          expression.func.max(LearningDatapoint.id)).one()
+
+        if min_id is None:
+            return None
+
+        pivot = random.randint(min_id, max_id)
+
+        not_submitted = expression.not_(
+            LearningDatapointSubmission.query.filter(
+                LearningDatapoint.id == LearningDatapointSubmission.datapoint_id,
+                LearningDatapointSubmission.user_id == user.id
+            ).exists()
+        )
+
+        datapoint = LearningDatapoint.query.filter(LearningDatapoint.id >= pivot, not_submitted).order_by(
+            LearningDatapoint.id
         ).first()
 
+        if datapoint is None:
+            datapoint = LearningDatapoint.query.filter(LearningDatapoint.id < pivot, not_submitted).order_by(
+                LearningDatapoint.id
+            ).first()
+
+        return datapoint
+
+    def move_screenshot(self):
+        """
+        Moves a screenshot that is stored inline to the blob storage of the app. The caller must commit.
+        """
+        if self.screenshot_hash is not None:
+            return
+
+        self.screenshot_hash = get_app().blob_storage.put(decode_screenshot(self.screenshot))
+        self.screenshot = None
+
+    def restore_screenshot(self):
+        """
+        Copies a screenshot from the blob storage of the app back into the database, so the migration storing
+        screenshots in blob storage can be reverted. The caller must commit.
+        """
+        if self.screenshot is not None:
+            return
+
+        data = get_app().blob_storage.get(self.screenshot_hash)
+
+        if data is None:
+            raise ValueError('Screenshot {} of datapoint {} is missing'.format(self.screenshot_hash, self.id))
+
+        self.screenshot = encode_screenshot(data)
+
     def user_submit(self, user: 'RegisteredUser', submission_data: Any):
         LearningDatapointSubmission.create(self, user, submission_data)
 
@@ -100,6 +100,13 @@ class RegisteredUser(ModelBase, UserMixin):
     def get_all_active() -> 'List[RegisteredUser]':
         return RegisteredUser.query.filter(RegisteredUser.activated_on != None).all()
 
+    @staticmethod
+    def get_subscribed_admins() -> 'List[RegisteredUser]':
+        return RegisteredUser.query.filter(
+            RegisteredUser.roles.any(Role.name == 'admin'),
+            RegisteredUser.web_subscriptions != '[]',
+        ).all()
+
     @staticmethod
     def get_all_by_role(role: 'Role') -> 'List[RegisteredUser]':
         return role.users
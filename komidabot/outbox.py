@@ -0,0 +1,160 @@
+import atexit
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import komidabot.messages as messages
+import komidabot.models as models
+from extensions import db
+from komidabot.rate_limit import Limiter
+from komidabot.users import DeliveryResults
+
+__all__ = ['Outbox']
+
+BATCH_SIZE = 50
+POLL_INTERVAL = 5.0  # Seconds between checks for messages that are due for a retry
+
+
+class Outbox:
+    """
+    Delivers messages that were queued using User.queue_message from a pool of worker threads. Each worker handles its
+    own partition of the users, so messages for a single user keep their order.
+    """
+
+    def __init__(self, the_app, workers: int):
+        self.app = the_app
+        self.workers = workers
+
+        # Without workers, nobody would deliver the queued messages, so they're sent immediately instead
+        self.synchronous = workers <= 0
+
+        # Shared between the workers, so subscription messages are sent at most DAILY_MENU_RATE per second in total
+        max_rate = the_app.config.get('DAILY_MENU_RATE', 0)
+        self.limiter: 'Optional[Limiter]' = Limiter(max_rate) if max_rate > 0 else None
+
+        self._stopping = threading.Event()
+        self._wakeup = [threading.Event() for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        if self.synchronous or self._threads:
+            return
+
+        for worker in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(worker,), name='outbox-{}'.format(worker), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        atexit.register(Outbox.stop, self)  # Ensure cleanup of resources
+
+    def stop(self):
+        self._stopping.set()
+        self.notify()
+
+        for thread in self._threads:
+            thread.join(timeout=10)
+
+        self._threads = []
+
+    def notify(self):
+        """
+        Wakes up the workers, call this after committing newly queued messages.
+        """
+        for event in self._wakeup:
+            event.set()
+
+    def _run(self, worker: int):
+        while not self._stopping.is_set():
+            processed = 0
+
+            try:
+                with self.app.app_context():
+                    processed = self.process_batch(worker, self.workers)
+            except Exception as e:
+                self.app.logger.exception(e)
+
+            if processed == 0:
+                self._wakeup[worker].wait(POLL_INTERVAL)
+                self._wakeup[worker].clear()
+
+    def process_batch(self, worker: int = 0, workers: int = 1) -> int:
+        """
+        Delivers a batch of pending messages for the given partition, writing the results back to the outbox and to the
+        delivery ledger. Must be called from an application context.
+        :return: The number of messages that were processed.
+        """
+        try:
+            outbox_messages = models.OutboxMessage.claim(worker, workers, BATCH_SIZE)
+
+            if not outbox_messages:
+                db.session.commit()  # Ends the transaction
+                return 0
+
+            ledger_results: 'Dict[Tuple, List[Tuple[int, str]]]' = dict()
+            delivery_results = DeliveryResults()
+
+            message_results = self._deliver(outbox_messages)
+
+            for outbox_message, message_result in zip(outbox_messages, message_results):
+                if self.app.config.get('VERBOSE'):
+                    print('Delivering queued message {} to user {} got result {}'.format(outbox_message.id,
+                                                                                       outbox_message.user_id,
+                                                                                       message_result), flush=True)
+
+                if message_result == messages.MessageSendResult.EXTERNAL_ERROR and outbox_message.retry_later():
+                    continue  # Later messages for this user aren't claimed until this one is handled
+
+                outbox_message.set_result(message_result.name)
+
+                if outbox_message.channel is not None:
+                    key = (outbox_message.dispatch_date, outbox_message.channel)
+                    ledger_results.setdefault(key, []).append((outbox_message.user_id, message_result.name))
+
+                    delivery_results.add(outbox_message.user_id, message_result)
+
+            for (dispatch_date, channel), results in ledger_results.items():
+                models.DeliveryLedger.record_results(dispatch_date, channel, results)
+
+            db.session.flush()
+
+            unreachable, gone = delivery_results.apply()
+            db.session.commit()
+
+            if unreachable or gone:
+                print('Outbox: marked {} users unreachable, removed {} users'.format(unreachable, gone), flush=True)
+
+            return len(outbox_messages)
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _deliver(self, outbox_messages: 'List[models.OutboxMessage]') -> 'List[messages.MessageSendResult]':
+        """
+        Delivers the messages, grouped by message handler so handlers can deliver many messages at once.
+        """
+        results: 'List[Optional[messages.MessageSendResult]]' = [None] * len(outbox_messages)
+        by_handler: 'Dict[messages.MessageHandler, List[int]]' = dict()
+        items = []
+
+        for index, outbox_message in enumerate(outbox_messages):
+            user = self.app.user_manager.get_user(outbox_message.user)
+            items.append((user, outbox_message.get_payload()))
+            by_handler.setdefault(user.get_message_handler(), []).append(index)
+
+        for handler, indices in by_handler.items():
+            if self.limiter is not None:
+                for index in indices:
+                    if outbox_messages[index].channel is not None:
+                        self.limiter()  # Ensure we don't send too many subscription messages at once
+
+            try:
+                handler_results = handler.deliver_prepared_many([items[index] for index in indices])
+            except Exception as e:
+                # XXX: It is unknown which of these messages were delivered, they're all retried a limited number of
+                #      times rather than failing the batch, which would resend them indefinitely
+                self.app.logger.exception(e)
+                handler_results = [messages.MessageSendResult.EXTERNAL_ERROR] * len(indices)
+
+            for index, result in zip(indices, handler_results):
+                results[index] = result
+
+        return results
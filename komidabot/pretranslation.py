@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Collection, Dict, List, NamedTuple, Optional, Tuple
+
+import komidabot.models as models
+from extensions import db
+from komidabot.translation import LANGUAGE_DUTCH, TranslationService
+
+__all__ = ['PretranslationResult', 'pretranslate']
+
+MAX_WORKERS = 4  # Maximum number of concurrent requests to the translation service
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 1.0  # Seconds before the first retry, doubles with every attempt
+
+
+class PretranslationResult(NamedTuple):
+    translated: int
+    failed: int
+
+
+def pretranslate(translatable_ids: 'Collection[int]', translator: TranslationService,
+                 locales: 'Collection[str]' = None) -> PretranslationResult:
+    """
+    Translates the given translatables into every locale that is in use, so replies don't have to wait on the
+    translation service. Translations that already exist are left alone. Must be called from an application context,
+    the caller doesn't need to commit.
+
+    :param locales: The locales to translate into, defaults to the locales of all enabled users.
+    """
+    if not translatable_ids:
+        return PretranslationResult(0, 0)
+
+    if locales is None:
+        locales = models.AppUser.find_active_locales(LANGUAGE_DUTCH)
+
+    translatables = models.Translatable.query.filter(models.Translatable.id.in_(translatable_ids)).all()
+    existing = models.Translation.find_existing(translatable_ids, locales)
+
+    # (language of text, locale to translate to) -> translatables
+    missing: 'Dict[Tuple[str, str], List[models.Translatable]]' = dict()
+
+    for translatable in translatables:
+        for locale in locales:
+            if locale != translatable.original_language and (translatable.id, locale) not in existing:
+                missing.setdefault((translatable.original_language, locale), []).append(translatable)
+
+    if not missing:
+        return PretranslationResult(0, 0)
+
+    # (language of text, locale to translate to, translatables)
+    work: 'List[Tuple[str, str, List[models.Translatable]]]' = [
+        (from_language, to_language, items[i:i + models.TRANSLATION_BATCH_SIZE])
+        for (from_language, to_language), items in missing.items()
+        for i in range(0, len(items), models.TRANSLATION_BATCH_SIZE)
+    ]
+
+    texts = [[translatable.original_text for translatable in batch] for _, _, batch in work]
+
+    # Only the calls to the translation service happen in the pool, the database is only accessed from this thread
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='pretranslation') as executor:
+        results = list(executor.map(lambda item, batch_texts: _translate(translator, batch_texts, item[0], item[1]),
+                                    work, texts))
+
+    translated = 0
+    failed = 0
+
+    for (_, to_language, batch), result in zip(work, results):
+        if result is None:
+            failed += len(batch)
+            continue
+
+        for translatable, text in zip(batch, result):
+            translatable.add_translation(to_language, text, translator.identifier)
+            translated += 1
+
+    db.session.commit()
+
+    return PretranslationResult(translated, failed)
+
+
+def _translate(translator: TranslationService, texts: 'List[str]', from_language: str,
+               to_language: str) -> 'Optional[List[str]]':
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return translator.translate_many(texts, from_language, to_language)
+        except Exception as e:
+            print('Translating {} strings to {} failed (attempt {}/{}): {}'.format(len(texts), to_language,
+                                                                                attempt + 1, MAX_ATTEMPTS, e),
+                  flush=True)
+
+            if attempt + 1 < MAX_ATTEMPTS:
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+
+    return None
@@ -1,23 +1,32 @@
+import threading
 import time
 from collections import deque
 from datetime import datetime
 
 
 class Limiter:
+    """
+    Limits calls to at most max_rate per second. Can be shared between threads, waiting callers are let through one at
+    a time.
+    """
+
     def __init__(self, max_rate: int):
         self.max_rate = max_rate
         self.last_times = deque()
+        self.lock = threading.Lock()
 
     def __call__(self):
-        now = datetime.now()
+        with self.lock:
+            now = datetime.now()
 
-        if len(self.last_times) < self.max_rate:
-            self.last_times.append(now)
-            return
+            if len(self.last_times) < self.max_rate:
+                self.last_times.append(now)
+                return
 
-        delta = (now - self.last_times.popleft()).total_seconds()
+            delta = (now - self.last_times.popleft()).total_seconds()
 
-        if delta < 1:
-            time.sleep(1.0 - delta)
+            if delta < 1:
+                time.sleep(1.0 - delta)
+                now = datetime.now()
 
-        self.last_times.append(now)
+            self.last_times.append(now)
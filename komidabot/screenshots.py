@@ -0,0 +1,92 @@
+import base64
+import io
+import threading
+from typing import Optional, Tuple
+
+from PIL import Image
+from cachetools import LRUCache
+
+from komidabot.blob_storage import BlobStorage
+
+__all__ = ['VARIANT_WIDTHS', 'decode_screenshot', 'encode_screenshot', 'get_screenshot']
+
+# Only these widths can be requested, so the number of variants per screenshot is limited
+VARIANT_WIDTHS = [320, 640, 1280]
+VARIANT_QUALITY = 80
+VARIANT_MIMETYPE = 'image/jpeg'
+
+VARIANT_CACHE_SIZE = 64 * 1024 * 1024  # Bytes
+
+_variant_cache = LRUCache(VARIANT_CACHE_SIZE, getsizeof=len)
+_variant_cache_lock = threading.Lock()
+
+
+def decode_screenshot(screenshot: str) -> bytes:
+    """
+    Decodes a base64 encoded screenshot, as found in the learning data. Data URLs are accepted as well.
+    """
+    if screenshot.startswith('data:'):
+        screenshot = screenshot.split(',', 1)[1]
+
+    return base64.b64decode(screenshot)
+
+
+def encode_screenshot(data: bytes) -> str:
+    """
+    Encodes a screenshot as a base64 data URL, the way screenshots used to be stored inline.
+    """
+    try:
+        mimetype = Image.MIME.get(Image.open(io.BytesIO(data)).format, 'application/octet-stream')
+    except Image.UnidentifiedImageError:
+        mimetype = 'application/octet-stream'
+
+    return 'data:{};base64,{}'.format(mimetype, base64.b64encode(data).decode('ascii'))
+
+
+def get_screenshot(storage: BlobStorage, key: str, width: int = None) -> 'Optional[Tuple[bytes, str]]':
+    """
+    Gets a screenshot, or a smaller and recompressed variant of it. Variants are kept in memory, as they're cheap to
+    recreate.
+
+    :param width: The maximum width of the variant, must be one of VARIANT_WIDTHS. If None, the original is returned.
+    :return: A 2-tuple containing the image data and its mimetype, or None if the screenshot doesn't exist.
+    """
+    if width is not None and width not in VARIANT_WIDTHS:
+        raise ValueError('width expected one of {}'.format(VARIANT_WIDTHS))
+
+    if width is not None:
+        with _variant_cache_lock:
+            data = _variant_cache.get((key, width))
+
+        if data is not None:
+            return data, VARIANT_MIMETYPE
+
+    original = storage.get(key)
+
+    if original is None:
+        return None
+
+    image = Image.open(io.BytesIO(original))
+
+    if width is None:
+        return original, Image.MIME.get(image.format, 'application/octet-stream')
+
+    data = _create_variant(image, width)
+
+    with _variant_cache_lock:
+        _variant_cache[(key, width)] = data
+
+    return data, VARIANT_MIMETYPE
+
+
+def _create_variant(image: Image.Image, width: int) -> bytes:
+    # Images are only scaled down, never up
+    image.thumbnail((width, image.height), Image.LANCZOS)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=VARIANT_QUALITY, optimize=True, progressive=True)
+
+    return output.getvalue()
@@ -1,19 +1,29 @@
-from typing import Dict, List, Optional, Union
+import zlib
+from typing import Dict, List, Optional, Tuple, Union
 
 import komidabot.messages as messages
 import komidabot.models as models
 import komidabot.subscriptions as subscriptions
+import komidabot.triggers as triggers
 from extensions import db
 from komidabot.app import get_app
 from komidabot.messages import Message
 from komidabot.models import Day
-from komidabot.users import User
+from komidabot.rate_limit import Limiter
+from komidabot.users import DeliveryResults, User
 
-__all__ = ['CHANNEL_ID', 'Channel']
+__all__ = ['CHANNEL_ID', 'Channel', 'get_dispatch_slot']
 
 CHANNEL_ID = 'daily_menu'
 
 
+def get_dispatch_slot(user_id: int, slots: int) -> int:
+    """
+    Gets the dispatch slot of a user. This is stable across restarts, unlike hash().
+    """
+    return zlib.crc32(str(user_id).encode('utf-8')) % slots
+
+
 class Query(subscriptions.SubscriptionQuery):
     def __init__(self, day: models.Day, campus: models.Campus = None):
         self.day = day
@@ -38,6 +48,9 @@ class Data(subscriptions.SubscriptionData):
 
 class Channel(subscriptions.SubscriptionChannel):
     def get_subscribed_users(self, /, query: Union[Query, Dict] = None) -> 'List[User]':
+        return list(self._get_subscribed_users_by_id(query).values())
+
+    def _get_subscribed_users_by_id(self, query: Union[Query, Dict] = None) -> 'Dict[int, User]':
         if not isinstance(query, Query):
             query = self.get_query_from(query)
 
@@ -49,9 +62,14 @@ class Channel(subscriptions.SubscriptionChannel):
         app = get_app()
         user_manager = app.user_manager
 
-        users = models.AppUser.find_subscribed_users_by_day(query.day)
+        result = dict()
 
-        return [user for user in (user_manager.get_user(user) for user in users) if self.user_supported(user)]
+        for app_user in models.AppUser.find_subscribed_users_by_day(query.day):
+            user = user_manager.get_user(app_user)
+            if self.user_supported(user):
+                result[app_user.id] = user
+
+        return result
 
     def get_query_from(self, query: Dict = None) -> Optional[Query]:
         if query is None:
@@ -62,15 +80,63 @@ class Channel(subscriptions.SubscriptionChannel):
         if not isinstance(message, messages.SubscriptionMenuMessage):
             raise NotImplementedError('Daily menu channel only supports SubscriptionMenuMessage')
 
-        day = Day(message.date.isoweekday())
-        changed = False
+        date = message.date
+        slot, slots = None, 1
+        if isinstance(message.trigger, triggers.SubscriptionTrigger):
+            slot, slots = message.trigger.slot, message.trigger.slots
+
+        # Queued messages are rate limited by the outbox when they're delivered
+        max_rate = get_app().config.get('DAILY_MENU_RATE', 0)
+        limiter = Limiter(max_rate) if max_rate > 0 and get_app().outbox.synchronous else None
+
+        subscribed_users = self._get_subscribed_users_by_id(Query(Day(date.isoweekday())))
+
+        # Register every recipient in the ledger before sending anything, this way a restarted dispatch only needs to
+        # send to the recipients that are still pending
+        models.DeliveryLedger.add_pending(date, CHANNEL_ID, subscribed_users.keys())
+        db.session.commit()
+
+        pending = models.DeliveryLedger.get_pending_user_ids(date, CHANNEL_ID)
+        results: 'List[Tuple[int, str]]' = []
+        delivery_results = DeliveryResults()
+
+        for user_id, user in subscribed_users.items():
+            if user_id not in pending:
+                continue  # Already handled by an earlier run of this dispatch
+            if slot is not None and get_dispatch_slot(user_id, slots) != slot:
+                continue  # Handled by another slot
+
+            if limiter is not None:
+                limiter()  # Ensure we don't send too many messages at once
+
+            message_result = user.queue_message(message, CHANNEL_ID, date)
+
+            if message_result is None:
+                # The outbox will record the result once the message has been delivered
+                results.append((user_id, models.DeliveryLedger.QUEUED))
+            else:
+                delivery_results.add(user_id, message_result)
+
+                results.append((user_id, message_result.name))
+
+            if len(results) >= models.DeliveryLedger.BATCH_SIZE:
+                models.DeliveryLedger.record_results(date, CHANNEL_ID, results)
+                db.session.commit()
+                results = []
+
+                get_app().outbox.notify()
+
+        models.DeliveryLedger.record_results(date, CHANNEL_ID, results)
+        db.session.commit()
+
+        get_app().outbox.notify()
 
-        for user in self.get_subscribed_users(query=Query(day)):
-            if user.send_message_or_remove(CHANNEL_ID, message):
-                changed = True
+        unreachable, gone = delivery_results.apply()
+        db.session.commit()
 
-        if changed:
-            db.session.commit()
+        if unreachable or gone:
+            print('Daily menu for {}: marked {} users unreachable, removed {} users'.format(date, unreachable, gone),
+                  flush=True)
 
     def get_name(self):
         return CHANNEL_ID
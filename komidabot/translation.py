@@ -1,3 +1,7 @@
+import threading
+from typing import Any, Collection, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
 from googletrans import Translator
 
 Language = str
@@ -16,6 +20,83 @@ def _fix_language(language: Language):
     return language
 
 
+class TranslationCache:
+    """
+    Thread-safe LRU cache mapping (translatable id, language) to (translation, provider). Translations hardly ever
+    change, so this saves a query for nearly every translated line that is rendered.
+    """
+
+    def __init__(self, maxsize: int):
+        self._lock = threading.Lock()
+        self._cache = LRUCache(maxsize=maxsize)
+        # Translatables for which all existing translations are in the cache
+        self._warm = LRUCache(maxsize=maxsize)
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, translatable_id: int, language: str) -> 'Optional[Tuple[str, Optional[str]]]':
+        with self._lock:
+            value = self._cache.get((translatable_id, language))
+
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return value
+
+    def put(self, translatable_id: int, language: str, translation: str, provider: 'Optional[str]'):
+        with self._lock:
+            self._cache[(translatable_id, language)] = (translation, provider)
+
+    def is_warm(self, translatable_id: int) -> bool:
+        with self._lock:
+            return translatable_id in self._warm
+
+    def set_warm(self, translatable_ids: 'Collection[int]'):
+        with self._lock:
+            for translatable_id in translatable_ids:
+                self._warm[translatable_id] = True
+
+    def invalidate(self, translatable_id: int, language: str):
+        with self._lock:
+            self._cache.pop((translatable_id, language), None)
+            self._warm.pop(translatable_id, None)
+
+    def discard(self, translatable_ids: 'Collection[int]'):
+        """
+        Removes all translations of the given translatables, used when the translatables are deleted.
+        """
+        translatable_ids = set(translatable_ids)
+
+        with self._lock:
+            for key in [key for key in self._cache.keys() if key[0] in translatable_ids]:
+                self._cache.pop(key, None)
+
+            for translatable_id in translatable_ids:
+                self._warm.pop(translatable_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._warm.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> 'Dict[str, Any]':
+        with self._lock:
+            total = self.hits + self.misses
+
+            return {
+                'size': self._cache.currsize,
+                'maxsize': self._cache.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total > 0 else None,
+            }
+
+
 class TranslationService:
     def translate(self, text: str, from_language: Language, to_language: Language):
         """
@@ -27,6 +108,17 @@ class TranslationService:
         """
         raise NotImplementedError()
 
+    def translate_many(self, texts: List[str], from_language: Language, to_language: Language) -> List[str]:
+        """
+        Submit multiple strings to be translated. Services that can translate multiple strings in a single request
+        should override this.
+        :param texts: The strings to translate
+        :param from_language: A 2 letter string defining the language to translate from
+        :param to_language: A 2 letter string defining the language to translate to
+        :return: The translated strings, in the same order
+        """
+        return [self.translate(text, from_language, to_language) for text in texts]
+
     @property
     def identifier(self):
         raise NotImplementedError()
@@ -50,12 +142,57 @@ class KomidaTranslationService(TranslationService):
 
 
 class GoogleTranslationService(TranslationService):
+    # Google rejects requests for more than 5000 characters, leave some room for encoding differences
+    MAX_REQUEST_LENGTH = 4500
+    SEGMENT_SEPARATOR = '\n'
+
     def __init__(self):
         self.translator = Translator()
 
     def translate(self, text: str, from_language: Language, to_language: Language):
         return self.translator.translate(text, src=from_language, dest=to_language).text
 
+    def translate_many(self, texts: List[str], from_language: Language, to_language: Language) -> List[str]:
+        # Multiple strings are translated in a single request by putting each of them on their own line
+        result = []
+
+        for chunk in self._get_chunks([text.replace(self.SEGMENT_SEPARATOR, ' ') for text in texts]):
+            if len(chunk) == 1:
+                result.append(self.translate(chunk[0], from_language, to_language))
+                continue
+
+            translated = self.translate(self.SEGMENT_SEPARATOR.join(chunk), from_language, to_language)
+            segments = translated.split(self.SEGMENT_SEPARATOR)
+
+            if len(segments) != len(chunk):
+                # Google merged or split some lines, fall back to translating the strings one by one
+                segments = [self.translate(text, from_language, to_language) for text in chunk]
+
+            result.extend(segment.strip() for segment in segments)
+
+        return result
+
+    def _get_chunks(self, texts: List[str]) -> List[List[str]]:
+        chunks = []
+        current = []
+        current_length = 0
+
+        for text in texts:
+            length = len(text) + len(self.SEGMENT_SEPARATOR)
+
+            if current and current_length + length > self.MAX_REQUEST_LENGTH:
+                chunks.append(current)
+                current = []
+                current_length = 0
+
+            current.append(text)
+            current_length += length
+
+        if current:
+            chunks.append(current)
+
+        return chunks
+
     @property
     def identifier(self):
         return 'google'
@@ -65,6 +202,23 @@ class GoogleTranslationService(TranslationService):
         return 'Google Translate'
 
 
+class LocalTranslationService(TranslationService):
+    """
+    Deterministic stand-in that doesn't contact any service, for use in tests and benchmarks.
+    """
+
+    def translate(self, text: str, from_language: Language, to_language: Language):
+        return '[{}] {}'.format(to_language, text)
+
+    @property
+    def identifier(self):
+        return 'local'
+
+    @property
+    def pretty_name(self):
+        return 'Local stand-in'
+
+
 class BingTranslationService(TranslationService):
     def translate(self, text: str, from_language: Language, to_language: Language):
         raise NotImplementedError()
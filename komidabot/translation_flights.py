@@ -0,0 +1,80 @@
+import atexit
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import komidabot.models as models
+from extensions import db
+from komidabot.translation import TranslationService
+
+__all__ = ['TranslationFlights']
+
+
+class TranslationFlights:
+    """
+    Runs translations in the background, so callers can stop waiting on them after a deadline. Concurrent requests for
+    the same translation share a single call to the translation service. Finished translations are stored, even if
+    nobody is waiting on them anymore.
+    """
+
+    def __init__(self, the_app, max_workers: int = 4):
+        self.app = the_app
+
+        self._lock = threading.Lock()
+        self._in_flight: 'Dict[Tuple[int, str], Future]' = dict()
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='translations')
+        atexit.register(ThreadPoolExecutor.shutdown, self.executor)  # Ensure cleanup of resources
+
+    def submit(self, translatables: 'List[Tuple[int, str]]', from_language: str, to_language: str,
+               translator: TranslationService) -> 'Dict[int, Future]':
+        """
+        Requests translations for multiple translatables, those that aren't being translated yet are translated using
+        a single call to the translation service.
+
+        :param translatables: 2-tuples containing the id and original text of the translatables.
+        :return: Maps the id of every translatable to a future that completes with the translated text once it is
+                 stored.
+        """
+        result = dict()
+        to_translate = []
+
+        with self._lock:
+            for translatable_id, text in translatables:
+                key = (translatable_id, to_language)
+
+                if key not in self._in_flight:
+                    self._in_flight[key] = Future()
+                    to_translate.append((translatable_id, text))
+
+                result[translatable_id] = self._in_flight[key]
+
+        if to_translate:
+            self.executor.submit(self._run, to_translate, from_language, to_language, translator)
+
+        return result
+
+    def _run(self, translatables: 'List[Tuple[int, str]]', from_language: str, to_language: str,
+             translator: TranslationService):
+        futures = [self._in_flight[(translatable_id, to_language)] for translatable_id, _ in translatables]
+
+        try:
+            texts = translator.translate_many([text for _, text in translatables], from_language, to_language)
+
+            with self.app.app_context():
+                models.Translation.insert_missing(to_language, translator.identifier,
+                                                  {translatable_id: text for (translatable_id, _), text in
+                                                   zip(translatables, texts)})
+                db.session.commit()
+
+            for future, text in zip(futures, texts):
+                future.set_result(text)
+        except Exception as e:
+            self.app.logger.exception(e)
+
+            for future in futures:
+                future.set_exception(e)
+        finally:
+            with self._lock:
+                for translatable_id, _ in translatables:
+                    self._in_flight.pop((translatable_id, to_language), None)
@@ -5,12 +5,15 @@ from komidabot.messages import Aspect, Trigger
 
 
 class SubscriptionTrigger(Trigger):
-    def __init__(self, *args, date: datetime.date = None, **kwargs):
+    def __init__(self, *args, date: datetime.date = None, slot: int = None, slots: int = 1, **kwargs):
         super().__init__(*args, **kwargs)
         self.date = date
+        # The dispatch slot to deliver to, or None to deliver to all recipients at once
+        self.slot = slot
+        self.slots = slots
 
     def get_repr_text(self):
-        return ['SubscriptionTrigger', '- Date: ' + repr(self.date)]
+        return ['SubscriptionTrigger', '- Date: ' + repr(self.date), '- Slot: {}/{}'.format(self.slot, self.slots)]
 
 
 class TextTrigger(Trigger):
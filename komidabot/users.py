@@ -1,14 +1,14 @@
 import datetime
 import functools
 import json
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Set, Tuple, Union
 from typing import NamedTuple
 
 import komidabot.messages as messages
 import komidabot.models as models
 from komidabot.app import get_app
 
-__all__ = ['UnifiedUserManager', 'User', 'UserId', 'UserManager']
+__all__ = ['DeliveryResults', 'UnifiedUserManager', 'User', 'UserId', 'UserManager']
 
 
 class UserId(NamedTuple):
@@ -244,9 +244,54 @@ class User:
 
         return result
 
+    def send_messages(self, message_list: 'List[messages.Message]') -> 'List[messages.MessageSendResult]':
+        """
+        Sends multiple messages in order, using as few requests as the message handler allows.
+        """
+        results = self.get_message_handler().send_messages(self, message_list)
+
+        app = get_app()
+        if app.config.get('VERBOSE'):
+            print('Sending {} messages to user {} got results {}'.format(len(message_list), self.id, results),
+                  flush=True)
+
+        return results
+
+    def queue_message(self, message: 'messages.Message', channel: str = None,
+                      dispatch_date: datetime.date = None) -> 'Optional[messages.MessageSendResult]':
+        """
+        Stores the message in the outbox to be delivered in the background. If the outbox isn't running, or the message
+        handler doesn't support the outbox, the message is sent immediately instead.
+        The caller is responsible for committing the changes and notifying the outbox.
+        :return: None if the message was queued, the result of sending the message otherwise.
+        """
+        if get_app().outbox.synchronous:
+            return self.send_message(message)
+
+        try:
+            payload = self.get_message_handler().prepare_message(self, message)
+        except NotImplementedError:
+            return self.send_message(message)
+
+        if isinstance(payload, messages.MessageSendResult):
+            return payload
+
+        user = self.get_db_user()
+        if user is None:
+            return messages.MessageSendResult.GONE
+
+        models.OutboxMessage.create(user.id, payload, channel, dispatch_date)
+
+        return None
+
     def send_message_or_remove(self, channel: str, message: 'messages.Message') -> bool:
-        message_result = self.send_message(message)
+        return self.handle_message_result(channel, self.send_message(message))
 
+    def handle_message_result(self, channel: str, message_result: 'messages.MessageSendResult') -> bool:
+        """
+        Updates the state of the user to reflect the result of sending a message on a subscription channel.
+        :return: True if the user was changed and the changes need to be committed, False otherwise.
+        """
         if message_result == messages.MessageSendResult.UNSUPPORTED:
             # Messages unsupported? Disable subscription then
             print('User {} does not support messages, removing from subscription list'.format(self.id), flush=True)
@@ -274,6 +319,37 @@ class User:
         return 'User: {}'.format(user_id)
 
 
+class DeliveryResults:
+    """
+    Collects the results of messages sent during a dispatch, so the users that turned out to be unreachable or gone can
+    be updated with a single statement each once the dispatch is done, rather than one query per user.
+    """
+
+    def __init__(self):
+        self.unreachable: 'Set[int]' = set()
+        self.gone: 'Set[int]' = set()
+
+    def add(self, user_id: int, message_result: 'messages.MessageSendResult'):
+        # FIXME: For unsupported messages, we should mark the user unreachable for this specific channel instead
+        if message_result in (messages.MessageSendResult.UNSUPPORTED, messages.MessageSendResult.UNREACHABLE):
+            self.unreachable.add(user_id)
+        elif message_result == messages.MessageSendResult.GONE:
+            self.gone.add(user_id)
+
+    def apply(self) -> 'Tuple[int, int]':
+        """
+        Applies the collected results to the database, the caller is responsible for committing the changes.
+        :return: A 2-tuple containing the number of users marked unreachable and the number of users removed.
+        """
+        unreachable = models.AppUser.disable_all(self.unreachable - self.gone)
+        gone = models.AppUser.delete_all(self.gone)
+
+        self.unreachable = set()
+        self.gone = set()
+
+        return unreachable, gone
+
+
 class UnifiedUserManager(UserManager):
     def __init__(self):
         self._managers: Dict[str, UserManager] = dict()
@@ -1,4 +1,6 @@
+import re
 import traceback
+import unicodedata
 from functools import wraps
 from typing import List, Tuple, TypeVar
 
@@ -70,6 +72,22 @@ def date_to_string(locale: str, date):
         return str(date)
 
 
+_PUNCTUATION_PATTERN = re.compile(r'[^\w\s]+')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a text so texts that only differ in case, punctuation or whitespace become equal. Accents are kept, as
+    these can change the meaning of a word.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = _PUNCTUATION_PATTERN.sub(' ', text)
+    text = _WHITESPACE_PATTERN.sub(' ', text)
+
+    return text.strip()
+
+
 def expected(name, value, *types):
     types_str = ' or '.join(type_obj.__name__ for type_obj in types)
     return ValueError('{} expected {} got {}'.format(name, types_str, type(value).__name__))
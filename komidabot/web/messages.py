@@ -1,5 +1,7 @@
 import copy
+import datetime
 import json
+from typing import NamedTuple, Optional
 
 from pywebpush import webpush, WebPushException
 
@@ -11,29 +13,91 @@ import komidabot.users as users
 import komidabot.util as util
 import komidabot.web.constants as web_constants
 from komidabot.app import get_app
-from komidabot.models import CourseType, Menu
+from komidabot.models import Campus, CourseType, Menu
 
 VAPID_CLAIMS = {
     'sub': 'mailto:komidabot@gmail.com'
 }
 
+# See https://tools.ietf.org/html/rfc8030#section-5.3
+URGENCY_VERY_LOW = 'very-low'
+URGENCY_LOW = 'low'
+URGENCY_NORMAL = 'normal'
+URGENCY_HIGH = 'high'
+
+# Menu notifications are useless once lunch is over
+LUNCH_END = datetime.time(hour=14, minute=0)
+
+
+class PushOptions(NamedTuple):
+    # Messages with the same topic replace each other while stored by the push service (max. 32 URL-safe characters)
+    topic: Optional[str] = None
+    # Number of seconds the push service keeps the message around for devices that are offline
+    ttl: int = 0
+    urgency: str = URGENCY_NORMAL
+
+    def get_headers(self):
+        headers = {'Urgency': self.urgency}
+        if self.topic:
+            headers['Topic'] = self.topic
+        return headers
+
+
+TEXT_PUSH_OPTIONS = PushOptions()
+
+
+def get_menu_push_options(campus: Campus, date: datetime.date, now: datetime.datetime = None) -> PushOptions:
+    """
+    Gets the push options for a menu notification. A newer notification for the same campus and date replaces an older
+    one that hasn't been delivered yet, and the notification expires once lunch is over.
+    """
+    if now is None:
+        now = datetime.datetime.now()
+
+    expires = datetime.datetime.combine(date, LUNCH_END)
+    ttl = max(int((expires - now).total_seconds()), 0)
+
+    return PushOptions(topic='menu-{}-{}'.format(campus.short_name, date.strftime('%Y%m%d')), ttl=ttl,
+                       urgency=URGENCY_LOW)
+
 
 class MessageHandler(messages.MessageHandler):
     def send_message(self, user: users.User, message: messages.Message) -> messages.MessageSendResult:
+        notification = self.prepare_message(user, message)
+
+        if isinstance(notification, messages.MessageSendResult):
+            return notification
+
+        return self.deliver_prepared(user, notification)
+
+    def prepare_message(self, user: users.User, message: messages.Message):
         if user.id.provider != web_constants.PROVIDER_ID:
             raise ValueError('User id is not for {}'.format(web_constants.PROVIDER_ID))
 
         if isinstance(message, messages.TextMessage):
-            return self._send_text_message(user, message)
+            return self._prepare_text_message(user, message)
         elif isinstance(message, messages.MenuMessage):
-            return self._send_menu_message(user, message)
+            return self._prepare_menu_message(user, message)
         elif isinstance(message, messages.SubscriptionMenuMessage):
-            return self._send_subscription_menu_message(user, message)
+            return self._prepare_subscription_menu_message(user, message)
         else:
             return messages.MessageSendResult.UNSUPPORTED
 
+    def deliver_prepared(self, user: users.User, notification: dict) -> messages.MessageSendResult:
+        return MessageHandler._send_notification(notification['subscription_information'], notification['data'],
+                                                 PushOptions(**notification['options']))
+
     @staticmethod
-    def _send_notification(subscription_information, data) -> messages.MessageSendResult:
+    def _notification(subscription_information, data, options: PushOptions = TEXT_PUSH_OPTIONS) -> dict:
+        return {
+            'subscription_information': subscription_information,
+            'data': data,
+            'options': options._asdict(),
+        }
+
+    @staticmethod
+    def _send_notification(subscription_information, data,
+                           options: PushOptions = TEXT_PUSH_OPTIONS) -> messages.MessageSendResult:
         app = get_app()
 
         try:
@@ -41,7 +105,9 @@ class MessageHandler(messages.MessageHandler):
                 subscription_info=subscription_information,
                 data=json.dumps(data),
                 vapid_private_key=app.config['VAPID_PRIVATE_KEY'],
-                vapid_claims=copy.deepcopy(VAPID_CLAIMS)
+                vapid_claims=copy.deepcopy(VAPID_CLAIMS),
+                ttl=options.ttl,
+                headers=options.get_headers()
             )
 
             if app.config.get('VERBOSE'):
@@ -53,6 +119,9 @@ class MessageHandler(messages.MessageHandler):
         except WebPushException as e:
             response = e.response
 
+            if response is None:  # The push service couldn't be reached
+                return messages.MessageSendResult.EXTERNAL_ERROR
+
             if app.config.get('VERBOSE'):
                 print('Received {} for push {}'.format(response.status_code, subscription_information['endpoint']),
                       flush=True)
@@ -75,7 +144,7 @@ class MessageHandler(messages.MessageHandler):
             return messages.MessageSendResult.ERROR
 
     @staticmethod
-    def _send_text_message(user: users.User, message: messages.TextMessage) -> messages.MessageSendResult:
+    def _prepare_text_message(user: users.User, message: messages.TextMessage):
         subscription_information = copy.deepcopy(user.get_data())
         subscription_information['endpoint'] = user.get_internal_id()
 
@@ -93,10 +162,10 @@ class MessageHandler(messages.MessageHandler):
             }
         }
 
-        return MessageHandler._send_notification(subscription_information, data)
+        return MessageHandler._notification(subscription_information, data)
 
     @staticmethod
-    def _send_menu_message(user: users.User, message: messages.MenuMessage) -> messages.MessageSendResult:
+    def _prepare_menu_message(user: users.User, message: messages.MenuMessage):
         locale = user.get_locale() or translation.LANGUAGE_DUTCH
         menu = message.menu
 
@@ -125,11 +194,12 @@ class MessageHandler(messages.MessageHandler):
             }
         }
 
-        return MessageHandler._send_notification(subscription_information, data)
+        options = get_menu_push_options(menu.campus, menu.menu_day)
+
+        return MessageHandler._notification(subscription_information, data, options)
 
     @staticmethod
-    def _send_subscription_menu_message(user: users.User,
-                                        message: messages.SubscriptionMenuMessage) -> messages.MessageSendResult:
+    def _prepare_subscription_menu_message(user: users.User, message: messages.SubscriptionMenuMessage):
         campus = user.get_campus_for_day(message.date)
         if campus is None:
             # If no campus for selected day, just success it
@@ -169,4 +239,6 @@ class MessageHandler(messages.MessageHandler):
         subscription_information = copy.deepcopy(user.get_data())
         subscription_information['endpoint'] = user.get_internal_id()
 
-        return MessageHandler._send_notification(subscription_information, copy.deepcopy(data))
+        options = get_menu_push_options(campus, message.date)
+
+        return MessageHandler._notification(subscription_information, copy.deepcopy(data), options)
@@ -1,18 +1,19 @@
 import datetime
-import glob
-import json
 import os
 import signal
 import sys
-import traceback
 import unittest
-from typing import Optional
+from typing import Optional, Tuple
 
 import click
 from colour_runner.runner import ColourTextTestRunner
 from flask import current_app
 from flask.cli import FlaskGroup
 
+import komidabot.bulk_io as bulk_io
+import komidabot.cleanup as cleanup_impl
+import komidabot.learning_data as learning_data
+import komidabot.menu_backfill as menu_backfill
 import komidabot.models as models
 from app import create_app
 from komidabot.models_training import LearningDatapoint
@@ -26,9 +27,17 @@ def recreate_db():
 
 
 @cli.command('seed_db')
-def seed_db():
+@click.option('--batch-size', default=bulk_io.BATCH_SIZE, show_default=True, help='Number of users per transaction')
+def seed_db(batch_size: int):
     models.create_standard_values()
-    models.import_dump(current_app.config['DUMP_FILE'])
+
+    if current_app.config['DUMP_FILE']:
+        with open(current_app.config['DUMP_FILE']) as file:
+            result = bulk_io.import_dump(file, batch_size=batch_size)
+
+        print('Users: {} inserted, {} updated, {} skipped in {:.1f}s ({:.0f} users/s)'.format(
+            result.inserted, result.updated, result.skipped, result.duration, result.throughput
+        ))
 
 
 @cli.command('run_subscription')
@@ -37,92 +46,301 @@ def run_subscription():
 
 
 @cli.command('update_menus')
-def update_menus():
-    raise NotImplementedError()
+@click.option('--campus', 'campuses', multiple=True, help='Short name of a campus to update (defaults to all)')
+@click.option('--from', 'from_str', help='First date to update (defaults to today)')
+@click.option('--to', 'to_str', help='Last date to update (defaults to a week after the first date)')
+@click.option('--workers', default=4, show_default=True, help='Number of menus fetched at the same time')
+@click.option('--dry-run', is_flag=True, help="Show which menus would change, but don't store anything")
+def update_menus(campuses: 'Tuple[str]', from_str: Optional[str], to_str: Optional[str], workers: int,
+                 dry_run: bool):
+    """Fetches and stores the menus of a range of dates"""
+    from komidabot.komidabot import update_menus as update_menus_impl
+    from komidabot.menu_ingestion import MenuUpdateStats
+    from komidabot.pretranslation import pretranslate
+
+    first_day = datetime.date.fromisoformat(from_str) if from_str else datetime.date.today()
+    last_day = datetime.date.fromisoformat(to_str) if to_str else first_day + datetime.timedelta(days=7)
+
+    if last_day < first_day:
+        raise click.BadParameter('--to is before --from')
+
+    dates = [first_day + datetime.timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    campus_count = len([campus for campus in models.Campus.get_all_active()
+                        if not campuses or campus.short_name in campuses])
+
+    stats = MenuUpdateStats()
+    done_per_campus = dict()
+
+    with click.progressbar(length=campus_count * len(dates), label='Updating menus', file=sys.stderr) as bar:
+        def on_progress(campus: models.Campus, done: int, _total: int):
+            bar.update(done - done_per_campus.get(campus.short_name, 0))
+            done_per_campus[campus.short_name] = done
+
+        translatable_ids = update_menus_impl(*campuses, dates=dates, on_progress=on_progress, max_workers=workers,
+                                             dry_run=dry_run, stats=stats)
+
+    _print_menu_update_stats(stats, dry_run)
+
+    if not dry_run:
+        result = pretranslate(translatable_ids, current_app.translator)
+
+        print('Pre-translation: translated {}, failed {}'.format(result.translated, result.failed))
+
+
+def _print_menu_update_stats(stats: 'MenuUpdateStats', dry_run: bool = False):
+    from komidabot.menu_ingestion import STAGES
+
+    print('Menus{}: {} requests, {} changed, {} unchanged, {} skipped'.format(
+        ' (dry run)' if dry_run else '', stats.requests, stats.changed, stats.unchanged, stats.skipped
+    ))
+
+    percentiles = [50, 90, 99, 100]
+
+    print('Latency (ms) {:>9} {:>9} {:>9} {:>9}'.format('p50', 'p90', 'p99', 'max'))
+
+    for stage in STAGES:
+        values = stats.get_percentiles(stage, percentiles)
+
+        if values is None:
+            print('  {:<10} {:>9} {:>9} {:>9} {:>9}'.format(stage, *['-'] * len(percentiles)))
+        else:
+            print('  {:<10} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(stage, *[value * 1000 for value in values]))
 
 
 @cli.command('cleanup')
-def cleanup():
-    raise NotImplementedError()
+@click.option('--menus', 'menu_days', type=int, default=0, show_default=True,
+              help='Days menus are kept for, 0 keeps them forever')
+@click.option('--delivery-ledger', 'delivery_ledger_days', type=int,
+              default=cleanup_impl.Retention().delivery_ledger, show_default=True,
+              help='Days entries of the delivery ledger are kept for, 0 keeps them forever')
+@click.option('--outbox', 'outbox_days', type=int, default=cleanup_impl.Retention().outbox, show_default=True,
+              help='Days handled outbox messages are kept for, 0 keeps them forever')
+@click.option('--jobs', 'job_days', type=int, default=cleanup_impl.Retention().jobs, show_default=True,
+              help='Days finished jobs are kept for, 0 keeps them forever')
+@click.option('--learning-data', 'learning_data_days', type=int, default=0, show_default=True,
+              help='Days learning data is kept for, 0 keeps it forever')
+@click.option('--batch-size', default=cleanup_impl.BATCH_SIZE, show_default=True,
+              help='Number of rows deleted per transaction')
+def cleanup(menu_days: int, delivery_ledger_days: int, outbox_days: int, job_days: int, learning_data_days: int,
+            batch_size: int):
+    """Removes menus on closing days, old rows and unused translatables"""
+    retention = cleanup_impl.Retention(
+        menus=menu_days or None,
+        delivery_ledger=delivery_ledger_days or None,
+        outbox=outbox_days or None,
+        jobs=job_days or None,
+        learning_data=learning_data_days or None,
+    )
+
+    print('{:<16} {:>10} {:>10}'.format('Step', 'Rows', 'Time (s)'))
+
+    results = cleanup_impl.cleanup(retention, batch_size=batch_size, on_step=lambda result: print(
+        '{:<16} {:>10} {:>10.2f}'.format(result.step, result.rows, result.duration), flush=True
+    ))
+
+    print('{:<16} {:>10} {:>10.2f}'.format('total', sum(result.rows for result in results),
+                                           sum(result.duration for result in results)))
 
 
 @cli.command('synchronize_menus')
-def synchronize_menus():
-    raise NotImplementedError()
+@click.argument('from_str', metavar='FROM')
+@click.argument('to_str', metavar='TO')
+@click.option('--campus', 'campuses', multiple=True, help='Short name of a campus to backfill (defaults to all)')
+@click.option('--workers', default=menu_backfill.MAX_WORKERS, show_default=True,
+              help='Number of weeks fetched at the same time')
+@click.option('--batch-size', default=menu_backfill.BATCH_SIZE, show_default=True,
+              help='Number of weeks stored per transaction')
+@click.option('--restart', is_flag=True, help='Backfill weeks again, even if an earlier run completed them')
+def synchronize_menus(from_str: str, to_str: str, campuses: 'Tuple[str]', workers: int, batch_size: int,
+                      restart: bool):
+    """Backfills the menus from FROM to TO, continuing where an earlier run left off"""
+    from extensions import db
+    from komidabot.menu_ingestion import MenuUpdateStats
+    from komidabot.models_jobs import BackfillShard
 
+    first_day = datetime.date.fromisoformat(from_str)
+    last_day = datetime.date.fromisoformat(to_str)
 
-@cli.command('upload_learning_data')
-def upload_learning_data():
-    import komidabot.external_menu as external_menu
-    from extensions import db
-    from komidabot.rate_limit import Limiter
+    if last_day < first_day:
+        raise click.BadParameter('TO is before FROM')
 
-    limiter = Limiter(10)
-    files = glob.glob(os.path.join(os.path.dirname(__file__), 'learning-data', '*.json'))
+    campus_list = [campus for campus in models.Campus.get_all_active() if not campuses or campus.short_name in campuses]
 
-    for file in sorted(files):
-        limiter()
-        print(os.path.basename(file))
+    if restart:
+        cleared = BackfillShard.clear([campus.id for campus in campus_list], menu_backfill.get_week_start(first_day),
+                                      menu_backfill.get_week_start(last_day))
+        db.session.commit()
 
-        try:
-            with open(file, 'r') as f:
-                data = json.load(f)
-        except KeyboardInterrupt:
-            raise
-        except json.JSONDecodeError:
-            print('Could not decode:', file)
-            continue
+        print('Forgot {} completed weeks'.format(cleared), file=sys.stderr)
 
-        campus = models.Campus.get_by_short_name(data['restaurant'])
-        date = datetime.date.fromisoformat(data['date'])
+    stats = MenuUpdateStats()
+    shard_count = len(menu_backfill.get_shards(campus_list, first_day, last_day))
 
-        try:
-            data_raw = external_menu.fetch_raw(campus, date)
-            data_parsed = external_menu.parse_fetched(data_raw)
-            data_processed = external_menu.process_parsed(data_parsed)
-        except KeyboardInterrupt:
-            raise
-        except Exception as e:
-            print('Failure parsing external menu for:', file)
+    with click.progressbar(length=shard_count, label='Backfilling menus', file=sys.stderr) as bar:
+        result = menu_backfill.backfill_menus(campus_list, first_day, last_day, max_workers=workers,
+                                              batch_size=batch_size, stats=stats, on_shard=lambda _: bar.update(1))
 
-            traceback.print_tb(e.__traceback__)
-            print(e, flush=True, file=sys.stderr)
+    print('Weeks: {} completed, {} already completed before, {} failed'.format(result.completed, result.skipped,
+                                                                               result.failed))
 
-            continue
+    _print_menu_update_stats(stats)
 
-        reference_menu: list = data['menu']
-        processed_menu: list = data_processed['menu'] if data_processed is not None else []
 
-        matched = []
+@cli.command('dispatch_report')
+@click.option('--date', 'date_str', help='Date of the dispatch (defaults to today)')
+@click.option('--channel', default='daily_menu', show_default=True)
+def dispatch_report(date_str: Optional[str], channel: str):
+    date = datetime.date.fromisoformat(date_str) if date_str else datetime.date.today()
+    report = models.DeliveryLedger.get_report(date, channel)
 
-        for reference_item in reference_menu:
-            i = 0
+    print('Dispatch of {} on {}'.format(report.channel, report.dispatch_date.isoformat()))
+    print('  Recipients: {}'.format(report.total))
+    print('  Delivered:  {}'.format(report.delivered))
+    print('  Pending:    {}'.format(report.pending))
+    print('  Failed:     {}'.format(report.failed))
 
-            for processed_item in processed_menu:
-                if processed_item['name']['nl'].lower() == reference_item['course_name'].lower():
-                    matched.append((reference_item, processed_item))
-                    break
+    for result, count in sorted(report.results.items()):
+        print('    {:<16} {}'.format(result, count))
 
-                i = i + 1
-            else:
-                print('Could not match reference item', reference_item['course_name'].lower())
-                continue
+    if report.throughput is not None:
+        print('  Throughput: {:.2f} messages/s'.format(report.throughput))
+
+
+@cli.command('export_translations')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+@click.option('--format', 'file_format', type=click.Choice(bulk_io.FORMATS),
+              help='Format of the output (defaults to the file extension, JSONL for stdout)')
+def export_translations(output: str, file_format: Optional[str]):
+    """Exports the translation memory to a CSV or JSONL file"""
+    file_format = bulk_io.get_format(output, file_format)
+
+    with click.open_file(output, 'w', encoding='utf-8') as file:
+        count = bulk_io.write_records(file, file_format, bulk_io.TRANSLATION_MEMORY_FIELDS,
+                                      bulk_io.iter_translation_memory())
+
+    print('Exported {} translations'.format(count), file=sys.stderr)
 
-            processed_menu.pop(i)
 
-        for processed_item in processed_menu:
-            print('Could not match processed item', processed_item['name']['nl'].lower())
+@cli.command('export_users')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+@click.option('--format', 'file_format', type=click.Choice(bulk_io.FORMATS),
+              help='Format of the output (defaults to the file extension, JSONL for stdout)')
+@click.option('--batch-size', default=bulk_io.BATCH_SIZE, show_default=True, help='Number of rows fetched at a time')
+def export_users(output: str, file_format: Optional[str], batch_size: int):
+    """Exports the users and their campus on every weekday to a CSV or JSONL file"""
+    file_format = bulk_io.get_format(output, file_format)
 
-        try:
-            for reference_item, processed_item in matched:
-                LearningDatapoint.create(campus, date, reference_item['screenshot'], processed_item)
-        except KeyboardInterrupt:
-            raise
-        except Exception:
-            print('Failure adding to database for', file)
-            continue
+    with click.open_file(output, 'w', encoding='utf-8') as file:
+        count = bulk_io.write_records(file, file_format, bulk_io.USER_FIELDS,
+                                      bulk_io.iter_users(batch_size=batch_size))
 
-    db.session.commit()
+    print('Exported {} users'.format(count), file=sys.stderr)
+
+
+@cli.command('export_menus')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+@click.option('--format', 'file_format', type=click.Choice(bulk_io.FORMATS),
+              help='Format of the output (defaults to the file extension, JSONL for stdout)')
+@click.option('--from', 'from_str', help='First date to export (defaults to the first menu)')
+@click.option('--to', 'to_str', help='Last date to export (defaults to the last menu)')
+@click.option('--batch-size', default=bulk_io.BATCH_SIZE, show_default=True, help='Number of rows fetched at a time')
+def export_menus(output: str, file_format: Optional[str], from_str: Optional[str], to_str: Optional[str],
+                 batch_size: int):
+    """Exports the menu items and the translations of their names to a CSV or JSONL file"""
+    file_format = bulk_io.get_format(output, file_format)
+
+    first_day = datetime.date.fromisoformat(from_str) if from_str else None
+    last_day = datetime.date.fromisoformat(to_str) if to_str else None
+
+    with click.open_file(output, 'w', encoding='utf-8') as file:
+        count = bulk_io.write_records(file, file_format, bulk_io.MENU_FIELDS,
+                                      bulk_io.iter_menus(first_day, last_day, batch_size=batch_size))
+
+    print('Exported {} menu items'.format(count), file=sys.stderr)
+
+
+@cli.command('export_learning_data')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+@click.option('--format', 'file_format', type=click.Choice(bulk_io.FORMATS),
+              help='Format of the output (defaults to the file extension, JSONL for stdout)')
+@click.option('--batch-size', default=bulk_io.BATCH_SIZE, show_default=True, help='Number of rows fetched at a time')
+def export_learning_data(output: str, file_format: Optional[str], batch_size: int):
+    """Exports the learning datapoints and their submissions to a CSV or JSONL file"""
+    file_format = bulk_io.get_format(output, file_format)
+
+    with click.open_file(output, 'w', encoding='utf-8') as file:
+        count = bulk_io.write_records(file, file_format, bulk_io.LEARNING_DATA_FIELDS,
+                                      bulk_io.iter_learning_data(batch_size=batch_size))
+
+    print('Exported {} learning datapoints'.format(count), file=sys.stderr)
+
+
+@cli.command('import_translations')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'file_format', type=click.Choice(bulk_io.FORMATS),
+              help='Format of the input (defaults to the file extension, JSONL for stdin)')
+@click.option('--batch-size', default=bulk_io.BATCH_SIZE, show_default=True)
+def import_translations(path: str, file_format: Optional[str], batch_size: int):
+    """Imports a translation memory from a CSV or JSONL file
+
+    The translation cache of a running bot isn't updated, clear it using DELETE /api/translations/cache or restart it.
+    """
+    file_format = bulk_io.get_format(path, file_format)
+
+    with click.open_file(path, 'r', encoding='utf-8') as file:
+        result = bulk_io.import_translation_memory(bulk_io.read_records(file, file_format), batch_size=batch_size)
+
+    print('Inserted {}, updated {}, skipped {} translations'.format(result.inserted, result.updated, result.skipped))
+
+    if result.inserted or result.updated:
+        print('Clear the translation cache of the running bot using DELETE /api/translations/cache')
+
+
+@cli.command('upload_learning_data')
+@click.option('--workers', default=learning_data.MAX_WORKERS, show_default=True)
+@click.option('--refetch', is_flag=True, help='Fetch menus again, even if they were fetched before')
+def upload_learning_data(workers: int, refetch: bool):
+    """Creates learning datapoints from the files in learning-data, skipping those that were imported before"""
+    directory = os.path.join(os.path.dirname(__file__), 'learning-data')
+
+    # noinspection PyProtectedMember
+    result = learning_data.upload_learning_data(current_app._get_current_object(), directory, max_workers=workers,
+                                                refetch=refetch)
+
+    print('Imported {} files ({} datapoints), skipped {}, failed {}'.format(result.imported, result.datapoints,
+                                                                          result.skipped, result.failed))
+
+
+@cli.command('migrate_screenshots')
+@click.option('--batch-size', default=100, show_default=True)
+@click.option('--restore', is_flag=True,
+              help='Copy the screenshots back into the database instead, needed before downgrading the database')
+def migrate_screenshots(batch_size: int, restore: bool):
+    """Moves screenshots of learning datapoints from the database to blob storage"""
+    from extensions import db
+
+    count = 0
+
+    while True:
+        if restore:
+            datapoints = LearningDatapoint.find_without_inline_screenshot(batch_size)
+        else:
+            datapoints = LearningDatapoint.find_with_inline_screenshot(batch_size)
+
+        if not datapoints:
+            break
+
+        for datapoint in datapoints:
+            if restore:
+                datapoint.restore_screenshot()
+            else:
+                datapoint.move_screenshot()
+
+        db.session.commit()
+        db.session.expunge_all()  # Don't keep the screenshots in memory
+
+        count += len(datapoints)
+        print('{} {} screenshots'.format('Restored' if restore else 'Moved', count), flush=True)
 
 
 @cli.command('test', with_appcontext=False)
@@ -148,4 +366,9 @@ def handler(signum: int, _):
 
 if __name__ == '__main__':
     signal.signal(signal.SIGTERM, handler)
+
+    # Scheduled jobs and outbox workers only run in the process serving the bot, not for any other command
+    if sys.argv[1:2] != ['run']:
+        os.environ.setdefault('KOMIDABOT_BACKGROUND_TASKS', 'false')
+
     cli()
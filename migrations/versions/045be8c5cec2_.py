@@ -0,0 +1,31 @@
+"""Add delivery ledger table to keep track of subscription deliveries
+
+Revision ID: 045be8c5cec2
+Revises: ecce0e669d8c
+Create Date: 2026-10-19 12:18:46.026625
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '045be8c5cec2'
+down_revision = 'ecce0e669d8c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('delivery_ledger',
+                    sa.Column('dispatch_date', sa.Date(), nullable=False),
+                    sa.Column('channel', sa.String(length=32), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('result', sa.String(length=16), nullable=True),
+                    sa.Column('queued_on', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('delivered_on', sa.DateTime(), nullable=True),
+                    sa.PrimaryKeyConstraint('dispatch_date', 'channel', 'user_id')
+                    )
+
+
+def downgrade():
+    op.drop_table('delivery_ledger')
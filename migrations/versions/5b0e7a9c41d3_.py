@@ -0,0 +1,25 @@
+"""Store the locale reported by the provider for users without a chosen language
+
+Revision ID: 5b0e7a9c41d3
+Revises: c3d1e6f4a2b7
+Create Date: 2026-10-19 16:04:12.903318
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5b0e7a9c41d3'
+down_revision = 'c3d1e6f4a2b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('app_user', sa.Column('provider_locale', sa.String(length=16), nullable=True))
+    op.add_column('app_user', sa.Column('provider_locale_refreshed_on', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('app_user', 'provider_locale_refreshed_on')
+    op.drop_column('app_user', 'provider_locale')
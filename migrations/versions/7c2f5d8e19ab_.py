@@ -0,0 +1,120 @@
+"""Add normalized text to translatables and merge translatables that only differ in case, punctuation or whitespace
+
+Revision ID: 7c2f5d8e19ab
+Revises: 5b0e7a9c41d3
+Create Date: 2026-10-19 17:21:45.380127
+
+"""
+import re
+import unicodedata
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '7c2f5d8e19ab'
+down_revision = '5b0e7a9c41d3'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+translatable = sa.table('translatable',
+                        sa.column('id', sa.Integer()),
+                        sa.column('original_text', sa.String()),
+                        sa.column('normalized_text', sa.String()))
+
+
+# Copy of komidabot.util.normalize_text at the time of this migration
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = re.sub(r'[^\w\s]+', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+
+    return text.strip()
+
+
+def upgrade():
+    connection = op.get_bind()
+
+    op.add_column('translatable', sa.Column('normalized_text', sa.Text(), nullable=True))
+
+    # Fill in the normalized texts in batches
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select(translatable.c.id, translatable.c.original_text)
+                                  .where(translatable.c.id > last_id)
+                                  .order_by(translatable.c.id).limit(BATCH_SIZE)).fetchall()
+
+        if not rows:
+            break
+
+        connection.execute(translatable.update().where(translatable.c.id == sa.bindparam('b_id'))
+                           .values(normalized_text=sa.bindparam('b_normalized_text')),
+                           [{'b_id': row.id, 'b_normalized_text': normalize_text(row.original_text)} for row in rows])
+
+        last_id = rows[-1].id
+
+    # Merge translatables with the same normalized text into the oldest one
+    op.execute("""
+    CREATE TEMPORARY TABLE translatable_merge AS
+    SELECT id, keep_id
+    FROM (
+        SELECT id, min(id) OVER (PARTITION BY original_language, normalized_text) AS keep_id
+        FROM translatable
+    ) AS groups
+    WHERE id <> keep_id
+    """)
+
+    # Per language, keep the translation of the best provider, preferring the translatable that is kept
+    op.execute("""
+    INSERT INTO translation (translatable_id, language, translation, provider)
+    SELECT keep_id, language, translation, provider
+    FROM (
+        SELECT DISTINCT ON (merged.keep_id, translation.language)
+            merged.keep_id, translation.translatable_id, translation.language, translation.translation,
+            translation.provider
+        FROM translation
+        JOIN (
+            SELECT id, keep_id FROM translatable_merge
+            UNION
+            SELECT keep_id, keep_id FROM translatable_merge
+        ) AS merged ON merged.id = translation.translatable_id
+        ORDER BY merged.keep_id, translation.language,
+            CASE WHEN provider = 'komida' THEN 0 WHEN provider = 'manual' OR provider IS NULL THEN 1 ELSE 2 END,
+            translation.translatable_id <> merged.keep_id, translation.translatable_id
+    ) AS best
+    WHERE translatable_id <> keep_id
+    ON CONFLICT (translatable_id, language) DO UPDATE
+    SET translation = excluded.translation, provider = excluded.provider
+    """)
+    op.execute("""
+    UPDATE menu_item
+    SET translatable_id = translatable_merge.keep_id
+    FROM translatable_merge
+    WHERE menu_item.translatable_id = translatable_merge.id
+    """)
+    op.execute("""
+    UPDATE closing_days
+    SET translatable_id = translatable_merge.keep_id
+    FROM translatable_merge
+    WHERE closing_days.translatable_id = translatable_merge.id
+    """)
+
+    # Translations of the duplicates are removed together with them
+    op.execute("""
+    DELETE FROM translatable
+    USING translatable_merge
+    WHERE translatable.id = translatable_merge.id
+    """)
+    op.execute("DROP TABLE translatable_merge")
+
+    op.alter_column('translatable', 'normalized_text', nullable=False)
+    op.create_index('ix_translatable_normalized_text', 'translatable', ['original_language', 'normalized_text'],
+                    unique=False)
+
+
+def downgrade():
+    # Merged translatables are not restored
+    op.drop_index('ix_translatable_normalized_text', table_name='translatable')
+    op.drop_column('translatable', 'normalized_text')
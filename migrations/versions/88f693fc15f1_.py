@@ -0,0 +1,39 @@
+"""Add outbox table for messages that are delivered in the background
+
+Revision ID: 88f693fc15f1
+Revises: 045be8c5cec2
+Create Date: 2026-10-19 14:02:11.518203
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '88f693fc15f1'
+down_revision = '045be8c5cec2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox_message',
+                    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('channel', sa.String(length=32), nullable=True),
+                    sa.Column('dispatch_date', sa.Date(), nullable=True),
+                    sa.Column('payload', sa.Text(), nullable=False),
+                    sa.Column('result', sa.String(length=16), nullable=True),
+                    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+                    sa.Column('next_attempt', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('queued_on', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('delivered_on', sa.DateTime(), nullable=True),
+                    sa.ForeignKeyConstraint(['user_id'], ['app_user.id'], onupdate='CASCADE', ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_outbox_message_pending', 'outbox_message', ['next_attempt'], unique=False,
+                    postgresql_where=sa.text('result IS NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_outbox_message_pending', table_name='outbox_message')
+    op.drop_table('outbox_message')
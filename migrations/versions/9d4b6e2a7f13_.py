@@ -0,0 +1,35 @@
+"""Store screenshots of learning datapoints outside of the database
+
+Revision ID: 9d4b6e2a7f13
+Revises: 7c2f5d8e19ab
+Create Date: 2026-10-19 18:02:37.514206
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '9d4b6e2a7f13'
+down_revision = '7c2f5d8e19ab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing screenshots are moved to blob storage using the migrate_screenshots command
+    op.add_column('learning_datapoint', sa.Column('screenshot_hash', sa.String(length=64), nullable=True))
+    op.alter_column('learning_datapoint', 'screenshot', existing_type=sa.Text(), nullable=True)
+
+
+def downgrade():
+    # Screenshots are only kept in blob storage, they need to be copied back into the database first
+    missing = op.get_bind().execute(sa.text(
+        "SELECT COUNT(*) FROM learning_datapoint WHERE screenshot IS NULL"
+    )).scalar()
+
+    if missing:
+        raise RuntimeError('{} learning datapoints have their screenshot in blob storage, run '
+                           '"manage.py migrate_screenshots --restore" before downgrading'.format(missing))
+
+    op.alter_column('learning_datapoint', 'screenshot', existing_type=sa.Text(), nullable=False)
+    op.drop_column('learning_datapoint', 'screenshot_hash')
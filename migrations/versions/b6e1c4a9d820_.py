@@ -0,0 +1,30 @@
+"""Add backfill_shard table to checkpoint menu backfills
+
+Revision ID: b6e1c4a9d820
+Revises: 9d4b6e2a7f13
+Create Date: 2026-10-19 19:12:08.661843
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1c4a9d820'
+down_revision = '9d4b6e2a7f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('backfill_shard',
+                    sa.Column('campus_id', sa.Integer(), nullable=False),
+                    sa.Column('week_start', sa.Date(), nullable=False),
+                    sa.Column('menus', sa.Integer(), nullable=False),
+                    sa.Column('completed_on', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+                    sa.ForeignKeyConstraint(['campus_id'], ['campus.id'], onupdate='CASCADE', ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('campus_id', 'week_start')
+                    )
+
+
+def downgrade():
+    op.drop_table('backfill_shard')
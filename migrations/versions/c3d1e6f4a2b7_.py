@@ -0,0 +1,36 @@
+"""Add job table for long running jobs started by admins
+
+Revision ID: c3d1e6f4a2b7
+Revises: 88f693fc15f1
+Create Date: 2026-10-19 15:21:40.284719
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'c3d1e6f4a2b7'
+down_revision = '88f693fc15f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+                    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                    sa.Column('job_type', sa.String(length=32), nullable=False),
+                    sa.Column('status', sa.Enum('QUEUED', 'RUNNING', 'DONE', 'FAILED', name='jobstatus'),
+                              nullable=False),
+                    sa.Column('arguments', sa.Text(), nullable=False),
+                    sa.Column('progress', sa.Text(), server_default='{}', nullable=False),
+                    sa.Column('error', sa.Text(), nullable=True),
+                    sa.Column('created_on', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('started_on', sa.DateTime(), nullable=True),
+                    sa.Column('finished_on', sa.DateTime(), nullable=True),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+
+
+def downgrade():
+    op.drop_table('job')
+    op.execute("""DROP TYPE jobstatus""")
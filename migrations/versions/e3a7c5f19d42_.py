@@ -0,0 +1,21 @@
+"""Don't limit the length of normalized texts of translatables
+
+Revision ID: e3a7c5f19d42
+Revises: b6e1c4a9d820
+Create Date: 2026-10-19 20:41:53.218604
+
+"""
+# revision identifiers, used by Alembic.
+revision = 'e3a7c5f19d42'
+down_revision = 'b6e1c4a9d820'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # XXX: 7c2f5d8e19ab now creates normalized_text as Text, this revision is kept for databases that already applied it
+    pass
+
+
+def downgrade():
+    pass
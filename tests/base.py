@@ -64,6 +64,9 @@ class BaseTestCase(TestCase):
 
         self.app.translator = self.translator = StubTranslator()
 
+        # Ids are reused between tests, so cached translations would leak into other tests
+        models.translation_cache.clear()
+
         with self.app.app_context():
             db.create_all()
             db.session.commit()
@@ -73,6 +76,10 @@ class BaseTestCase(TestCase):
             db.session.remove()
             db.drop_all()
 
+            # Every test has its own app and with it its own connection pool, which includes the connections of worker
+            # threads. Close them, so they don't pile up over the tests.
+            db.engine.dispose()
+
         super().tearDown()
 
     def assertEqualCommutative(self, first, second, msg=None):
@@ -0,0 +1,69 @@
+import base64
+import io
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+
+from komidabot.blob_storage import LocalBlobStorage, get_blob_key
+from komidabot.screenshots import decode_screenshot, get_screenshot
+
+
+class TestBlobStorage(TestCase):
+    """
+    Test komidabot.blob_storage and komidabot.screenshots
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalBlobStorage(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_local_storage(self):
+        key = self.storage.put(b'data')
+
+        self.assertEqual(key, get_blob_key(b'data'))
+        self.assertTrue(self.storage.exists(key))
+        self.assertEqual(self.storage.get(key), b'data')
+
+        # Storing the same data again results in the same blob
+        self.assertEqual(self.storage.put(b'data'), key)
+
+        missing = get_blob_key(b'missing')
+        self.assertFalse(self.storage.exists(missing))
+        self.assertIsNone(self.storage.get(missing))
+
+        with self.assertRaises(ValueError):
+            self.storage.get('../' + key[3:])
+
+    def test_decode_screenshot(self):
+        encoded = base64.b64encode(b'screenshot').decode('ascii')
+
+        self.assertEqual(decode_screenshot(encoded), b'screenshot')
+        self.assertEqual(decode_screenshot('data:image/png;base64,' + encoded), b'screenshot')
+
+    def test_get_screenshot(self):
+        output = io.BytesIO()
+        Image.new('RGBA', (1000, 500), (255, 0, 0, 255)).save(output, format='PNG')
+        original = output.getvalue()
+
+        key = self.storage.put(original)
+
+        self.assertEqual(get_screenshot(self.storage, key), (original, 'image/png'))
+
+        data, mimetype = get_screenshot(self.storage, key, 320)
+        image = Image.open(io.BytesIO(data))
+
+        self.assertEqual(mimetype, 'image/jpeg')
+        self.assertEqual(image.size, (320, 160))
+
+        # Images are not scaled up
+        data, _ = get_screenshot(self.storage, key, 1280)
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (1000, 500))
+
+        with self.assertRaises(ValueError):
+            get_screenshot(self.storage, key, 100)
+
+        self.assertIsNone(get_screenshot(self.storage, get_blob_key(b'missing'), 320))
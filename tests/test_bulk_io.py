@@ -0,0 +1,190 @@
+import datetime
+import io
+import json
+from decimal import Decimal
+
+import komidabot.bulk_io as bulk_io
+import komidabot.models as models
+from app import db
+from komidabot.models_training import LearningDatapoint
+from komidabot.models_users import RegisteredUser
+from tests.base import BaseTestCase
+
+
+class TestBulkIO(BaseTestCase):
+    """
+    Test komidabot.bulk_io
+    """
+
+    def test_import_translation_memory(self):
+        with self.app.app_context():
+            friet, _ = models.Translatable.get_or_create('Friet', 'nl')
+            soep, _ = models.Translatable.get_or_create('Soep', 'nl')
+            friet.add_translation('en', 'Chips', 'google')
+            soep.add_translation('en', 'Soup', 'komida')
+            db.session.commit()
+
+            data = io.StringIO('\n'.join(json.dumps(record) for record in [
+                # Replaces the translation from Google
+                {'original_language': 'nl', 'original_text': 'friet', 'language': 'en', 'translation': 'Fries',
+                 'provider': 'manual'},
+                # Doesn't replace the official translation
+                {'original_language': 'nl', 'original_text': 'Soep', 'language': 'en', 'translation': 'Broth',
+                 'provider': 'manual'},
+                # New translatable
+                {'original_language': 'nl', 'original_text': 'Stoofvlees', 'language': 'fr',
+                 'translation': 'Carbonnade', 'provider': 'komida'},
+                # Duplicate with a lower precedence
+                {'original_language': 'nl', 'original_text': 'Stoofvlees', 'language': 'fr',
+                 'translation': 'Ragoût', 'provider': 'google'},
+                # Nothing to translate
+                {'original_language': 'nl', 'original_text': 'Soep', 'language': 'nl', 'translation': 'Soep'},
+            ]))
+
+            result = bulk_io.import_translation_memory(bulk_io.read_records(data, bulk_io.FORMAT_JSONL),
+                                                       batch_size=3)
+
+            self.assertEqual(result, bulk_io.TranslationImportResult(inserted=1, updated=1, skipped=3))
+
+            self.assertEqual(friet.get_translation('en').translation, 'Fries')
+            self.assertEqual(soep.get_translation('en').translation, 'Soup')
+
+            stoofvlees, _ = models.Translatable.get_or_create('Stoofvlees', 'nl')
+            self.assertEqual(stoofvlees.get_translation('fr').translation, 'Carbonnade')
+            self.assertEqual(stoofvlees.get_translation('fr').provider, 'komida')
+
+    def test_export_translation_memory(self):
+        with self.app.app_context():
+            friet, _ = models.Translatable.get_or_create('Friet', 'nl')
+            friet.add_translation('en', 'Fries', 'manual')
+            friet.add_translation('fr', 'Frites', None)
+            db.session.commit()
+
+            output = io.StringIO()
+            count = bulk_io.write_records(output, bulk_io.FORMAT_CSV, bulk_io.TRANSLATION_MEMORY_FIELDS,
+                                          bulk_io.iter_translation_memory(batch_size=1))
+
+            self.assertEqual(count, 2)
+            self.assertEqual(output.getvalue().splitlines(), [
+                'original_language,original_text,language,translation,provider',
+                'nl,Friet,en,Fries,manual',
+                'nl,Friet,fr,Frites,',
+            ])
+
+            # The export can be imported again
+            output.seek(0)
+            records = list(bulk_io.read_records(output, bulk_io.FORMAT_CSV))
+            self.assertIsNone(records[1]['provider'])
+
+            result = bulk_io.import_translation_memory(records)
+            self.assertEqual(result, bulk_io.TranslationImportResult(inserted=0, updated=2, skipped=0))
+
+    def test_import_dump(self):
+        with self.app.app_context():
+            models.Campus.create('Stadscampus', 'cst', [], 1)
+            models.Campus.create('Campus Middelheim', 'cmi', [], 3)
+            existing = models.AppUser.create('facebook', '1', 'en_GB')
+            db.session.commit()
+
+            existing_id = existing.id
+
+            dump = io.StringIO('\n'.join([
+                'id\tactive\tmonday\ttuesday\twednesday\tthursday\tfriday\tlocale',
+                '1\tTrue\tcst\tcst\tcmi\tcmi\tcst\tnl_BE',
+                '2\tFalse\tcmi\tcmi\tcmi\tcmi\tcmi\t0',
+                '3\tTrue\tcst\tcst\tcst\tcst\txxx\tnl_BE',  # Unknown campus
+                '4\tTrue\tcst',  # Missing columns
+                '',
+            ]))
+
+            result = bulk_io.import_dump(dump, batch_size=2)
+
+            self.assertEqual((result.inserted, result.updated, result.skipped), (1, 1, 2))
+
+            user1 = models.AppUser.find_by_id('facebook', '1')
+            self.assertEqual(user1.id, existing_id)
+            self.assertEqual(user1.language, 'en_GB')  # Not overwritten by the dump
+            self.assertEqual(user1.get_campus(models.Day.WEDNESDAY).short_name, 'cmi')
+            self.assertTrue(user1.get_subscription(models.Day.MONDAY).active)
+
+            user2 = models.AppUser.find_by_id('facebook', '2')
+            self.assertEqual(user2.language, '')
+            self.assertEqual(len(models.UserDayCampusPreference.get_all_for_user(user2)), 5)
+            self.assertFalse(user2.get_subscription(models.Day.FRIDAY).active)
+
+            self.assertIsNone(models.AppUser.find_by_id('facebook', '3'))
+
+    def test_export_users(self):
+        with self.app.app_context():
+            campus = models.Campus.create('Stadscampus', 'cst', [], 1)
+            user1 = models.AppUser.create('facebook', '1', 'nl_BE')
+            models.AppUser.create('web', '2', 'en')
+            db.session.flush()
+
+            user1.set_campus(models.Day.MONDAY, campus, active=True)
+            user1.set_campus(models.Day.FRIDAY, campus, active=False)
+            db.session.commit()
+
+            output = io.StringIO()
+            count = bulk_io.write_records(output, bulk_io.FORMAT_JSONL, bulk_io.USER_FIELDS,
+                                          bulk_io.iter_users(batch_size=1))
+
+            self.assertEqual(count, 2)
+
+            records = [json.loads(line) for line in output.getvalue().splitlines()]
+
+            self.assertEqual(records[0]['internal_id'], '1')
+            self.assertEqual((records[0]['monday'], records[0]['monday_active']), ('cst', True))
+            self.assertEqual((records[0]['friday'], records[0]['friday_active']), ('cst', False))
+            self.assertIsNone(records[0]['tuesday'])
+            self.assertEqual((records[1]['provider'], records[1]['monday']), ('web', None))
+
+    def test_export_menus(self):
+        with self.app.app_context():
+            campus = models.Campus.create('Stadscampus', 'cst', [], 1)
+            stoofvlees, _ = models.Translatable.get_or_create('Stoofvlees', 'nl')
+            stoofvlees.add_translation('en', 'Beef stew', 'manual')
+            soep, _ = models.Translatable.get_or_create('Soep', 'nl')
+
+            for day in [datetime.date(2020, 2, 3), datetime.date(2020, 2, 4)]:
+                menu = models.Menu.create(campus, day)
+                menu.add_menu_item(stoofvlees, models.CourseType.DAILY, models.CourseSubType.NORMAL, [],
+                                   [models.CourseAllergens.CELERY], Decimal('4.40'), Decimal('5.80'))
+                menu.add_menu_item(soep, models.CourseType.SOUP, models.CourseSubType.VEGAN, [], [],
+                                   Decimal('1.50'), None)
+            db.session.commit()
+
+            output = io.StringIO()
+            count = bulk_io.write_records(output, bulk_io.FORMAT_CSV, bulk_io.MENU_FIELDS,
+                                          bulk_io.iter_menus(first_day=datetime.date(2020, 2, 4), batch_size=1))
+
+            self.assertEqual(count, 2)
+
+            output.seek(0)
+            records = list(bulk_io.read_records(output, bulk_io.FORMAT_CSV))
+
+            self.assertEqual(records[0]['menu_day'], '2020-02-04')
+            self.assertEqual(records[0]['price_students'], '4.40')
+            self.assertEqual(json.loads(records[0]['course_allergens']), ['CELERY'])
+            self.assertEqual(json.loads(records[0]['translations']), {'en': 'Beef stew'})
+            self.assertEqual((records[1]['original_text'], records[1]['translations']), ('Soep', '{}'))
+            self.assertIsNone(records[1]['price_staff'])
+
+    def test_export_learning_data(self):
+        with self.app.app_context():
+            campus = models.Campus.create('Stadscampus', 'cst', [], 1)
+            user = RegisteredUser.create('test', '1', 'Test User', 'user@example.com', 'https://example.com/1.png')
+            db.session.flush()
+
+            datapoint1 = LearningDatapoint.create(campus, datetime.date(2020, 2, 3), b'1', {'index': 1})
+            LearningDatapoint.create(campus, datetime.date(2020, 2, 3), b'2', {'index': 2})
+            db.session.flush()
+
+            datapoint1.user_submit(user, {'course_type': 1})
+            db.session.commit()
+
+            records = list(bulk_io.iter_learning_data(batch_size=1))
+
+            self.assertEqual([record['processed_data'] for record in records], [{'index': 1}, {'index': 2}])
+            self.assertEqual(records[0]['submissions'], [{'user_id': user.id, 'submission': {'course_type': 1}}])
+            self.assertEqual(records[1]['submissions'], [])
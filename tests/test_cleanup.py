@@ -0,0 +1,97 @@
+import datetime
+from decimal import Decimal
+
+import komidabot.cleanup as cleanup
+import komidabot.models as models
+from extensions import db
+from komidabot.models_jobs import Job, JobStatus
+from tests.base import BaseTestCase
+
+
+class TestCleanup(BaseTestCase):
+    """
+    Test komidabot.cleanup
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.today = datetime.date.today()
+        self.old_day = self.today - datetime.timedelta(days=100)
+
+    def add_menu(self, campus: models.Campus, day: datetime.date, text: str) -> models.Menu:
+        translatable, _ = models.Translatable.get_or_create(text, 'nl')
+
+        menu = models.Menu.create(campus, day)
+        menu.add_menu_item(translatable, models.CourseType.DAILY, models.CourseSubType.NORMAL, [], [],
+                           Decimal('4.00'), None)
+
+        return menu
+
+    def test_cleanup(self):
+        with self.app.app_context():
+            campus = models.Campus.create('Testcampus', 'ctst', [], 0)
+            db.session.flush()
+
+            closed_day = self.today + datetime.timedelta(days=3)
+            models.ClosingDays.create(campus, closed_day, closed_day, 'Gesloten', 'nl')
+
+            self.add_menu(campus, self.old_day, 'Stoofvlees')
+            self.add_menu(campus, closed_day, 'Balletjes')
+            # Shared with the old menu, so the translatable is kept
+            self.add_menu(campus, self.today, 'Stoofvlees')
+
+            models.DeliveryLedger.add_pending(self.old_day, 'daily_menu', [1, 2])
+            models.DeliveryLedger.add_pending(self.today, 'daily_menu', [1])
+
+            old_job = Job.create('test', {})
+            running_job = Job.create('test', {})
+            db.session.flush()
+
+            old_job.status = JobStatus.DONE
+            old_job.finished_on = datetime.datetime.now() - datetime.timedelta(days=40)
+            running_job.status = JobStatus.RUNNING
+            db.session.commit()
+
+            results = cleanup.cleanup(cleanup.Retention(menus=30, delivery_ledger=30, outbox=30, jobs=30),
+                                      batch_size=1)
+            rows = {result.step: result.rows for result in results}
+
+            self.assertEqual(rows[cleanup.STEP_CLOSING_DAYS], 1)
+            self.assertEqual(rows[cleanup.STEP_MENUS], 1)
+            self.assertEqual(rows[cleanup.STEP_DELIVERY_LEDGER], 2)
+            self.assertEqual(rows[cleanup.STEP_JOBS], 1)
+            self.assertEqual(rows[cleanup.STEP_TRANSLATABLES], 1)
+            self.assertNotIn(cleanup.STEP_LEARNING_DATA, rows)
+
+            self.assertEqual([menu.menu_day for menu in models.Menu.query.all()], [self.today])
+            self.assertEqual(models.MenuItem.query.count(), 1)
+            self.assertEqual(models.DeliveryLedger.query.count(), 1)
+            self.assertEqual([job.id for job in Job.query.all()], [running_job.id])
+            self.assertEqual(sorted(translatable.original_text for translatable in models.Translatable.query.all()),
+                             ['Gesloten', 'Stoofvlees'])
+
+            # Nothing is left to clean up
+            results = cleanup.cleanup(cleanup.Retention(menus=30, delivery_ledger=30, outbox=30, jobs=30))
+
+            self.assertEqual(sum(result.rows for result in results), 0)
+
+    def test_cleanup_skips_translatables_in_use(self):
+        with self.app.app_context():
+            translatable, _ = models.Translatable.get_or_create('Stoofvlees', 'nl')
+            db.session.commit()
+
+            # Another transaction looked up the translatable, but hasn't added a menu item yet
+            with db.engine.connect() as connection, connection.begin():
+                connection.execute(db.select(models.Translatable.id).where(models.Translatable.id == translatable.id)
+                                   .with_for_update(read=True, key_share=True))
+
+                results = cleanup.cleanup(cleanup.Retention())
+                rows = {result.step: result.rows for result in results}
+
+                self.assertEqual(rows[cleanup.STEP_TRANSLATABLES], 0)
+
+            results = cleanup.cleanup(cleanup.Retention())
+            rows = {result.step: result.rows for result in results}
+
+            self.assertEqual(rows[cleanup.STEP_TRANSLATABLES], 1)
@@ -0,0 +1,51 @@
+import komidabot.messages as messages
+import komidabot.triggers as triggers
+from komidabot.debug.administration import get_exception_fingerprint
+from tests.base import BaseTestCase, HttpCapture
+
+
+def _raise(exception: Exception):
+    raise exception
+
+
+def _capture(exception: Exception) -> Exception:
+    try:
+        _raise(exception)
+    except Exception as e:
+        return e
+
+
+class TestAdminNotifier(BaseTestCase):
+    """
+    Test debug.administration.AdminNotifier
+    """
+
+    def test_fingerprint(self):
+        error1 = _capture(RuntimeError('Error 1'))
+        error2 = _capture(RuntimeError('Error 2'))
+        error3 = _capture(ValueError('Error 1'))
+
+        # Same type raised from the same place
+        self.assertEqual(get_exception_fingerprint(error1), get_exception_fingerprint(error2))
+        self.assertNotEqual(get_exception_fingerprint(error1), get_exception_fingerprint(error3))
+
+    def test_repeated_exceptions(self):
+        notifier = self.app.bot.admin_notifier
+
+        for i in range(3):
+            notifier.notify(messages.ExceptionMessage(triggers.Trigger(), _capture(RuntimeError('Error'))))
+        notifier.notify(messages.ExceptionMessage(triggers.Trigger(), _capture(ValueError('Error'))))
+
+        with HttpCapture():  # Ensure no requests are made, there are no admins with subscriptions
+            # Only the first occurrence of each exception is sent
+            self.assertTrue(notifier.process())
+            self.assertTrue(notifier.process())
+            self.assertFalse(notifier.process())
+
+        digest = notifier.get_digest()
+
+        self.assertIsInstance(digest, messages.TextMessage)
+        self.assertEqual(digest.text, 'RuntimeError: Error (repeated 2 times)')
+
+        # A new interval has started
+        self.assertIsNone(notifier.get_digest())
@@ -0,0 +1,68 @@
+import json
+from urllib.parse import parse_qs
+
+import httpretty
+
+import komidabot.messages as messages
+from komidabot.facebook.api_interface import ApiInterface
+from tests.base import BaseTestCase, HttpCapture
+
+
+def _text_message(recipient: str, text: str):
+    return {
+        'recipient': {'id': recipient},
+        'message': {'text': text},
+        'messaging_type': 'RESPONSE',
+    }
+
+
+class TestFacebookApiInterface(BaseTestCase):
+    """
+    Test facebook.api_interface
+    """
+
+    def test_post_send_api_batch(self):
+        with self.app.app_context():
+            api_interface = ApiInterface('token')
+
+            with HttpCapture() as http:
+                http.register_uri(HttpCapture.POST, 'https://graph.facebook.com/v4.0', json.dumps([
+                    {'code': 400, 'body': json.dumps({'error': {'code': 10, 'error_subcode': 2018108}})},
+                    {'code': 200, 'body': json.dumps({'recipient_id': '1002', 'message_id': 'm1'})},
+                    None,  # Not executed because the message it depends on failed
+                    {'code': 200, 'body': json.dumps({'recipient_id': '1002', 'message_id': 'm2'})},
+                ]))
+
+                results = api_interface.post_send_api_batch([
+                    _text_message('1001', 'First'),
+                    _text_message('1002', 'First'),
+                    _text_message('1001', 'Second'),
+                    _text_message('1002', 'Second'),
+                ])
+
+                batch = json.loads(parse_qs(httpretty.last_request().body.decode())['batch'][0])
+
+            self.assertEqual(results, [messages.MessageSendResult.UNREACHABLE, messages.MessageSendResult.SUCCESS,
+                                       messages.MessageSendResult.UNREACHABLE, messages.MessageSendResult.SUCCESS])
+
+            # Messages for the same recipient are chained, so they arrive in order
+            self.assertEqual(len(batch), 4)
+            self.assertNotIn('depends_on', batch[0])
+            self.assertNotIn('depends_on', batch[1])
+            self.assertEqual(batch[2]['depends_on'], batch[0]['name'])
+            self.assertEqual(batch[3]['depends_on'], batch[1]['name'])
+            self.assertEqual(json.loads(parse_qs(batch[2]['body'])['message'][0]), {'text': 'Second'})
+
+    def test_post_send_api_batch_failure(self):
+        with self.app.app_context():
+            api_interface = ApiInterface('token')
+
+            with HttpCapture() as http:
+                http.register_uri(HttpCapture.POST, 'https://graph.facebook.com/v4.0', '{}', status=503)
+
+                results = api_interface.post_send_api_batch([
+                    _text_message('1001', 'First'),
+                    _text_message('1002', 'First'),
+                ])
+
+            self.assertEqual(results, [messages.MessageSendResult.EXTERNAL_ERROR] * 2)
@@ -0,0 +1,102 @@
+import json
+from urllib.parse import parse_qs
+
+import komidabot.facebook.constants as fb_constants
+from app import db
+from komidabot.models import AppUser
+from komidabot.translation import LANGUAGE_DUTCH
+from komidabot.users import UserId
+from tests.base import BaseTestCase, HttpCapture
+
+
+class TestFacebookUsers(BaseTestCase):
+    """
+    Test facebook.users
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        with self.app.app_context():
+            self.user1 = self.app.user_manager.get_user(UserId('1001', fb_constants.PROVIDER_ID))
+            self.user2 = self.app.user_manager.get_user(UserId('1002', fb_constants.PROVIDER_ID))
+            self.user3 = self.app.user_manager.get_user(UserId('1003', fb_constants.PROVIDER_ID))
+
+            self.user1.add_to_db()
+            self.user2.add_to_db()
+            self.user3.add_to_db()
+            self.user3.get_db_user().set_language('en')
+
+            db.session.commit()
+
+    def test_get_locale(self):
+        with self.app.app_context():
+            with HttpCapture():  # Ensure no requests are made, looking up the locale never blocks
+                self.assertEqual(self.user1.get_locale(), LANGUAGE_DUTCH)
+                self.assertEqual(self.user3.get_locale(), 'en')
+
+                AppUser.set_provider_locales(fb_constants.PROVIDER_ID, {'1001': 'fr_FR'})
+                db.session.commit()
+
+                self.assertEqual(self.user1.get_locale(), 'fr_FR')
+
+    def test_refresh_stale_locales(self):
+        with self.app.app_context():
+            with HttpCapture() as http:
+                http.register_uri(HttpCapture.POST, 'https://graph.facebook.com/v4.0', json.dumps([
+                    {'code': 200, 'body': json.dumps({'id': '1001', 'locale': 'en_GB'})},
+                    {'code': 400, 'body': json.dumps({'error': {'message': 'Unknown user'}})},
+                ]))
+
+                # User 3 has chosen a language, so their locale isn't looked up
+                self.assertEqual(self.user1.get_manager().refresh_stale_locales(), 1)
+
+            self.assertEqual(self.user1.get_locale(), 'en_GB')
+            self.assertEqual(self.user1.get_db_user().provider_locale, 'en_GB')
+            self.assertIsNotNone(self.user1.get_db_user().provider_locale_refreshed_on)
+
+            # The failed lookup isn't retried until the locale is stale again
+            self.assertIsNone(self.user2.get_db_user().provider_locale)
+            self.assertIsNotNone(self.user2.get_db_user().provider_locale_refreshed_on)
+            self.assertEqual(AppUser.find_stale_provider_locales(fb_constants.PROVIDER_ID,
+                                                                 self.user1.get_db_user().provider_locale_refreshed_on,
+                                                                 10), [])
+
+    def test_refresh_stale_locales_failing(self):
+        def batch_response(request, _uri, headers):
+            batch = json.loads(parse_qs(request.body.decode('utf-8'))['batch'][0])
+            responses = []
+
+            for item in batch:
+                user_id = item['relative_url'].split('?')[0]
+
+                if user_id == '1004':
+                    responses.append({'code': 200, 'body': json.dumps({'id': user_id, 'locale': 'fr_FR'})})
+                else:
+                    responses.append({'code': 400, 'body': json.dumps({'error': {'message': 'Unknown user'}})})
+
+            return 200, headers, json.dumps(responses)
+
+        with self.app.app_context():
+            with HttpCapture() as http:
+                http.register_uri(HttpCapture.POST, 'https://graph.facebook.com/v4.0', batch_response)
+
+                # Users 1 and 2 can't be looked up, and fill the limit
+                self.assertEqual(self.user1.get_manager().refresh_stale_locales(limit=2), 0)
+
+                user4 = self.app.user_manager.get_user(UserId('1004', fb_constants.PROVIDER_ID))
+                user4.add_to_db()
+                db.session.commit()
+
+                # The users that failed before don't take up the limit again
+                self.assertEqual(self.user1.get_manager().refresh_stale_locales(limit=2), 1)
+
+            self.assertEqual(user4.get_db_user().provider_locale, 'fr_FR')
+
+    def test_sender_actions(self):
+        with self.app.app_context():
+            with HttpCapture():  # Ensure no requests are made, sender actions are dropped without an access token
+                self.user1.mark_message_seen()
+
+                typing_timer = self.user1.start_typing_timer(delay=0.0)
+                typing_timer.join()
@@ -0,0 +1,84 @@
+import komidabot.models as models
+import tests.utils as utils
+from app import db
+from komidabot.jobs import JOB_MENU_UPDATE, job_to_object
+from komidabot.models_jobs import Job, JobStatus
+from tests.base import BaseTestCase, HttpCapture
+
+
+class TestJobs(BaseTestCase):
+    """
+    Test jobs.JobRunner
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        with self.app.app_context():
+            models.Campus.create('Testcampus', 'ctst', [], 1)
+            models.Campus.create('Campus Omega', 'com', [], 2)
+            db.session.commit()
+
+    def test_menu_update(self):
+        with self.app.app_context():
+            with HttpCapture():  # Ensure no requests are made, there's no menu on weekends
+                job_id, future = self.app.job_runner.submit(JOB_MENU_UPDATE, {
+                    'campuses': ['ctst'],
+                    'dates': [utils.DAYS['SAT'].isoformat(), utils.DAYS['SUN'].isoformat()],
+                })
+                future.result(timeout=30)
+
+            job = Job.find_by_id(job_id)
+
+            self.assertEqual(job.status, JobStatus.DONE)
+            self.assertIsNotNone(job.started_on)
+            self.assertIsNotNone(job.finished_on)
+
+            # Only the requested campus is updated
+            progress = job.get_progress()
+            self.assertEqual(list(progress.keys()), ['ctst', 'pretranslation'])
+            self.assertEqual(progress['ctst']['done'], 2)
+            self.assertEqual(progress['ctst']['total'], 2)
+            self.assertIsNotNone(progress['ctst']['duration'])
+            self.assertEqual(progress['pretranslation'], {'translated': 0, 'failed': 0})
+
+            self.assertEqual(job_to_object(job)['status'], 'DONE')
+
+    def test_failed_job(self):
+        with self.app.app_context():
+            job_id, future = self.app.job_runner.submit(JOB_MENU_UPDATE, {'dates': ['not a date']})
+            future.result(timeout=30)
+
+            job = Job.find_by_id(job_id)
+
+            self.assertEqual(job.status, JobStatus.FAILED)
+            self.assertTrue(job.error.startswith('ValueError'))
+
+    def test_unknown_job(self):
+        with self.app.app_context():
+            with self.assertRaises(ValueError):
+                self.app.job_runner.submit('unknown', {})
+
+            self.assertEqual(Job.query.count(), 0)
+
+    def test_interrupted_jobs(self):
+        with self.app.app_context():
+            queued_job = Job.create(JOB_MENU_UPDATE, {})
+            running_job = Job.create(JOB_MENU_UPDATE, {})
+            done_job = Job.create(JOB_MENU_UPDATE, {})
+            db.session.flush()
+
+            running_job.set_running()
+            done_job.set_done()
+            db.session.commit()
+
+            job_ids = [queued_job.id, running_job.id, done_job.id]
+
+            self.app.job_runner.start()
+
+            jobs = [Job.find_by_id(job_id) for job_id in job_ids]
+
+            self.assertEqual([job.status for job in jobs], [JobStatus.FAILED, JobStatus.FAILED, JobStatus.DONE])
+            self.assertTrue(jobs[0].error.startswith('Interrupted'))
+            self.assertIsNotNone(jobs[1].finished_on)
+            self.assertIsNone(jobs[2].error)
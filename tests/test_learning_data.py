@@ -0,0 +1,78 @@
+import base64
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+import komidabot.external_menu as external_menu
+import komidabot.learning_data as learning_data
+import komidabot.models as models
+from extensions import db
+from komidabot.models_training import LearningDatapoint
+from tests.base import BaseTestCase
+
+
+class TestLearningData(BaseTestCase):
+    """
+    Test komidabot.learning_data
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        self.directory = tempfile.TemporaryDirectory()
+
+        os.makedirs(os.path.join(self.directory.name, learning_data.RAW_MENU_DIRECTORY))
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'external_menus', '2019-11-25_cst.raw.json'),
+                    os.path.join(self.directory.name, learning_data.RAW_MENU_DIRECTORY))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+        super().tearDown()
+
+    def write_file(self, name: str, data):
+        with open(os.path.join(self.directory.name, name), 'w') as f:
+            f.write(data if isinstance(data, str) else json.dumps(data))
+
+    def test_upload_learning_data(self):
+        with self.app.app_context():
+            models.Campus.create('Stadscampus', 'cst', ['stad', 'stadscampus'], 1)
+            db.session.commit()
+
+        screenshot = base64.b64encode(b'screenshot').decode('ascii')
+
+        self.write_file('2019-11-25_cst.json', {
+            'restaurant': 'cst',
+            'date': '2019-11-25',
+            'menu': [
+                {'course_name': 'PASTINAAKSOEP', 'screenshot': screenshot},
+                {'course_name': 'Not on the menu', 'screenshot': screenshot},
+            ]
+        })
+        self.write_file('invalid.json', '{')
+
+        with mock.patch.object(external_menu, 'fetch_raw') as fetch_raw_mock, \
+                mock.patch.object(external_menu, '_convert_price', return_value=Decimal('5.00')):
+            result = learning_data.upload_learning_data(self.app, self.directory.name, max_workers=2)
+
+            # The menu was fetched before
+            fetch_raw_mock.assert_not_called()
+
+        self.assertEqual(result, learning_data.LearningDataImportResult(imported=1, skipped=0, failed=1,
+                                                                        datapoints=1))
+
+        with self.app.app_context():
+            datapoints = LearningDatapoint.get_all()
+
+            self.assertEqual(len(datapoints), 1)
+            self.assertEqual(json.loads(datapoints[0].processed_data)['name']['nl'], 'Pastinaaksoep')
+            self.assertEqual(self.app.blob_storage.get(datapoints[0].screenshot_hash), b'screenshot')
+
+        # Files that were imported before are skipped
+        result = learning_data.upload_learning_data(self.app, self.directory.name, max_workers=2)
+
+        self.assertEqual(result, learning_data.LearningDataImportResult(imported=0, skipped=1, failed=1,
+                                                                        datapoints=0))
@@ -0,0 +1,118 @@
+import komidabot.external_menu as external_menu
+import komidabot.learning_evaluation as learning_evaluation
+import komidabot.models as models
+from app import db
+from komidabot.models_training import LearningDatapoint
+from komidabot.models_users import RegisteredUser
+from tests import utils
+from tests.base import BaseTestCase
+
+
+def processed_item(name: str, attributes, price: str, course_type: str):
+    return {
+        'name': {'nl': name},
+        'course_type': course_type,
+        'course_sub_type': 'NORMAL',
+        'course_attributes': attributes,
+        'course_allergens': [],
+        'price_students': price,
+        'price_staff': None,
+    }
+
+
+def submission(course_type: models.CourseType, correct: bool = True):
+    return {
+        'course_name_correct': correct,
+        'course_type': course_type.value if course_type is not None else -1,
+        'course_sub_type': models.CourseSubType.NORMAL.value,
+        'price_students_correct': True,
+        'price_staff_correct': correct,
+    }
+
+
+class TestLearningEvaluation(BaseTestCase):
+    """
+    Test komidabot.learning_evaluation
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        learning_evaluation.clear_cache()
+
+    def test_classify_course(self):
+        self.assertEqual(external_menu.classify_course(['SOUP', 'VEGAN'], 'Tomatensoep', '1.50'),
+                         (models.CourseType.SOUP, models.CourseSubType.VEGAN, external_menu.RULE_SOUP))
+        self.assertEqual(external_menu.classify_course([], 'Spaghetti bolognese', '4.40'),
+                         (models.CourseType.PASTA, models.CourseSubType.NORMAL, external_menu.RULE_PASTA_NAME))
+        self.assertEqual(external_menu.classify_course(['SNACK', 'VEGGIE'], 'Broodje kaas', '3.00'),
+                         (models.CourseType.SUB, models.CourseSubType.VEGETARIAN, external_menu.RULE_SUB))
+        self.assertEqual(external_menu.classify_course([], 'Chocomousse', '1.20'),
+                         (models.CourseType.DESSERT, models.CourseSubType.NORMAL, external_menu.RULE_DESSERT))
+        self.assertEqual(external_menu.classify_course([], 'Stoofvlees', '4.40'),
+                         (models.CourseType.DAILY, models.CourseSubType.NORMAL, external_menu.RULE_DAILY))
+
+    def test_evaluate_classifier(self):
+        with self.app.app_context():
+            campus = models.Campus.create('Testcampus', 'ctst', [], 0)
+            user1 = RegisteredUser.create('test', '1', 'Test User', 'user1@example.com', 'https://example.com/1.png')
+            user2 = RegisteredUser.create('test', '2', 'Test User', 'user2@example.com', 'https://example.com/2.png')
+            db.session.flush()
+
+            soup = LearningDatapoint.create(campus, utils.DAYS['MON'], b'1',
+                                            processed_item('Tomatensoep', ['SOUP'], '1.50', 'SOUP'))
+            # Stored as a daily course, before pasta was recognised by name
+            pasta = LearningDatapoint.create(campus, utils.DAYS['MON'], b'2',
+                                             processed_item('Spaghetti', [], '4.40', 'DAILY'))
+            dessert = LearningDatapoint.create(campus, utils.DAYS['MON'], b'3',
+                                               processed_item('Appeltaart', [], '2.00', 'DESSERT'))
+            db.session.flush()
+
+            soup.user_submit(user1, submission(models.CourseType.SOUP))
+            soup.user_submit(user2, submission(models.CourseType.SOUP))
+            pasta.user_submit(user1, submission(models.CourseType.PASTA, correct=False))
+            dessert.user_submit(user1, submission(models.CourseType.SNACK))
+            dessert.user_submit(user2, submission(None))
+            db.session.commit()
+
+            result = learning_evaluation.get_evaluation()
+
+            self.assertEqual(result['submissions'], 5)
+            self.assertEqual(result['datapoints'], 3)
+
+            self.assertEqual(result['course_type']['accuracy'], 0.75)
+            self.assertEqual(result['course_type']['without_type'], 1)
+            self.assertEqual(result['course_type']['changed'], 1)
+
+            matrix = result['course_type']['confusion_matrix']
+            self.assertEqual(matrix[models.CourseType.SOUP.value - 1][models.CourseType.SOUP.value - 1], 2)
+            self.assertEqual(matrix[models.CourseType.PASTA.value - 1][models.CourseType.PASTA.value - 1], 1)
+            self.assertEqual(matrix[models.CourseType.SNACK.value - 1][models.CourseType.DESSERT.value - 1], 1)
+            self.assertEqual(sum(map(sum, matrix)), 4)
+
+            self.assertEqual(result['course_sub_type']['accuracy'], 1.0)
+
+            self.assertEqual(result['rules'][external_menu.RULE_SOUP], {'total': 2, 'accuracy': 1.0})
+            self.assertEqual(result['rules'][external_menu.RULE_PASTA_NAME], {'total': 1, 'accuracy': 1.0})
+            self.assertEqual(result['rules'][external_menu.RULE_DESSERT], {'total': 1, 'accuracy': 0.0})
+            self.assertEqual(result['rules'][external_menu.RULE_GRILL], {'total': 0, 'accuracy': None})
+
+            self.assertEqual(result['name_correct'], 0.8)
+            self.assertEqual(result['price_students_correct'], 1.0)
+            self.assertEqual(result['price_staff_correct'], 0.8)
+
+            # The evaluation is reused until new submissions come in
+            self.assertIs(learning_evaluation.get_evaluation(), result)
+
+            pasta.user_submit(user2, submission(models.CourseType.PASTA))
+            db.session.commit()
+
+            self.assertEqual(learning_evaluation.get_evaluation()['submissions'], 6)
+
+    def test_evaluate_classifier_empty(self):
+        with self.app.app_context():
+            result = learning_evaluation.get_evaluation()
+
+            self.assertEqual(result['submissions'], 0)
+            self.assertIsNone(result['course_type']['accuracy'])
+            self.assertEqual(result['rules'][external_menu.RULE_DAILY], {'total': 0, 'accuracy': None})
@@ -0,0 +1,168 @@
+import datetime
+import os
+import re
+from decimal import Decimal
+from typing import Tuple
+from unittest import mock
+
+import komidabot.external_menu as external_menu
+import komidabot.menu_backfill as menu_backfill
+import komidabot.menu_ingestion as menu_ingestion
+import komidabot.models as models
+from extensions import db
+from komidabot.models_jobs import BackfillShard
+from tests.base import BaseTestCase, HttpCapture
+
+MONDAY = datetime.date(2019, 11, 25)
+SATURDAY = datetime.date(2019, 11, 30)
+
+
+class TestMenuIngestion(BaseTestCase):
+    """
+    Test komidabot.menu_ingestion
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        with self.app.app_context():
+            models.Campus.create('Stadscampus', 'cst', ['stad', 'stadscampus'], 1)
+            db.session.commit()
+
+        with open(os.path.join(os.path.dirname(__file__), 'external_menus', '2019-11-25_cst.raw.json')) as f:
+            self.raw_menu = f.read()
+
+    def update_menus(self, **kwargs) -> menu_ingestion.MenuUpdateStats:
+        stats = menu_ingestion.MenuUpdateStats()
+
+        with HttpCapture() as http:
+            http.register_uri(HttpCapture.GET, re.compile(r'.*/api/GetMenuByDate/1/2019-11-25$'), self.raw_menu)
+
+            with mock.patch.object(external_menu, '_convert_price', return_value=Decimal('5.00')):
+                menu_ingestion.update_menus(models.Campus.get_all_active(), [MONDAY, SATURDAY], stats=stats,
+                                            **kwargs)
+
+        return stats
+
+    def test_update_menus(self):
+        with self.app.app_context():
+            stats = self.update_menus(dry_run=True)
+
+            # The menu and the prices for staff of the 8 items with multiple prices
+            self.assertEqual((stats.requests, stats.changed, stats.unchanged, stats.skipped), (9, 1, 0, 1))
+            self.assertIsNone(models.Menu.get_menu(models.Campus.get_by_short_name('cst'), MONDAY))
+
+            stats = self.update_menus(max_workers=2)
+
+            self.assertEqual((stats.requests, stats.changed, stats.unchanged, stats.skipped), (9, 1, 0, 1))
+            self.assertEqual(len(models.Menu.get_menu(models.Campus.get_by_short_name('cst'), MONDAY).menu_items), 9)
+
+            # Nothing changes when the same menu is fetched again
+            stats = self.update_menus(max_workers=2)
+
+            self.assertEqual((stats.requests, stats.changed, stats.unchanged, stats.skipped), (9, 0, 1, 1))
+
+            for stage in menu_ingestion.STAGES:
+                self.assertEqual(len(stats.get_percentiles(stage, [50, 90])), 2)
+
+    def test_update_menus_translation_cache(self):
+        with self.app.app_context():
+            self.update_menus()
+
+            menu_item = models.Menu.get_menu(models.Campus.get_by_short_name('cst'), MONDAY).menu_items[0]
+            translation = models.Translation.find_by_id(menu_item.translatable_id, 'en')
+            expected = translation.translation
+
+            translation.translation = 'Outdated'
+            db.session.commit()
+
+            models.translation_cache.put(menu_item.translatable_id, 'en', 'Outdated', 'komida')
+
+            with mock.patch.object(db.session, 'commit', wraps=db.session.commit) as commit_mock:
+                original_invalidate = models.translation_cache.invalidate
+
+                def invalidate(translatable_id, language):
+                    # The updated translation is removed from the cache only once it has been committed
+                    commit_mock.assert_called()
+                    original_invalidate(translatable_id, language)
+
+                with mock.patch.object(models.translation_cache, 'invalidate', side_effect=invalidate):
+                    self.update_menus()
+
+            self.assertEqual(menu_item.translatable.get_translation('en').translation, expected)
+
+    def test_get_shards(self):
+        with self.app.app_context():
+            campuses = models.Campus.get_all_active()
+
+            # From a Wednesday to the Tuesday two weeks later
+            shards = menu_backfill.get_shards(campuses, datetime.date(2019, 11, 27), datetime.date(2019, 12, 10))
+
+            self.assertEqual([shard.week_start for shard in shards],
+                             [datetime.date(2019, 11, 25), datetime.date(2019, 12, 2), datetime.date(2019, 12, 9)])
+            self.assertEqual([len(shard.dates) for shard in shards], [3, 5, 2])
+
+    def test_backfill_menus(self):
+        def get_menu(_request, uri, headers):
+            if uri.endswith('/2019-11-25'):
+                return 200, headers, self.raw_menu
+
+            return 204, headers, ''
+
+        def backfill() -> 'Tuple[menu_backfill.BackfillResult, menu_ingestion.MenuUpdateStats]':
+            stats = menu_ingestion.MenuUpdateStats()
+
+            with HttpCapture() as http:
+                http.register_uri(HttpCapture.GET, re.compile(r'.*/api/GetMenuByDate/1/.*'), get_menu)
+
+                with mock.patch.object(external_menu, '_convert_price', return_value=Decimal('5.00')):
+                    result = menu_backfill.backfill_menus(models.Campus.get_all_active(), MONDAY,
+                                                          datetime.date(2019, 12, 3), max_workers=2, batch_size=1,
+                                                          stats=stats)
+
+            return result, stats
+
+        with self.app.app_context():
+            result, stats = backfill()
+
+            self.assertEqual(result, menu_backfill.BackfillResult(shards=2, completed=2, skipped=0, failed=0))
+            self.assertEqual((stats.requests, stats.changed, stats.skipped), (15, 1, 6))
+            self.assertEqual(len(models.Menu.get_menu(models.Campus.get_by_short_name('cst'), MONDAY).menu_items), 9)
+
+            # The second week is only partially backfilled, so it isn't marked as completed
+            self.assertEqual(BackfillShard.find_completed(MONDAY, datetime.date(2019, 12, 2)), {(1, MONDAY)})
+
+            # Completed weeks are skipped when running again
+            result, stats = backfill()
+
+            self.assertEqual(result, menu_backfill.BackfillResult(shards=2, completed=1, skipped=1, failed=0))
+            self.assertEqual(stats.requests, 2)
+
+    def test_backfill_menus_failures(self):
+        def get_menu(_request, uri, headers):
+            if uri.endswith('/2019-11-26'):
+                return 503, headers, ''
+            if uri.endswith('/2019-12-03'):
+                return 404, headers, ''
+
+            return 204, headers, ''
+
+        with self.app.app_context():
+            with HttpCapture() as http:
+                http.register_uri(HttpCapture.GET, re.compile(r'.*/api/GetMenuByDate/1/.*'), get_menu)
+
+                result = menu_backfill.backfill_menus(models.Campus.get_all_active(), MONDAY,
+                                                      datetime.date(2019, 12, 13), max_workers=2, batch_size=1)
+
+            # Failures don't stop the backfill, but the weeks they're in are backfilled again by the next run
+            self.assertEqual(result, menu_backfill.BackfillResult(shards=3, completed=1, skipped=0, failed=2))
+            self.assertEqual(BackfillShard.find_completed(MONDAY, datetime.date(2019, 12, 9)),
+                             {(1, datetime.date(2019, 12, 9))})
+
+            # Failures outside of fetching a day fail the whole week
+            with HttpCapture(), mock.patch.object(models.ClosingDays, 'find_is_closed',
+                                                  side_effect=RuntimeError('Database unavailable')):
+                result = menu_backfill.backfill_menus(models.Campus.get_all_active(), MONDAY,
+                                                      datetime.date(2019, 12, 6), max_workers=2, batch_size=1)
+
+            self.assertEqual(result, menu_backfill.BackfillResult(shards=2, completed=0, skipped=0, failed=2))
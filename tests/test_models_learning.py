@@ -0,0 +1,88 @@
+import base64
+import io
+
+from PIL import Image
+
+import komidabot.models as models
+from app import db
+from komidabot.models_training import LearningDatapoint
+from komidabot.models_users import RegisteredUser
+from komidabot.screenshots import decode_screenshot
+from tests import utils
+from tests.base import BaseTestCase
+
+
+class TestModelsLearning(BaseTestCase):
+    """
+    Test models_training.LearningDatapoint
+    """
+
+    def test_get_random(self):
+        with self.app.app_context():
+            campus = models.Campus.create('Testcampus', 'ctst', [], 0)
+            user = RegisteredUser.create('test', '123', 'Test User', 'user@example.com', 'https://example.com/img.png')
+
+            self.assertIsNone(LearningDatapoint.get_random(user))
+
+            datapoints = [LearningDatapoint.create(campus, utils.DAYS['MON'], b'screenshot', {'index': i})
+                          for i in range(5)]
+            db.session.flush()
+
+            for datapoint in datapoints[:2] + datapoints[3:]:
+                datapoint.user_submit(user, {})
+
+            db.session.commit()
+
+            # Whichever id the search starts at, it ends up at the only datapoint that wasn't submitted yet
+            for _ in range(20):
+                self.assertEqual(LearningDatapoint.get_random(user), datapoints[2])
+
+            datapoints[2].user_submit(user, {})
+            db.session.commit()
+
+            self.assertIsNone(LearningDatapoint.get_random(user))
+
+    def test_move_screenshot(self):
+        with self.app.app_context():
+            campus = models.Campus.create('Testcampus', 'ctst', [], 0)
+            db.session.flush()
+
+            datapoint = LearningDatapoint.create(campus, utils.DAYS['MON'], b'screenshot', {})
+            db.session.commit()
+
+            self.assertEqual(self.app.blob_storage.get(datapoint.screenshot_hash), b'screenshot')
+            self.assertIsNone(datapoint.screenshot)
+
+            # Datapoints created before screenshots were put in blob storage
+            datapoint.screenshot_hash = None
+            datapoint.screenshot = base64.b64encode(b'old screenshot').decode('ascii')
+            db.session.commit()
+
+            self.assertEqual(LearningDatapoint.find_with_inline_screenshot(10), [datapoint])
+
+            datapoint.move_screenshot()
+            db.session.commit()
+
+            self.assertEqual(LearningDatapoint.find_with_inline_screenshot(10), [])
+            self.assertEqual(self.app.blob_storage.get(datapoint.screenshot_hash), b'old screenshot')
+            self.assertIsNone(datapoint.screenshot)
+
+    def test_restore_screenshot(self):
+        with self.app.app_context():
+            campus = models.Campus.create('Testcampus', 'ctst', [], 0)
+            db.session.flush()
+
+            image = io.BytesIO()
+            Image.new('RGB', (4, 4)).save(image, format='PNG')
+
+            datapoint = LearningDatapoint.create(campus, utils.DAYS['MON'], image.getvalue(), {})
+            db.session.commit()
+
+            self.assertEqual(LearningDatapoint.find_without_inline_screenshot(10), [datapoint])
+
+            datapoint.restore_screenshot()
+            db.session.commit()
+
+            self.assertEqual(LearningDatapoint.find_without_inline_screenshot(10), [])
+            self.assertTrue(datapoint.screenshot.startswith('data:image/png;base64,'))
+            self.assertEqual(decode_screenshot(datapoint.screenshot), image.getvalue())
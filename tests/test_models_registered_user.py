@@ -222,6 +222,38 @@ class TestModelsRegisteredUsers(BaseTestCase):
             self.assertIn(user2.id, ids2)
             self.assertNotIn(user3.id, ids2)
 
+    def test_get_subscribed_admins(self):
+        with self.app.app_context():
+            admin = Role.create('admin')
+            learner = Role.create('learner')
+
+            user1 = RegisteredUser.create('test', '123', 'Test User 1',
+                                          'user1@example.com', 'https://example.com/img1.png')
+            user2 = RegisteredUser.create('test', '456', 'Test User 2',
+                                          'user2@example.com', 'https://example.com/img2.png')
+            user3 = RegisteredUser.create('test', '789', 'Test User 3',
+                                          'user3@example.com', 'https://example.com/img3.png')
+
+            user1.add_role(admin)
+            user2.add_role(admin)
+            user3.add_role(learner)
+
+            # Flush makes sure default values are actually assigned
+            db.session.flush()
+
+            user1.add_subscription('https://example.com/push/1', {'auth': 'a', 'p256dh': 'b'})
+            user3.add_subscription('https://example.com/push/3', {'auth': 'a', 'p256dh': 'b'})
+
+            db.session.commit()
+
+            # Only admins that have a subscription
+            self.assertEqual([user.id for user in RegisteredUser.get_subscribed_admins()], [user1.id])
+
+            user1.remove_subscription('https://example.com/push/1')
+            db.session.commit()
+
+            self.assertEqual(RegisteredUser.get_subscribed_admins(), [])
+
     def test_roles(self):
         # Test getting all active RegisteredUser objects
 
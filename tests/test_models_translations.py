@@ -2,9 +2,20 @@ from sqlalchemy import inspect
 
 import komidabot.models as models
 from app import db
+from komidabot.translation import LocalTranslationService
 from tests.base import BaseTestCase
 
 
+class CountingTranslator(LocalTranslationService):
+    def __init__(self):
+        self.calls = []
+
+    def translate_many(self, texts, from_language, to_language):
+        self.calls.append((texts, from_language, to_language))
+
+        return super().translate_many(texts, from_language, to_language)
+
+
 # TODO: Add provider tests
 class TestModelsTranslations(BaseTestCase):
     """
@@ -165,6 +176,88 @@ class TestModelsTranslations(BaseTestCase):
                                                                                     translatable.original_language,
                                                                                     translation.language))
 
+    def test_get_translations(self):
+        # Test usage of Translatable.get_translations
+
+        with self.app.app_context():
+            translatable1, _ = models.Translatable.get_or_create('Translation 1: en', 'en')
+            translatable2, _ = models.Translatable.get_or_create('Translation 2: en', 'en')
+            translatable3, _ = models.Translatable.get_or_create('Translation 3: nl', 'nl')
+            translation1 = translatable1.add_translation('nl', 'Translation 1: nl', 'manual')
+
+            db.session.commit()
+
+            translator = CountingTranslator()
+
+            translations = models.Translatable.get_translations([translatable1.id, translatable2.id,
+                                                                 translatable3.id], 'nl', translator)
+            db.session.commit()
+
+            # Only the missing translation was sent to the translator, in a single batch
+            self.assertEqual(translator.calls, [(['Translation 2: en'], 'en', 'nl')])
+
+            self.assertEqual(translations[translatable1.id], translation1)
+            self.assertEqual(translations[translatable2.id].translation, '[nl] Translation 2: en')
+            self.assertEqual(translations[translatable3.id].translation, 'Translation 3: nl')
+
+            self.assertEqual(translatable2.get_translation('nl', None).translation, '[nl] Translation 2: en')
+
+            with self.assertRaises(ValueError):
+                models.Translatable.get_translations([translatable1.id], 'fr', None)
+
+    def test_translation_cache(self):
+        # Test the caching of translations
+
+        with self.app.app_context():
+            translatable1, _ = models.Translatable.get_or_create('Translation 1: en', 'en')
+            translatable2, _ = models.Translatable.get_or_create('Translation 2: en', 'en')
+            translatable1.add_translation('nl', 'Translation 1: nl', 'manual')
+            translatable2.add_translation('nl', 'Translation 2: nl', 'manual')
+            db.session.commit()
+
+            cache = models.translation_cache
+
+            self.assertEqual(translatable1.get_translation('nl', None).translation, 'Translation 1: nl')
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+            self.assertEqual(translatable1.get_translation('nl', None).translation, 'Translation 1: nl')
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            # Warming loads all translations in one go
+            models.Translatable.warm_cache([translatable1.id, translatable2.id])
+            self.assertTrue(cache.is_warm(translatable2.id))
+            self.assertEqual(translatable2.get_translation('nl', None).translation, 'Translation 2: nl')
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+            # Adding a translation invalidates what was cached
+            cache.put(translatable1.id, 'fr', 'Stale', None)
+            translatable1.add_translation('fr', 'Translation 1: fr', 'manual')
+            self.assertFalse(cache.is_warm(translatable1.id))
+            self.assertEqual(translatable1.get_translation('fr', None).translation, 'Translation 1: fr')
+
+            self.assertEqual(cache.get_stats()['size'], 3)
+
+    def test_get_or_create_normalized(self):
+        # Test that Translatable.get_or_create ignores differences in case, punctuation and whitespace
+
+        with self.app.app_context():
+            translatable1, _ = models.Translatable.get_or_create('Spaghetti bolognese', 'nl')
+            translatable2, _ = models.Translatable.get_or_create(' spaghetti  Bolognese.', 'nl')
+            translatable3, _ = models.Translatable.get_or_create('Spaghetti bolognese', 'en')
+            translatable4, _ = models.Translatable.get_or_create('Spaghetti carbonara', 'nl')
+
+            self.assertEqual(translatable1, translatable2)
+            self.assertEqual(translatable1.original_text, 'Spaghetti bolognese')
+            self.assertEqual(translatable1.normalized_text, 'spaghetti bolognese')
+            self.assertNotEqual(translatable1, translatable3)
+            self.assertNotEqual(translatable1, translatable4)
+
+            # Normalizing can make a text longer than the original text is allowed to be
+            translatable5, _ = models.Translatable.get_or_create('ß' * 256, 'nl')
+            db.session.commit()
+
+            self.assertEqual(translatable5.normalized_text, 'ss' * 256)
+
     def test_get_by_id(self):
         # Test usage of Translatable.get_by_id
 
@@ -0,0 +1,77 @@
+from unittest import mock
+
+import komidabot.models as models
+import komidabot.pretranslation as pretranslation
+from app import db
+from tests.base import BaseTestCase
+from tests.utils import StubTranslator
+
+
+class FlakyTranslator(StubTranslator):
+    def __init__(self):
+        self.calls = 0
+
+    def translate(self, text, from_language, to_language):
+        self.calls += 1
+
+        if self.calls == 1:
+            raise Exception('Service unavailable')
+
+        return super().translate(text, from_language, to_language)
+
+
+class TestPretranslation(BaseTestCase):
+    """
+    Test komidabot.pretranslation
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        with self.app.app_context():
+            models.AppUser.create('test', 'user1', 'en')
+            models.AppUser.create('test', 'user2', '').provider_locale = 'fr_FR'
+            models.AppUser.create('test', 'user3', '')
+            models.AppUser.create('test', 'user4', 'de').enabled = False
+
+            db.session.commit()
+
+    def test_find_active_locales(self):
+        with self.app.app_context():
+            self.assertEqual(models.AppUser.find_active_locales('nl'), ['en', 'fr_FR', 'nl'])
+
+    def test_pretranslate(self):
+        with self.app.app_context():
+            translatable1, _ = models.Translatable.get_or_create('Friet', 'nl')
+            translatable2, _ = models.Translatable.get_or_create('Soep', 'nl')
+            translatable2.add_translation('en', 'Soup', 'komida')
+            db.session.commit()
+
+            result = pretranslation.pretranslate([translatable1.id, translatable2.id], self.translator)
+
+            # Dutch is the original language and the English soup was already translated
+            self.assertEqual(result, pretranslation.PretranslationResult(3, 0))
+
+            self.assertTrue(translatable1.has_translation('en'))
+            self.assertTrue(translatable1.has_translation('fr_FR'))
+            self.assertTrue(translatable2.has_translation('fr_FR'))
+            self.assertFalse(translatable1.has_translation('de'))
+            self.assertEqual(translatable2.get_translation('en').translation, 'Soup')
+
+            # Everything is translated already
+            result = pretranslation.pretranslate([translatable1.id, translatable2.id], self.translator)
+            self.assertEqual(result, pretranslation.PretranslationResult(0, 0))
+
+    def test_pretranslate_retries(self):
+        with self.app.app_context():
+            translatable, _ = models.Translatable.get_or_create('Friet', 'nl')
+            db.session.commit()
+
+            translator = FlakyTranslator()
+
+            with mock.patch.object(pretranslation, 'RETRY_DELAY', 0):
+                result = pretranslation.pretranslate([translatable.id], translator, locales=['en'])
+
+            self.assertEqual(result, pretranslation.PretranslationResult(1, 0))
+            self.assertEqual(translator.calls, 2)
+            self.assertTrue(translatable.has_translation('en'))
@@ -2,6 +2,7 @@ import datetime
 from decimal import Decimal
 from typing import Dict, List, Tuple
 
+import komidabot.messages as messages
 import komidabot.models as models
 import komidabot.triggers as triggers
 import komidabot.users as users
@@ -9,7 +10,9 @@ import komidabot.util as util
 import tests.users_stub as users_stub
 import tests.utils as utils
 from app import db
-from komidabot.models import AppUser, Day, CourseType, CourseSubType, UserDayCampusPreference, course_icons_matrix
+from komidabot.models import AppUser, Day, CourseType, CourseSubType, DeliveryLedger, OutboxMessage, \
+    UserDayCampusPreference, course_icons_matrix
+from komidabot.subscriptions.daily_menu import CHANNEL_ID as DAILY_MENU_ID, get_dispatch_slot
 from tests.base import BaseTestCase, HttpCapture, menu_item
 
 
@@ -145,6 +148,199 @@ class TestGenericSubscriptions(BaseSubscriptionsTestCase):
 
                 # print(self.message_handler.message_log, flush=True)
 
+    def test_resume_dispatch(self):
+        self.setup_subscriptions()
+        self.setup_menu()
+
+        with self.app.app_context():
+            self.activate_feature('menu_subscription', available=True, has_context=True)
+
+            with HttpCapture():  # Ensure no requests are made
+                self.app.bot.trigger_received(triggers.SubscriptionTrigger(date=utils.DAYS['TUE']))
+
+                db_user2 = AppUser.find_by_id(self.user2.id.provider, self.user2.id.id)
+
+                report = DeliveryLedger.get_report(utils.DAYS['TUE'], DAILY_MENU_ID)
+                self.assertEqual(report.total, 2)
+                self.assertEqual(report.pending, 0)
+                self.assertEqual(report.results, {'SUCCESS': 2})
+
+                # Simulate a dispatch that got interrupted before the second user received their message
+                entry = DeliveryLedger.query.filter_by(dispatch_date=utils.DAYS['TUE'], channel=DAILY_MENU_ID,
+                                                       user_id=db_user2.id).first()
+                entry.result = None
+                db.session.commit()
+
+                self.assertTrue(DeliveryLedger.has_pending(utils.DAYS['TUE'], DAILY_MENU_ID))
+                self.assertEqual(DeliveryLedger.get_pending_user_ids(utils.DAYS['TUE'], DAILY_MENU_ID), {db_user2.id})
+
+                self.message_handler.reset()
+
+                self.app.bot.trigger_received(triggers.SubscriptionTrigger(date=utils.DAYS['TUE']))
+
+                db.session.add_all(self.campuses)
+
+                self.assertNotIn(self.user1.id, self.message_handler.message_log)
+                self.assertEqual(self.message_handler.message_log[self.user2.id], [
+                    self.expected_menus[(self.campuses[1].short_name, utils.DAYS['TUE'])],
+                ])
+
+                self.assertFalse(DeliveryLedger.has_pending(utils.DAYS['TUE'], DAILY_MENU_ID))
+                self.assertEqual(DeliveryLedger.get_pending_user_ids(utils.DAYS['TUE'], DAILY_MENU_ID), set())
+
+    def test_dispatch_slots(self):
+        self.setup_subscriptions()
+        self.setup_menu()
+
+        with self.app.app_context():
+            self.activate_feature('menu_subscription', available=True, has_context=True)
+
+            # With 2 slots, both users end up in the same slot
+            slots = 3
+            db_users = [AppUser.find_by_id(user.id.provider, user.id.id) for user in [self.user1, self.user2]]
+
+            # Otherwise nothing is filtered out by the slots
+            self.assertEqual(len({get_dispatch_slot(db_user.id, slots) for db_user in db_users}), 2)
+
+            with HttpCapture():  # Ensure no requests are made
+                for slot in range(slots):
+                    self.message_handler.reset()
+
+                    self.app.bot.trigger_received(triggers.SubscriptionTrigger(date=utils.DAYS['TUE'], slot=slot,
+                                                                                slots=slots))
+
+                    # Only the users assigned to this slot receive the menu
+                    for db_user, user in zip(db_users, [self.user1, self.user2]):
+                        if get_dispatch_slot(db_user.id, slots) == slot:
+                            self.assertIn(user.id, self.message_handler.message_log)
+                        else:
+                            self.assertNotIn(user.id, self.message_handler.message_log)
+
+                report = DeliveryLedger.get_report(utils.DAYS['TUE'], DAILY_MENU_ID)
+                self.assertEqual(report.total, 2)
+                self.assertEqual(report.pending, 0)
+                self.assertEqual(report.results, {'SUCCESS': 2})
+
+    def test_outbox_dispatch(self):
+        self.setup_subscriptions()
+        self.setup_menu()
+
+        with self.app.app_context():
+            self.activate_feature('menu_subscription', available=True, has_context=True)
+
+            self.app.outbox.synchronous = False  # Queue messages without starting any workers
+            self.message_handler.forced_results[self.user2.id] = messages.MessageSendResult.EXTERNAL_ERROR
+
+            limited = []
+            self.app.outbox.limiter = lambda: limited.append(len(self.message_handler.message_log))
+
+            with HttpCapture():  # Ensure no requests are made
+                self.app.bot.trigger_received(triggers.SubscriptionTrigger(date=utils.DAYS['TUE']))
+
+                # Nothing is sent until the outbox is processed
+                self.assertEqual(self.message_handler.message_log, {})
+                self.assertEqual(OutboxMessage.count_pending(), 2)
+
+                report = DeliveryLedger.get_report(utils.DAYS['TUE'], DAILY_MENU_ID)
+                self.assertEqual(report.queued, 2)
+                self.assertEqual(report.failed, 0)
+                self.assertFalse(DeliveryLedger.has_pending(utils.DAYS['TUE'], DAILY_MENU_ID))
+
+                self.assertEqual(limited, [])
+                self.assertEqual(self.app.outbox.process_batch(), 2)
+
+                # The rate is limited when the messages are delivered, rather than when they're queued
+                self.assertEqual(limited, [0, 0])
+
+                db.session.add_all(self.campuses)
+
+                self.assertEqual(self.message_handler.message_log[self.user1.id], [
+                    self.expected_menus[(self.campuses[1].short_name, utils.DAYS['TUE'])],
+                ])
+                self.assertNotIn(self.user2.id, self.message_handler.message_log)
+
+                # The external error is retried later, so the message for user 2 stays queued
+                report = DeliveryLedger.get_report(utils.DAYS['TUE'], DAILY_MENU_ID)
+                self.assertEqual(report.results, {'SUCCESS': 1, DeliveryLedger.QUEUED: 1})
+
+                retried = OutboxMessage.query.filter(OutboxMessage.result.is_(None)).one()
+                self.assertEqual(retried.attempts, 1)
+
+                # Not due yet
+                self.assertEqual(self.app.outbox.process_batch(), 0)
+
+    def test_outbox_delivery_raises(self):
+        with self.app.app_context():
+            self.app.outbox.synchronous = False
+            self.message_handler.forced_results[self.user2.id] = ConnectionError('Push service unreachable')
+
+            user_ids = [AppUser.find_by_id(user.id.provider, user.id.id).id for user in [self.user1, self.user2]]
+
+            for user_id in user_ids:
+                OutboxMessage.create(user_id, 'Hello')
+            db.session.commit()
+
+            self.assertEqual(self.app.outbox.process_batch(), 2)
+
+            # The message that was delivered isn't sent again, the one that raised is retried later
+            self.assertEqual(self.message_handler.message_log, {self.user1.id: ['Hello']})
+
+            retried = OutboxMessage.query.filter(OutboxMessage.result.is_(None)).one()
+            self.assertEqual((retried.user_id, retried.attempts), (user_ids[1], 1))
+
+            self.assertEqual(self.app.outbox.process_batch(), 0)
+            self.assertEqual(self.message_handler.message_log, {self.user1.id: ['Hello']})
+
+    def test_outbox_order(self):
+        with self.app.app_context():
+            self.app.outbox.synchronous = False
+            self.message_handler.forced_results[self.user1.id] = messages.MessageSendResult.EXTERNAL_ERROR
+
+            user_id = AppUser.find_by_id(self.user1.id.provider, self.user1.id.id).id
+
+            OutboxMessage.create(user_id, 'First')
+            db.session.commit()
+
+            self.assertEqual(self.app.outbox.process_batch(), 1)
+
+            # Queued while the first message waits for a retry, it isn't delivered before the first
+            OutboxMessage.create(user_id, 'Second')
+            db.session.commit()
+
+            self.assertEqual(self.app.outbox.process_batch(), 0)
+
+            del self.message_handler.forced_results[self.user1.id]
+            OutboxMessage.query.update({OutboxMessage.next_attempt: datetime.datetime(2000, 1, 1)})
+            db.session.commit()
+
+            self.assertEqual(self.app.outbox.process_batch(), 1)
+            self.assertEqual(self.app.outbox.process_batch(), 1)
+            self.assertEqual(self.message_handler.message_log[self.user1.id], ['First', 'Second'])
+
+    def test_unreachable_and_gone_users(self):
+        self.setup_subscriptions()
+        self.setup_menu()
+
+        with self.app.app_context():
+            self.activate_feature('menu_subscription', available=True, has_context=True)
+
+            self.message_handler.forced_results[self.user1.id] = messages.MessageSendResult.GONE
+            self.message_handler.forced_results[self.user2.id] = messages.MessageSendResult.UNREACHABLE
+
+            with HttpCapture():  # Ensure no requests are made
+                self.app.bot.trigger_received(triggers.SubscriptionTrigger(date=utils.DAYS['TUE']))
+
+            self.assertIsNone(AppUser.find_by_id(self.user1.id.provider, self.user1.id.id))
+            self.assertFalse(AppUser.find_by_id(self.user2.id.provider, self.user2.id.id).enabled)
+            self.assertTrue(AppUser.find_by_id(self.user3.id.provider, self.user3.id.id).enabled)
+
+            # Preferences of removed users are removed by the database
+            self.assertEqual(UserDayCampusPreference.query.count(), 10)
+
+            report = DeliveryLedger.get_report(utils.DAYS['TUE'], DAILY_MENU_ID)
+            self.assertEqual(report.results, {'GONE': 1, 'UNREACHABLE': 1})
+            self.assertEqual(report.failed, 2)
+
 
 # class TestFacebookSubscriptions(BaseSubscriptionsTestCase):
 #     def test_http_capture(self):
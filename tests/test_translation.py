@@ -0,0 +1,44 @@
+from unittest import TestCase, mock
+
+from komidabot.translation import GoogleTranslationService, LocalTranslationService
+
+
+class TestTranslation(TestCase):
+    """
+    Test komidabot.translation
+    """
+
+    def test_local_translate_many(self):
+        translator = LocalTranslationService()
+
+        self.assertEqual(translator.translate_many(['Friet', 'Soep'], 'nl', 'en'), ['[en] Friet', '[en] Soep'])
+        self.assertEqual(translator.translate('Friet', 'nl', 'en'), '[en] Friet')
+
+    def test_google_translate_many(self):
+        translator = GoogleTranslationService()
+        local = LocalTranslationService()
+
+        def translate(text, from_language, to_language):
+            return '\n'.join(local.translate(line, from_language, to_language) for line in text.split('\n'))
+
+        with mock.patch.object(translator, 'translate', side_effect=translate) as translate_mock:
+            with mock.patch.object(GoogleTranslationService, 'MAX_REQUEST_LENGTH', 20):
+                result = translator.translate_many(['Friet', 'Soep', 'Stoofvlees\nmet friet'], 'nl', 'en')
+
+            self.assertEqual(result, ['[en] Friet', '[en] Soep', '[en] Stoofvlees met friet'])
+
+            # Strings are combined into requests, as long as they fit
+            self.assertEqual([call.args[0] for call in translate_mock.call_args_list],
+                             ['Friet\nSoep', 'Stoofvlees met friet'])
+
+    def test_google_translate_many_mismatch(self):
+        translator = GoogleTranslationService()
+
+        def translate(text, from_language, to_language):
+            return text.replace('\n', ' ')  # Lines were merged
+
+        with mock.patch.object(translator, 'translate', side_effect=translate) as translate_mock:
+            result = translator.translate_many(['Friet', 'Soep'], 'nl', 'en')
+
+            self.assertEqual(result, ['Friet', 'Soep'])
+            self.assertEqual(translate_mock.call_count, 3)
@@ -0,0 +1,62 @@
+import threading
+
+import komidabot.models as models
+from app import db
+from tests.base import BaseTestCase
+from tests.utils import StubTranslator
+
+
+class BlockingTranslator(StubTranslator):
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def translate(self, text, from_language, to_language):
+        self.calls += 1
+        self.release.wait(10)
+
+        return super().translate(text, from_language, to_language)
+
+
+class TestTranslationFlights(BaseTestCase):
+    """
+    Test komidabot.translation_flights
+    """
+
+    def test_deadline(self):
+        with self.app.app_context():
+            translatable, _ = models.Translatable.get_or_create('Friet', 'nl')
+            db.session.commit()
+
+            translator = BlockingTranslator()
+
+            # The translator is too slow, so the original text is used
+            translation = translatable.get_translation('en', translator, deadline=0.05)
+            self.assertEqual(translation.translation, 'Friet')
+
+            # Waiting on the same translation doesn't start another call
+            translations = models.Translatable.get_translations([translatable.id], 'en', translator, deadline=0.05)
+            self.assertEqual(translations[translatable.id].translation, 'Friet')
+
+            futures = self.app.translation_flights.submit([(translatable.id, 'Friet')], 'nl', 'en', translator)
+
+            translator.release.set()
+            text = futures[translatable.id].result(timeout=10)
+
+            self.assertEqual(translator.calls, 1)
+            self.assertEqual(text, translator.translate('Friet', 'nl', 'en'))
+
+            # The translation was stored in the background
+            db.session.rollback()
+            self.assertEqual(models.Translation.find_by_id(translatable.id, 'en').translation, text)
+            self.assertEqual(translatable.get_translation('en', None, deadline=0.05).translation, text)
+
+    def test_deadline_met(self):
+        with self.app.app_context():
+            translatable, _ = models.Translatable.get_or_create('Friet', 'nl')
+            db.session.commit()
+
+            translation = translatable.get_translation('en', self.translator, deadline=10)
+
+            self.assertEqual(translation.translation, self.translator.translate('Friet', 'nl', 'en'))
+            self.assertEqual(translation.provider, self.translator.identifier)
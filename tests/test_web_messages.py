@@ -0,0 +1,37 @@
+import datetime
+
+import komidabot.models as models
+import komidabot.web.messages as web_messages
+from tests.base import BaseTestCase
+
+
+class TestWebMessages(BaseTestCase):
+    """
+    Test komidabot.web.messages
+    """
+
+    def test_menu_push_options(self):
+        with self.app.app_context():
+            campus = models.Campus('Testcampus', 'ctst')
+            date = datetime.date(2020, 2, 10)
+
+            options = web_messages.get_menu_push_options(campus, date, now=datetime.datetime(2020, 2, 10, 10, 0))
+
+            self.assertEqual(options.topic, 'menu-ctst-20200210')
+            self.assertEqual(options.ttl, 4 * 60 * 60)
+            self.assertEqual(options.urgency, web_messages.URGENCY_LOW)
+            self.assertEqual(options.get_headers(), {'Topic': 'menu-ctst-20200210', 'Urgency': 'low'})
+
+            # A topic can be at most 32 characters
+            self.assertLessEqual(len(options.topic), 32)
+
+            # Once lunch is over, the push service shouldn't keep the notification around
+            options = web_messages.get_menu_push_options(campus, date, now=datetime.datetime(2020, 2, 10, 15, 0))
+
+            self.assertEqual(options.ttl, 0)
+
+    def test_text_push_options(self):
+        options = web_messages.TEXT_PUSH_OPTIONS
+
+        self.assertIsNone(options.topic)
+        self.assertEqual(options.get_headers(), {'Urgency': 'normal'})
@@ -77,43 +77,47 @@ class MessageHandler(messages.MessageHandler):
 
     def __init__(self):
         self.message_log: Dict[users.UserId, List[str]] = dict()
+        # Results to return instead of delivering the message, or exceptions to raise, for simulating failures
+        self.forced_results: Dict[users.UserId, Union[messages.MessageSendResult, Exception]] = dict()
 
     def reset(self):
         self.message_log = dict()
+        self.forced_results = dict()
 
     def send_message(self, user, message: messages.Message) -> messages.MessageSendResult:
-        if user.id.provider != PROVIDER_ID:
-            raise ValueError('User id is not for Stub Provider')
+        text = self.prepare_message(user, message)
 
-        if isinstance(message, messages.TextMessage):
-            if user.id not in self.message_log:
-                self.message_log[user.id] = []
+        if isinstance(text, messages.MessageSendResult):
+            return text
 
-            text = message.text
+        return self.deliver_prepared(user, text)
 
-            self.message_log[user.id].append(text)
+    def prepare_message(self, user, message: messages.Message):
+        if user.id.provider != PROVIDER_ID:
+            raise ValueError('User id is not for Stub Provider')
 
-            return messages.MessageSendResult.SUCCESS
+        if isinstance(message, messages.TextMessage):
+            return message.text
         elif isinstance(message, messages.MenuMessage):
-            if user.id not in self.message_log:
-                self.message_log[user.id] = []
-
-            text = komidabot.menu.get_menu_text(message.menu, message.translator, user.get_locale())
-
-            self.message_log[user.id].append(text)
-
-            return messages.MessageSendResult.SUCCESS
+            return komidabot.menu.get_menu_text(message.menu, message.translator, user.get_locale())
         elif isinstance(message, messages.SubscriptionMenuMessage):
-            if user.id not in self.message_log:
-                self.message_log[user.id] = []
-
             campus = user.get_campus_for_day(message.date)
             menu = Menu.get_menu(campus, message.date)
 
-            text = komidabot.menu.get_menu_text(menu, message.translator, user.get_locale())
-
-            self.message_log[user.id].append(text)
-
-            return messages.MessageSendResult.SUCCESS
+            return komidabot.menu.get_menu_text(menu, message.translator, user.get_locale())
         else:
             return messages.MessageSendResult.UNSUPPORTED
+
+    def deliver_prepared(self, user, text: str) -> messages.MessageSendResult:
+        if user.id in self.forced_results:
+            if isinstance(self.forced_results[user.id], Exception):
+                raise self.forced_results[user.id]
+
+            return self.forced_results[user.id]
+
+        if user.id not in self.message_log:
+            self.message_log[user.id] = []
+
+        self.message_log[user.id].append(text)
+
+        return messages.MessageSendResult.SUCCESS